@@ -0,0 +1,44 @@
+from glisse.effects import Command, EffectCache, EffectError, EffectRunner, command
+from glisse.engine import Context, Crossing, Engine, Phase, Promotion, PromotionError, effect_key
+from glisse.journal import Journal, JournalError
+from glisse.pipeline import (
+    Branch,
+    Chain,
+    Guard,
+    Hook,
+    Pipeline,
+    PipelineError,
+    Transition,
+    branch,
+    combine,
+    guard,
+    transition,
+)
+
+__all__ = [
+    "Branch",
+    "Chain",
+    "Command",
+    "Context",
+    "Crossing",
+    "EffectCache",
+    "EffectError",
+    "EffectRunner",
+    "Engine",
+    "Guard",
+    "Hook",
+    "Journal",
+    "JournalError",
+    "Phase",
+    "Pipeline",
+    "PipelineError",
+    "Promotion",
+    "PromotionError",
+    "Transition",
+    "branch",
+    "combine",
+    "command",
+    "effect_key",
+    "guard",
+    "transition",
+]
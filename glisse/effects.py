@@ -0,0 +1,201 @@
+"""Running ``when_merged`` hooks.
+
+A hook is called with the merge ``Context`` and may return:
+
+* ``None`` or any plain value, when it did its work inline;
+* an awaitable, which is awaited;
+* a ``Command`` (see ``command``), which is spawned as a subprocess.
+
+``EffectRunner`` runs hooks on the event loop with at most ``concurrency``
+of them in flight, so a slow hook only holds up its own promotion.
+
+With a coalescing ``window`` (seconds), the first trigger of a hook on a
+target branch opens a batch; further triggers of the same hook on the same
+branch until the window closes only replace the batch context.  The hook
+then runs once, against the context of the last merge, and every trigger
+gets that result.
+
+Hooks registered with a ``cache`` name are looked up in an ``EffectCache``
+by (name, merged tree) first; a tree that name already succeeded on, as
+after a fast-forward to the next stage, is not processed again.
+"""
+
+import asyncio
+import inspect
+import shelve
+import shlex
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Mapping, NamedTuple
+
+
+class Command(NamedTuple):
+    argv: tuple[str, ...]
+    cwd: str | None = None
+    env: Mapping[str, str] | None = None
+    check: bool = True
+
+
+def command(*argv: str, cwd: str | None = None, env: Mapping[str, str] | None = None, check: bool = True) -> Command:
+    """``command("bumpversion --tag")`` or ``command("bumpversion", "--tag")``."""
+    if len(argv) == 1:
+        argv = tuple(shlex.split(argv[0]))
+    return Command(tuple(argv), cwd, env, check)
+
+
+class EffectError(Exception):
+    def __init__(self, result: subprocess.CompletedProcess):
+        self.result = result
+        super().__init__(f"{shlex.join(result.args)} exited with status {result.returncode}")
+
+
+class EffectCache:
+    """Successful hook results by (cache name, tree id).
+
+    In memory by default, keeping the ``max_entries`` most recently used
+    results.  With ``path`` the results (which must pickle) are kept in a
+    ``shelve`` database, without a limit, and survive restarts.
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = 4096):
+        self._data = OrderedDict() if path is None else shelve.open(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, name: str, tree: bytes):
+        """``(True, result)`` for a recorded result, ``(False, None)`` otherwise."""
+        key = _cache_key(name, tree)
+        with self._lock:
+            try:
+                result = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            if isinstance(self._data, OrderedDict):
+                self._data.move_to_end(key)
+            self.hits += 1
+            return True, result
+
+    def put(self, name: str, tree: bytes, result) -> None:
+        key = _cache_key(name, tree)
+        with self._lock:
+            data = self._data
+            data[key] = result
+            if isinstance(data, OrderedDict):
+                data.move_to_end(key)
+                while len(data) > self.max_entries:
+                    data.popitem(last=False)
+
+    def close(self) -> None:
+        if isinstance(self._data, shelve.Shelf):
+            self._data.close()
+
+
+def _cache_key(name: str, tree: bytes) -> str:
+    return f"{name}:{tree.hex()}"
+
+
+class _Batch:
+    __slots__ = ("ctx", "task")
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.task = None
+
+
+class EffectRunner:
+    def __init__(self, concurrency: int = 8, window: float = 0.0, cache: EffectCache | None = None):
+        self.concurrency = concurrency
+        self.window = window
+        self.cache = cache if cache is not None else EffectCache()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._batches: dict[tuple, _Batch] = {}
+
+    async def run(self, hook, ctx):
+        if self.window <= 0:
+            return await self._run(hook, ctx)
+        slot = (ctx.target, hook)
+        batch = self._batches.get(slot)
+        if batch is None:
+            batch = self._batches[slot] = _Batch(ctx)
+            batch.task = asyncio.ensure_future(self._flush(slot, hook, batch))
+        else:
+            batch.ctx = ctx
+        return await asyncio.shield(batch.task)
+
+    async def _flush(self, slot, hook, batch):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            del self._batches[slot]
+        return await self._run(hook, batch.ctx)
+
+    async def _run(self, hook, ctx):
+        cached, result = self._cached(hook, ctx)
+        if cached:
+            return result
+        async with self._sem:
+            result = hook(ctx)
+            if isinstance(result, Command):
+                result = await _spawn(result)
+            elif inspect.isawaitable(result):
+                result = await result
+        self._store(hook, ctx, result)
+        return result
+
+    def run_sync(self, hook, ctx):
+        """Run ``hook`` outside an event loop, blocking until it is done.
+
+        There is nothing to coalesce with here, so ``window`` is ignored.
+        """
+        cached, result = self._cached(hook, ctx)
+        if cached:
+            return result
+        result = hook(ctx)
+        if isinstance(result, Command):
+            result = _check(result, subprocess.run(
+                result.argv, cwd=result.cwd, env=result.env,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            ))
+        elif inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        self._store(hook, ctx, result)
+        return result
+
+    def _cached(self, hook, ctx):
+        name = getattr(hook, "cache", None)
+        if name is None or ctx.tree is None:
+            return False, None
+        return self.cache.get(name, ctx.tree)
+
+    def _store(self, hook, ctx, result) -> None:
+        name = getattr(hook, "cache", None)
+        if name is not None and ctx.tree is not None:
+            self.cache.put(name, ctx.tree, result)
+
+
+async def _spawn(cmd: Command) -> subprocess.CompletedProcess:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd.argv, cwd=cmd.cwd, env=cmd.env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        out, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+        raise
+    return _check(cmd, subprocess.CompletedProcess(cmd.argv, proc.returncode, out))
+
+
+def _check(cmd: Command, result: subprocess.CompletedProcess) -> subprocess.CompletedProcess:
+    if cmd.check and result.returncode:
+        raise EffectError(result)
+    return result
@@ -0,0 +1,959 @@
+"""Promotion state machine.
+
+A promotion walks a pipeline one stage at a time::
+
+    prom-start a [a>b>c] nil
+    prom a [a>b>c] nil
+    prom-merge a b
+    prom-eff (eff a b)
+    prom b [b>c] [b':b]
+    ...
+    prom-end c [c':c, b':b]
+
+Each phase maps to a handler in ``_STEP``; stepping is a table lookup that
+returns the next ``Promotion`` record.
+
+In a pipeline with fan-out, the promotion goes on to the first successor
+and forks one promotion per other successor; together they form a group.
+A fan-in stage is claimed by whichever member of the group settles the
+last of its predecessors, and that member merges all of them into it.
+"""
+
+import asyncio
+import hashlib
+import struct
+import threading
+from enum import IntEnum
+from typing import NamedTuple, Protocol
+
+from glisse.effects import EffectRunner
+from glisse.history import History, HistoryStore
+from glisse.journal import Journal, Op
+from glisse.oid import SHA1_SIZE
+from glisse.pipeline import Branch, Pipeline
+
+
+class Phase(IntEnum):
+    START = 0
+    PROM = 1
+    MERGE = 2
+    EFF = 3
+    END = 4
+
+
+_LABELS = {
+    Phase.START: "prom-start",
+    Phase.PROM: "prom",
+    Phase.MERGE: "prom-merge",
+    Phase.EFF: "prom-eff",
+    Phase.END: "prom-end",
+}
+
+
+class Backend(Protocol):
+    oid_size: int
+
+    def tip(self, branch: str) -> bytes:
+        """Commit at the tip of ``branch``."""
+
+    def tree(self, commit: bytes) -> bytes:
+        """Root tree of ``commit``."""
+
+    def merge(self, source: str, target: str, fast_forward_only: bool = False) -> bytes:
+        """Merge ``source`` into ``target``, advance ``target`` and return its new tip.
+
+        Must be a no-op returning the current tip when ``target`` already
+        contains ``source``: a merge interrupted before its journal record
+        is written is retried on recovery.  With ``fast_forward_only``, must
+        fail rather than create a merge commit.
+        """
+
+    def touches(self, base: bytes | None, commit: bytes, paths: tuple[str, ...]) -> bool:
+        """Whether a commit in ``commit`` but not in ``base`` changes a path matching ``paths``.
+
+        Only called for transitions and hooks declared with ``paths``.
+        """
+
+    def branches(self, pattern: str) -> list[str]:
+        """Names of the branches matching glob ``pattern``.
+
+        Only called for pattern stages such as ``branch("release/*")``.
+        """
+
+
+class Context(NamedTuple):
+    """Argument handed to ``when_merged`` hooks."""
+
+    pipeline: Pipeline
+    source: Branch
+    target: Branch
+    commit: bytes
+    key: bytes
+    """Idempotency key of this effect, see ``effect_key``."""
+    tree: bytes | None = None
+    """Root tree of ``commit``; only looked up when a hook of ``target`` is cached."""
+
+
+class Crossing(NamedTuple):
+    """Argument handed to transition guards."""
+
+    pipeline: Pipeline
+    source: Branch
+    target: Branch
+    commit: bytes | None
+    """Tip of ``source``; ``None`` when it is a pattern stage."""
+
+
+class Promotion(NamedTuple):
+    id: int
+    pipeline: Pipeline
+    phase: Phase
+    stage: int
+    target: int
+    history: History
+    merged: bytes | None = None
+    # Target tip before the merge; only looked up when a hook of the target
+    # is path-scoped.
+    base: bytes | None = None
+    # Id of the promotion this one was forked from, or its own.
+    group: int = 0
+    # Stages a transition guard keeps this promotion from entering; it
+    # stays in prom and checks them again on its next step.
+    blocked: tuple[int, ...] = ()
+
+    @property
+    def branch(self) -> Branch:
+        return self.pipeline.stages[self.stage]
+
+    @property
+    def remaining(self) -> tuple[Branch, ...]:
+        """Stages ahead, through the current target and then first successors."""
+        stages, succ = self.pipeline.stages, self.pipeline.succ
+        out, i = [stages[self.stage]], self.target
+        if i < 0:
+            i = succ[self.stage][0] if succ[self.stage] else -1
+        while i >= 0:
+            out.append(stages[i])
+            i = succ[i][0] if succ[i] else -1
+        return tuple(out)
+
+    def __repr__(self):
+        chain = ">".join(b.name for b in self.remaining)
+        blocked = ""
+        if self.blocked:
+            blocked = " blocked:" + ",".join(self.pipeline.stages[i].name for i in self.blocked)
+        return f"<{_LABELS[self.phase]} {self.branch.name} [{chain}] {self.history!r}{blocked}>"
+
+
+class PromotionError(Exception):
+    pass
+
+
+# Stage states within a group, see ``_Group.status``.
+_DONE, _READY, _WAITING, _SKIPPED = "done", "ready", "waiting", "skipped"
+
+
+class _Group:
+    """Progress of a promotion and the promotions forked from it."""
+
+    __slots__ = ("start", "done", "claimed", "rejected", "blocked", "live")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.done = {start}
+        # Stages a member has taken on but not finished yet.
+        self.claimed: set[int] = set()
+        # Edges whose path filter the promoted commits did not match.
+        self.rejected: set[tuple[int, int]] = set()
+        # Edges a transition guard is holding back; not journaled, since the
+        # promotion at their source checks them again after recovery.
+        self.blocked: set[tuple[int, int]] = set()
+        self.live = 0
+
+    def status(self, pipeline: Pipeline, stage: int, memo: dict) -> str:
+        """Whether ``stage`` is done, ready to merge, waiting on a predecessor, or skipped.
+
+        Only predecessors downstream of the group's start count; a stage
+        whose inputs all settled without one to merge is skipped.  A stage
+        behind a blocked edge waits.
+        """
+        reach = pipeline.reachable(self.start)
+        stack = [stage]
+        while stack:
+            s = stack[-1]
+            if s in memo:
+                stack.pop()
+                continue
+            if s in self.done:
+                memo[stack.pop()] = _DONE
+                continue
+            preds = [q for q in pipeline.pred[s] if q in reach]
+            missing = [q for q in preds if q not in memo]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            if any(memo[q] is _READY or memo[q] is _WAITING or (q, s) in self.blocked for q in preds):
+                memo[s] = _WAITING
+            elif any(memo[q] is _DONE and (q, s) not in self.rejected for q in preds):
+                memo[s] = _READY
+            else:
+                memo[s] = _SKIPPED
+        return memo[stage]
+
+
+def effect_key(pipeline: Pipeline, stage: int, commit: bytes, hook: str) -> bytes:
+    """Identify one run of the hook called ``hook`` of ``stage`` for a merged ``commit``.
+
+    ``hook`` is the hook's ``name``, followed by ``#n`` for the ``n``-th
+    hook of that name on the stage, so keys survive hooks being added,
+    removed or reordered between a crash and the restart.  Only hooks
+    sharing a name, such as lambdas, are told apart by their order.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pipeline.digest)
+    h.update(_STAGE.pack(stage))
+    h.update(commit)
+    h.update(hook.encode())
+    return h.digest()
+
+
+class Engine:
+    """Steps promotions against a backend.
+
+    With a ``journal``, every prom-start, prom-merge, prom-eff and prom-end
+    transition is made durable before ``start``/``step`` return, and
+    ``recover`` rebuilds the in-flight promotions after a restart.
+    Pipelines are identified in the journal by their ``digest``, so they
+    must be passed in (or started once) before recovering.  When
+    path-scoped hooks or edges depend on the target tip before a merge,
+    that tip is journaled before the merge starts, so a merge retried on
+    recovery still compares against it.
+
+    ``checkpoint`` snapshots the live promotions and folds finished ones
+    into a summary segment so that startup only replays the journal tail;
+    with ``checkpoint_every`` it runs after that many journaled transitions.
+    It also moves the live histories to a fresh ``history`` store, which
+    frees the cells of finished promotions once nothing else holds them.
+
+    Each ``when_merged`` hook that completes is journaled under its
+    ``effect_key``, so a promotion recovered in prom-eff only runs the hooks
+    that had not finished.
+
+    Promotions forked at a fan-out are added to ``live``; ``run`` and
+    ``arun`` step them along with the promotion they were forked from.
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        journal: Journal | None = None,
+        pipelines=(),
+        checkpoint_every: int | None = None,
+        runner: EffectRunner | None = None,
+    ):
+        self.backend = backend
+        self.runner = runner if runner is not None else EffectRunner()
+        self.journal = journal
+        self.pipelines: dict[str, Pipeline] = {p.name: p for p in pipelines}
+        self._digests: dict[bytes, Pipeline] = {}
+        self.history = HistoryStore(getattr(backend, "oid_size", SHA1_SIZE))
+        self.live: dict[int, Promotion] = {}
+        self.groups: dict[int, _Group] = {}
+        # Forked promotions not yet picked up by ``run``/``arun``, by group.
+        self._forked: dict[int, list[Promotion]] = {}
+        # Keys of effects already run for promotions in prom-eff.
+        self.effects: dict[int, set[bytes]] = {}
+        self.checkpoint_every = checkpoint_every
+        self._next_id = 1
+        self._logged = 0
+        # Serializes changes to ``live`` with their journal records, so a
+        # checkpoint never sees a state whose record lands after the rotation.
+        self._lock = threading.Lock()
+
+    def start(self, pipeline: Pipeline, branch: str) -> Promotion:
+        p, lsn = self._open(pipeline, branch)
+        self._sync(lsn)
+        return p
+
+    async def astart(self, pipeline: Pipeline, branch: str) -> Promotion:
+        """``start`` for an asyncio daemon: the journal sync runs in a worker thread."""
+        p, lsn = self._open(pipeline, branch)
+        if lsn:
+            await asyncio.to_thread(self._sync, lsn)
+        return p
+
+    def _open(self, pipeline: Pipeline, branch: str) -> tuple[Promotion, int]:
+        self.pipelines.setdefault(pipeline.name, pipeline)
+        stage = pipeline.index[branch]
+        with self._lock:
+            p = Promotion(
+                self._next_id, pipeline, Phase.START, stage, -1, self.history.nil, group=self._next_id
+            )
+            self._next_id += 1
+            self.live[p.id] = p
+            group = self.groups[p.id] = _Group(stage)
+            group.live = 1
+            lsn = self._log(_log_start(p))
+        return p, lsn
+
+    def step(self, p: Promotion) -> Promotion:
+        try:
+            handler = _STEP[p.phase]
+        except KeyError:
+            raise PromotionError(f"promotion {p.id} already ended") from None
+        done = p.phase
+        p = handler(self, p)
+        self._sync(self._commit(done, p))
+        return p
+
+    async def astep(self, p: Promotion) -> Promotion:
+        """``step`` for an asyncio daemon.
+
+        Merges and journal syncs run in worker threads and hooks go through
+        ``runner``, so a slow promotion does not hold up the others.  The
+        hooks of a merge target run concurrently rather than one by one.
+        """
+        handler = _ASTEP.get(p.phase)
+        if handler is None:
+            return self.step(p)
+        done = p.phase
+        p = await handler(self, p)
+        lsn = self._commit(done, p)
+        if lsn:
+            await asyncio.to_thread(self._sync, lsn)
+        return p
+
+    async def arun(self, p: Promotion) -> Promotion:
+        """``run`` with the promotions forked on the way stepped concurrently.
+
+        The walks share a task group: when one fails the others are
+        cancelled before its exception is raised.  A merge already running
+        in a worker thread finishes, but its step is not committed, so
+        the promotion stays live and retries it when run again.
+        """
+        blocked, ended = [], []
+
+        async def walk(q):
+            while q.phase is not Phase.END:
+                q = await self.astep(q)
+                for child in self._take_forks(q.group):
+                    walks.create_task(walk(child))
+                if q.blocked:
+                    break
+            (blocked if q.blocked else ended).append(q)
+
+        try:
+            async with asyncio.TaskGroup() as walks:
+                walks.create_task(walk(p))
+        except BaseExceptionGroup as group:
+            raise group.exceptions[0] from None
+        return blocked[-1] if blocked else ended[-1]
+
+    def recover(self) -> list[Promotion]:
+        """Replay the journal and return the promotions that were still in flight."""
+        last = 0
+        for op, payload in self.journal.replay():
+            last = max(last, _REPLAY[op](self, payload))
+        self._next_id = max(self._next_id, last + 1)
+        return list(self.live.values())
+
+    def checkpoint(self) -> None:
+        """Snapshot live promotions, summarize finished ones and drop old segments."""
+        journal = self.journal
+        with self._lock:
+            prev = journal.snapshot_seq()
+            seq = journal.rotate()
+            snapshot = [(Op.SNAPSHOT, _SNAPSHOT.pack(self._next_id))]
+            snapshot.extend(_log_group(gid, g) for gid, g in self.groups.items())
+            for p in self.live.values():
+                snapshot.extend(_snapshot(p, self.effects.get(p.id, ())))
+            # Leave the cells of finished promotions behind.
+            live = list(self.live.values())
+            self.history, copies = self.history.compacted(p.history for p in live)
+            for p, history in zip(live, copies):
+                self.live[p.id] = p._replace(history=history)
+        # Summaries newer than the snapshot come from an interrupted
+        # checkpoint; the one written now covers the same segments.
+        journal.drop_summaries(after=prev)
+        summary = list(self._summarize(prev, seq))
+        if summary:
+            journal.write_summary(seq, summary)
+        journal.write_snapshot(seq, snapshot)
+        journal.retire(seq)
+
+    def effect_done(self, p: Promotion, key: bytes) -> None:
+        """Durably record that the effect ``key`` of ``p`` completed."""
+        self._sync(self._effect_done(p, key))
+
+    def run(self, p: Promotion) -> Promotion:
+        """Step ``p`` and the promotions forked from it to the end.
+
+        A promotion held back by a transition guard stops in prom with
+        ``blocked`` set; running it again checks the guards again.  Returns
+        a blocked promotion if one was left, else the one that ended last.
+        """
+        todo, blocked = [p], None
+        while todo:
+            p = todo.pop()
+            while p.phase is not Phase.END:
+                p = self.step(p)
+                todo.extend(self._take_forks(p.group))
+                if p.blocked:
+                    blocked = p
+                    break
+        return blocked or p
+
+    def blocked(self) -> list[Promotion]:
+        """Live promotions held back by a transition guard."""
+        with self._lock:
+            return [p for p in self.live.values() if p.blocked]
+
+    def _commit(self, done: Phase, p: Promotion) -> int:
+        """Store ``p`` as the state after running ``done`` and journal the transition."""
+        with self._lock:
+            if p.phase is Phase.END:
+                self.live.pop(p.id, None)
+                self._leave(p.group)
+                done = Phase.END
+            elif done is Phase.MERGE and p.phase is Phase.PROM:
+                # Nothing was merged, see ``_unmerged``.
+                self.live[p.id] = p
+                done = Phase.PROM
+            else:
+                self.live[p.id] = p
+            if done is Phase.EFF:
+                self.effects.pop(p.id, None)
+                self.groups[p.group].done.add(p.stage)
+            log = _LOG.get(done)
+            return self._log(log(p)) if log is not None else 0
+
+    def _advance(self, p: Promotion, rejected, blocked=()) -> list[int]:
+        """Claim the stages ``p`` leads to that are ready; fork for all but the first.
+
+        ``rejected`` are the edges out of ``p.stage`` whose path filter did
+        not match.  Stages that end up skipped are looked through, so a
+        fan-in behind them is not left waiting.  ``blocked`` are the edges
+        a guard holds back; with any of them ``p`` stays where it is and
+        every claimed stage gets a fork.
+        """
+        pipeline = p.pipeline
+        with self._lock:
+            group = self.groups[p.group]
+            for src, dst in rejected:
+                if (src, dst) not in group.rejected:
+                    group.rejected.add((src, dst))
+                    self._log((Op.SKIP, _SKIP.pack(p.group, src, dst)))
+            group.blocked = {e for e in group.blocked if e[0] != p.stage}
+            group.blocked.update(blocked)
+            memo = {}
+            targets, todo, seen = [], list(pipeline.succ[p.stage]), set()
+            for t in todo:
+                if t in seen:
+                    continue
+                seen.add(t)
+                status = group.status(pipeline, t, memo)
+                if status is _READY and t not in group.claimed:
+                    group.claimed.add(t)
+                    targets.append(t)
+                elif status is _SKIPPED:
+                    todo.extend(pipeline.succ[t])
+            for t in targets if blocked else targets[1:]:
+                child = Promotion(
+                    self._next_id, pipeline, Phase.MERGE, p.stage, t, p.history, group=p.group
+                )
+                self._next_id += 1
+                self.live[child.id] = child
+                group.live += 1
+                self._log((Op.FORK, _FORK.pack(child.id, p.id, t)))
+                self._forked.setdefault(p.group, []).append(child)
+        return targets
+
+    def _unmerged(self, p: Promotion) -> Promotion:
+        """Give up ``p.target``, which had nothing to merge: it counts as skipped from now on."""
+        with self._lock:
+            group = self.groups[p.group]
+            group.claimed.discard(p.target)
+            for src in p.pipeline.pred[p.target]:
+                if (src, p.target) not in group.rejected:
+                    group.rejected.add((src, p.target))
+                    self._log((Op.SKIP, _SKIP.pack(p.group, src, p.target)))
+        return p._replace(phase=Phase.PROM, target=-1, base=None)
+
+    def _unsettled(self, p: Promotion) -> list[int]:
+        """Successors of ``p.stage`` its group has not claimed, finished or rejected."""
+        with self._lock:
+            group = self.groups[p.group]
+            return [
+                t for t in p.pipeline.succ[p.stage]
+                if t not in group.claimed and t not in group.done and (p.stage, t) not in group.rejected
+            ]
+
+    def _sources(self, p: Promotion) -> list[int]:
+        """Stages to merge into ``p.target``: its done predecessors whose edge was not rejected."""
+        with self._lock:
+            group = self.groups[p.group]
+            return [
+                q for q in p.pipeline.pred[p.target]
+                if q in group.done and (q, p.target) not in group.rejected
+            ]
+
+    def _take_forks(self, group: int) -> list[Promotion]:
+        with self._lock:
+            return self._forked.pop(group, [])
+
+    def _leave(self, gid: int) -> None:
+        group = self.groups.get(gid)
+        if group is not None:
+            group.live -= 1
+            if group.live <= 0:
+                del self.groups[gid]
+                self._forked.pop(gid, None)
+
+    def _intend(self, p: Promotion) -> None:
+        """Durably record the target tip ``p`` is about to merge into."""
+        with self._lock:
+            self.live[p.id] = p
+            lsn = self._log(_log_intent(p))
+        self._sync(lsn)
+
+    def _effect_done(self, p: Promotion, key: bytes) -> int:
+        with self._lock:
+            self.effects.setdefault(p.id, set()).add(key)
+            return self._log((Op.EFFECT, _EFFECT.pack(p.id) + key))
+
+    def _log(self, record) -> int:
+        if self.journal is None:
+            return 0
+        self._logged += 1
+        return self.journal.append(*record)
+
+    def _sync(self, lsn: int) -> None:
+        if not lsn:
+            return
+        self.journal.sync(lsn)
+        if self.checkpoint_every and self._logged >= self.checkpoint_every:
+            with self._lock:
+                due, self._logged = self._logged >= self.checkpoint_every, 0
+            if due:
+                self.checkpoint()
+
+    def _summarize(self, prev: int, seq: int):
+        """Summary records for promotions that ended in segments ``prev`` .. ``seq - 1``."""
+        journal = self.journal
+        sources = [journal.records(prev, ".snap")] if prev else []
+        sources += [journal.records(s) for s in journal.segments() if prev <= s < seq]
+        started = {}
+        for records in sources:
+            for op, payload in records:
+                if op is Op.START:
+                    pid, _ = _START.unpack_from(payload)
+                    started[pid] = (payload[_START.size:_START.size + _DIGEST], [])
+                elif op is Op.FORK:
+                    pid, parent, _ = _FORK.unpack_from(payload)
+                    if parent in started:
+                        digest, steps = started[parent]
+                        started[pid] = (digest, list(steps))
+                elif op is Op.EFF:
+                    pid, stage = _EFF.unpack_from(payload)
+                    if pid in started:
+                        started[pid][1].append(_STAGE.pack(stage) + payload[_EFF.size:])
+                elif op is Op.END:
+                    (pid,) = _END.unpack_from(payload)
+                    if pid in started:
+                        digest, steps = started.pop(pid)
+                        head = _SUMMARY.pack(pid, len(steps))
+                        yield Op.SUMMARY, head + digest + b"".join(steps)
+
+
+def _start(engine, p):
+    return p._replace(phase=Phase.PROM)
+
+
+def _prom(engine, p):
+    pipeline, backend = p.pipeline, engine.backend
+    names = _names(engine, p.branch)
+    rejected, blocked = [], []
+    for t in engine._unsettled(p):
+        edge = pipeline.transitions[(p.stage, t)]
+        if not names:
+            rejected.append((p.stage, t))
+            continue
+        if edge.paths is not None:
+            target_tip = backend.tip(pipeline.stages[t].name)
+            if not any(backend.touches(target_tip, backend.tip(n), edge.paths) for n in names):
+                rejected.append((p.stage, t))
+                continue
+        if edge.guards and not _guarded(engine, p, t, edge.guards):
+            blocked.append((p.stage, t))
+    targets = engine._advance(p, rejected, blocked)
+    if blocked:
+        return p._replace(blocked=tuple(t for _, t in blocked))
+    if not targets:
+        return p._replace(phase=Phase.END, blocked=())
+    return p._replace(phase=Phase.MERGE, target=targets[0], blocked=())
+
+
+def _merge(engine, p):
+    stages, transitions = p.pipeline.stages, p.pipeline.transitions
+    target = stages[p.target]
+    base = p.base
+    if base is None and _needs_base(p):
+        # Durable before the ref can move: a merge retried on recovery
+        # would otherwise read a base that already contains it.
+        base = engine.backend.tip(target.name)
+        engine._intend(p._replace(base=base))
+    before = base if base is not None else engine.backend.tip(target.name)
+    commit = None
+    for src in engine._sources(p):
+        ff_only = transitions[(src, p.target)].fast_forward_only
+        for name in _names(engine, stages[src]):
+            commit = engine.backend.merge(name, target.name, ff_only)
+    if commit is None:
+        # The branches a pattern matched in prom are gone.
+        return engine._unmerged(p)
+    if commit != before:
+        with engine._lock:
+            target.merges += 1
+    return p._replace(phase=Phase.EFF, merged=commit, base=base)
+
+
+def _eff(engine, p):
+    target = p.pipeline.stages[p.target]
+    tree = engine.backend.tree(p.merged) if _cached(target) else None
+    for hook, ctx in _pending_effects(engine, p, tree, _unchanged(engine, p)):
+        engine.runner.run_sync(hook, ctx)
+        engine.effect_done(p, ctx.key)
+    return _promoted(p)
+
+
+async def _aprom(engine, p):
+    transitions = p.pipeline.transitions
+    edges = [transitions[(p.stage, t)] for t in p.pipeline.succ[p.stage]]
+    if p.branch.pattern or any(e.paths is not None or e.guards for e in edges):
+        return await asyncio.to_thread(_prom, engine, p)
+    return _prom(engine, p)
+
+
+async def _amerge(engine, p):
+    return await asyncio.to_thread(_merge, engine, p)
+
+
+async def _aeff(engine, p):
+    target = p.pipeline.stages[p.target]
+    tree = None
+    if _cached(target):
+        tree = await asyncio.to_thread(engine.backend.tree, p.merged)
+    skip = ()
+    if _scoped(target):
+        skip = await asyncio.to_thread(_unchanged, engine, p)
+
+    async def run(hook, ctx):
+        await engine.runner.run(hook, ctx)
+        lsn = engine._effect_done(p, ctx.key)
+        if lsn:
+            await asyncio.to_thread(engine._sync, lsn)
+
+    # Started together, so each hook's coalescing window runs alongside
+    # the others'; the first failure is raised once all of them are done.
+    results = await asyncio.gather(
+        *(run(hook, ctx) for hook, ctx in _pending_effects(engine, p, tree, skip)),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return _promoted(p)
+
+
+def _pending_effects(engine, p, tree, skip):
+    """``(hook, ctx)`` for the hooks of the merge target that have not run yet."""
+    source, target = p.pipeline.stages[p.stage], p.pipeline.stages[p.target]
+    done = engine.effects.get(p.id, ())
+    named = {}
+    for i, hook in enumerate(target._hooks):
+        name = hook.name
+        n = named[name] = named.get(name, -1) + 1
+        if i in skip:
+            continue
+        key = effect_key(p.pipeline, p.target, p.merged, f"{name}#{n}")
+        if key not in done:
+            yield hook, Context(p.pipeline, source, target, p.merged, key, tree)
+
+
+def _unchanged(engine, p):
+    """Indices of the path-scoped hooks of the target whose paths the merge left alone."""
+    if p.base is None:
+        # Journaled without a base: run every hook rather than guess.
+        return ()
+    hooks = p.pipeline.stages[p.target]._hooks
+    return {
+        i
+        for i, hook in enumerate(hooks)
+        if hook.paths is not None and not engine.backend.touches(p.base, p.merged, hook.paths)
+    }
+
+
+def _guarded(engine, p, t, guards):
+    """Whether every guard of the edge to stage ``t`` passes; stops at the first failure."""
+    source, target = p.branch, p.pipeline.stages[t]
+    commit = None if source.pattern else engine.backend.tip(source.name)
+    crossing = Crossing(p.pipeline, source, target, commit)
+    return all(g(crossing) for g in guards)
+
+
+def _names(engine, branch):
+    """Branches a stage stands for: its matches if it is a pattern, else itself."""
+    return engine.backend.branches(branch.name) if branch.pattern else (branch.name,)
+
+
+def _needs_base(p):
+    """Whether the pre-merge target tip decides anything: path-scoped hooks or edges."""
+    pipeline = p.pipeline
+    if _scoped(pipeline.stages[p.target]):
+        return True
+    return any(pipeline.transitions[(s, p.target)].paths is not None for s in pipeline.pred[p.target])
+
+
+def _cached(branch):
+    return any(hook.cache is not None for hook in branch._hooks)
+
+
+def _scoped(branch):
+    return any(hook.paths is not None for hook in branch._hooks)
+
+
+def _promoted(p):
+    return p._replace(
+        phase=Phase.PROM,
+        stage=p.target,
+        target=-1,
+        history=p.history.cons(p.merged, p.pipeline.stages[p.target].name),
+        merged=None,
+        base=None,
+    )
+
+
+_STEP = {
+    Phase.START: _start,
+    Phase.PROM: _prom,
+    Phase.MERGE: _merge,
+    Phase.EFF: _eff,
+}
+
+# Phases that block; the others are shared with ``_STEP``.
+_ASTEP = {
+    Phase.PROM: _aprom,
+    Phase.MERGE: _amerge,
+    Phase.EFF: _aeff,
+}
+
+
+# Journal records: fixed fields, then a tail (pipeline digest, or merged
+# object id followed by the pre-merge target tip if it was read).
+_START = struct.Struct("<QI")
+_DIGEST = 16
+_MERGE = struct.Struct("<QII")
+_EFF = struct.Struct("<QI")
+_END = struct.Struct("<Q")
+_SNAPSHOT = struct.Struct("<Q")
+_EFFECT = struct.Struct("<Q")
+# Summary of a finished promotion: id, number of steps, then the pipeline
+# digest and one (stage:u32, object id) pair per promoted stage.
+_SUMMARY = struct.Struct("<QI")
+_STAGE = struct.Struct("<I")
+# Promotion forked from a parent (in prom at its current stage) to a target.
+_FORK = struct.Struct("<QQI")
+# Path-filtered edge of a group: group, source stage, target stage.
+_SKIP = struct.Struct("<QII")
+# Snapshot of a group: id, start stage, number of done stages, then the done
+# stages and the rejected edges as (source, target) pairs.
+_GROUP = struct.Struct("<QIH")
+_EDGE = struct.Struct("<II")
+# Snapshot: promotion joins a group other than its own.
+_JOIN = struct.Struct("<QQ")
+# Merge about to start: id, stage, target, then the target tip before it.
+_INTENT = struct.Struct("<QII")
+
+
+def _log_start(p):
+    return Op.START, _START.pack(p.id, p.stage) + p.pipeline.digest
+
+
+def _log_merge(p):
+    return Op.MERGE, _MERGE.pack(p.id, p.stage, p.target) + p.merged + (p.base or b"")
+
+
+def _log_intent(p):
+    return Op.INTENT, _INTENT.pack(p.id, p.stage, p.target) + p.base
+
+
+def _log_eff(p):
+    return Op.EFF, _EFF.pack(p.id, p.stage) + p.history.head.oid
+
+
+def _log_end(p):
+    return Op.END, _END.pack(p.id)
+
+
+def _log_group(gid, group):
+    head = _GROUP.pack(gid, group.start, len(group.done))
+    done = b"".join(_STAGE.pack(s) for s in sorted(group.done))
+    edges = b"".join(_EDGE.pack(*e) for e in sorted(group.rejected))
+    return Op.GROUP, head + done + edges
+
+
+def _snapshot(p, effects):
+    """The shortest record sequence that replays to ``p``.
+
+    Follows the ``Op.GROUP`` records of the live groups.
+    """
+    yield _log_start(p)
+    if p.group != p.id:
+        yield Op.JOIN, _JOIN.pack(p.id, p.group)
+    index = p.pipeline.index
+    for entry in reversed(list(p.history)):
+        yield Op.EFF, _EFF.pack(p.id, index[entry.branch]) + entry.oid
+    if p.phase is Phase.MERGE and p.base is not None:
+        yield _log_intent(p)
+    if p.phase is Phase.EFF:
+        yield _log_merge(p)
+        for key in effects:
+            yield Op.EFFECT, _EFFECT.pack(p.id) + key
+
+
+# Keyed by the phase that was just executed.
+_LOG = {
+    Phase.MERGE: _log_merge,
+    Phase.EFF: _log_eff,
+    Phase.END: _log_end,
+}
+
+
+def _replay_start(engine, payload):
+    pid, stage = _START.unpack_from(payload)
+    digest = payload[_START.size:_START.size + _DIGEST]
+    pipeline = engine._digests.get(digest)
+    if pipeline is None:
+        engine._digests = {p.digest: p for p in engine.pipelines.values()}
+        pipeline = engine._digests.get(digest)
+        if pipeline is None:
+            raise PromotionError(f"journal refers to unknown pipeline {digest.hex()}")
+    engine.live[pid] = Promotion(pid, pipeline, Phase.START, stage, -1, engine.history.nil, group=pid)
+    group = engine.groups.get(pid)
+    if group is None:
+        group = engine.groups[pid] = _Group(stage)
+    group.live += 1
+    return pid
+
+
+def _replay_merge(engine, payload):
+    pid, stage, target = _MERGE.unpack_from(payload)
+    p = engine.live[pid]
+    oids = payload[_MERGE.size:]
+    width = engine.history.width
+    engine.live[pid] = p._replace(
+        phase=Phase.EFF, stage=stage, target=target, merged=oids[:width], base=oids[width:] or None
+    )
+    engine.groups[p.group].claimed.add(target)
+    return pid
+
+
+def _replay_intent(engine, payload):
+    pid, stage, target = _INTENT.unpack_from(payload)
+    p = engine.live[pid]
+    engine.live[pid] = p._replace(
+        phase=Phase.MERGE, stage=stage, target=target, base=payload[_INTENT.size:]
+    )
+    engine.groups[p.group].claimed.add(target)
+    return pid
+
+
+def _replay_eff(engine, payload):
+    pid, stage = _EFF.unpack_from(payload)
+    p = engine.live[pid]
+    engine.live[pid] = p._replace(
+        phase=Phase.PROM,
+        stage=stage,
+        target=-1,
+        history=p.history.cons(payload[_EFF.size:], p.pipeline.stages[stage].name),
+        merged=None,
+        base=None,
+    )
+    engine.effects.pop(pid, None)
+    engine.groups[p.group].done.add(stage)
+    return pid
+
+
+def _replay_end(engine, payload):
+    (pid,) = _END.unpack_from(payload)
+    p = engine.live.pop(pid, None)
+    if p is not None:
+        engine._leave(p.group)
+    engine.effects.pop(pid, None)
+    return pid
+
+
+def _replay_fork(engine, payload):
+    pid, parent, target = _FORK.unpack_from(payload)
+    p = engine.live[parent]
+    engine.live[pid] = Promotion(
+        pid, p.pipeline, Phase.MERGE, p.stage, target, p.history, group=p.group
+    )
+    group = engine.groups[p.group]
+    group.claimed.add(target)
+    group.live += 1
+    return pid
+
+
+def _replay_skip(engine, payload):
+    gid, src, dst = _SKIP.unpack_from(payload)
+    engine.groups[gid].rejected.add((src, dst))
+    return 0
+
+
+def _replay_group(engine, payload):
+    gid, start, ndone = _GROUP.unpack_from(payload)
+    group = engine.groups[gid] = _Group(start)
+    pos = _GROUP.size
+    for _ in range(ndone):
+        group.done.add(_STAGE.unpack_from(payload, pos)[0])
+        pos += _STAGE.size
+    for src, dst in _EDGE.iter_unpack(payload[pos:]):
+        group.rejected.add((src, dst))
+    return gid
+
+
+def _replay_join(engine, payload):
+    pid, gid = _JOIN.unpack_from(payload)
+    p = engine.live[pid]
+    engine._leave(p.group)
+    engine.live[pid] = p._replace(group=gid)
+    engine.groups[gid].live += 1
+    return pid
+
+
+def _replay_effect(engine, payload):
+    (pid,) = _EFFECT.unpack_from(payload)
+    engine.effects.setdefault(pid, set()).add(payload[_EFFECT.size:])
+    return pid
+
+
+def _replay_snapshot(engine, payload):
+    (next_id,) = _SNAPSHOT.unpack_from(payload)
+    return next_id - 1
+
+
+_REPLAY = {
+    Op.START: _replay_start,
+    Op.MERGE: _replay_merge,
+    Op.EFF: _replay_eff,
+    Op.END: _replay_end,
+    Op.SNAPSHOT: _replay_snapshot,
+    Op.EFFECT: _replay_effect,
+    Op.FORK: _replay_fork,
+    Op.SKIP: _replay_skip,
+    Op.GROUP: _replay_group,
+    Op.JOIN: _replay_join,
+    Op.INTENT: _replay_intent,
+}
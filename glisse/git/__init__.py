@@ -0,0 +1,39 @@
+from glisse.git.ancestry import Ancestry
+from glisse.git.bitmap import ReachabilityIndex, pending_by_stage
+from glisse.git.bloom import BloomFilter, BloomIndex
+from glisse.git.cache import CachedObjects, ObjectCache
+from glisse.git.catfile import CatFilePool
+from glisse.git.commitgraph import CommitGraph
+from glisse.git.merge import MergeConflict, NotFastForward
+from glisse.git.objects import Commit, MissingObject, ObjectError, ObjectReader, TreeEntry
+from glisse.git.paths import PathSpec
+from glisse.git.refs import RefConflict, RefError, RefSnapshot, RefTransaction, RefTrie
+from glisse.git.repository import Repository
+from glisse.git.store import ObjectStore
+
+__all__ = [
+    "Ancestry",
+    "BloomFilter",
+    "BloomIndex",
+    "CachedObjects",
+    "CatFilePool",
+    "Commit",
+    "CommitGraph",
+    "MergeConflict",
+    "MissingObject",
+    "NotFastForward",
+    "ObjectCache",
+    "ObjectError",
+    "ObjectReader",
+    "ObjectStore",
+    "PathSpec",
+    "ReachabilityIndex",
+    "RefConflict",
+    "RefError",
+    "RefSnapshot",
+    "RefTransaction",
+    "RefTrie",
+    "Repository",
+    "TreeEntry",
+    "pending_by_stage",
+]
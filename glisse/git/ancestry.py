@@ -0,0 +1,107 @@
+"""Ancestry and merge-base queries.
+
+Commits covered by the commit-graph get their parents and generation number
+from it; the others (written since the graph was last updated) are parsed
+from the object store and treated as having an infinite generation, as git
+does.  Walks visit commits by decreasing generation and stop as soon as
+nothing left in the queue can still matter.
+"""
+
+import heapq
+
+from glisse.git.commitgraph import GENERATION_INFINITY, CommitGraph
+
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+_BOTH = _PARENT1 | _PARENT2
+
+
+class Ancestry:
+    def __init__(self, objects, graph: CommitGraph | None = None):
+        self.objects = objects
+        self.graph = graph
+        # Commits outside the graph never change, so their parents can be
+        # remembered as long as this graph is; ``Repository.refresh``
+        # starts over once a new graph covers them.
+        self._parsed: dict[bytes, tuple[bytes, ...]] = {}
+
+    def generation(self, oid: bytes) -> int:
+        if self.graph is not None:
+            pos = self.graph.position(oid)
+            if pos >= 0:
+                return self.graph.generation(pos)
+        return GENERATION_INFINITY
+
+    def parents(self, oid: bytes) -> tuple[bytes, ...]:
+        if self.graph is not None:
+            pos = self.graph.position(oid)
+            if pos >= 0:
+                graph = self.graph
+                return tuple(graph.oid(p) for p in graph.parents(pos))
+        parents = self._parsed.get(oid)
+        if parents is None:
+            parents = self._parsed[oid] = self.objects.commit(oid).parents
+        return parents
+
+    def is_ancestor(self, ancestor: bytes, descendant: bytes) -> bool:
+        """Whether ``ancestor`` is reachable from ``descendant`` (or equal to it)."""
+        if ancestor == descendant:
+            return True
+        # The graph is closed under ancestry, so a commit outside it (of
+        # infinite generation) is never reached from one inside it.
+        floor = self.generation(ancestor)
+        if floor > self.generation(descendant):
+            return False
+        seen = {descendant}
+        todo = [descendant]
+        while todo:
+            for parent in self.parents(todo.pop()):
+                if parent == ancestor:
+                    return True
+                if parent not in seen:
+                    seen.add(parent)
+                    if self.generation(parent) >= floor:
+                        todo.append(parent)
+        return False
+
+    def merge_bases(self, a: bytes, b: bytes) -> list[bytes]:
+        """Best common ancestors of ``a`` and ``b``, like ``git merge-base --all``."""
+        if a == b:
+            return [a]
+        candidates = self._paint(a, b)
+        if len(candidates) < 2:
+            return candidates
+        return [
+            c for c in candidates
+            if not any(c != other and self.is_ancestor(c, other) for other in candidates)
+        ]
+
+    def merge_base(self, a: bytes, b: bytes) -> bytes | None:
+        bases = self.merge_bases(a, b)
+        return bases[0] if bases else None
+
+    def _paint(self, a: bytes, b: bytes) -> list[bytes]:
+        # git's paint_down_to_common: flood each side's flag down the
+        # history; a commit reached from both sides is a candidate and its
+        # ancestors are stale.  Stop once only stale commits are queued.
+        flags = {a: _PARENT1, b: _PARENT2}
+        queue = [(-self.generation(a), 0, a), (-self.generation(b), 1, b)]
+        order = 2
+        result = []
+        while any(not flags[oid] & _STALE for _, _, oid in queue):
+            _, _, oid = heapq.heappop(queue)
+            f = flags[oid]
+            if f & _BOTH == _BOTH and not f & _STALE:
+                result.append(oid)
+                f |= _STALE
+                flags[oid] = f
+            carried = f & (_BOTH | _STALE)
+            for parent in self.parents(oid):
+                old = flags.get(parent, 0)
+                if old & carried == carried:
+                    continue
+                flags[parent] = old | carried
+                heapq.heappush(queue, (-self.generation(parent), order, parent))
+                order += 1
+        return result
@@ -0,0 +1,147 @@
+"""Reachability bitmaps for "commits pending promotion" counts.
+
+Every commit gets a bit: its commit-graph position, or a slot after the
+graph for commits written since.  ``reachable(tip)`` is the set of commits
+reachable from ``tip`` as a Python ``int`` bitmap; bitmaps of recently used
+tips are kept, and a walk from a new tip stops at any commit whose bitmap
+is already known, so moving a branch forward only walks the new commits.
+"How many commits of ``dev`` are not in ``staging``" is then one
+``and``/``not`` and a popcount.
+
+Slots after the graph are never given back; ``Repository.refresh`` builds
+a new index, with narrower bitmaps, once git rewrites the graph.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class ReachabilityIndex:
+    def __init__(self, objects, graph=None, capacity: int = 256):
+        self.objects = objects
+        self.graph = graph
+        self.capacity = capacity
+        self._base = len(graph) if graph is not None else 0
+        self._extra: dict[bytes, int] = {}
+        self._extra_oids: list[bytes] = []
+        self._extra_parents: list[tuple[int, ...]] = []
+        self._bitmaps: OrderedDict[int, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def slot(self, oid: bytes) -> int:
+        with self._lock:
+            return self._slot(oid)
+
+    def reachable(self, tip: bytes) -> int:
+        with self._lock:
+            return self._reachable(self._slot(tip))
+
+    def pending(self, source: bytes, target: bytes) -> int:
+        """Number of commits reachable from ``source`` but not from ``target``."""
+        with self._lock:
+            src = self._reachable(self._slot(source))
+            dst = self._reachable(self._slot(target))
+        return (src & ~dst).bit_count()
+
+    def missing(self, source: bytes, target: bytes | None) -> list[bytes]:
+        """Commits reachable from ``source`` but not from ``target``."""
+        with self._lock:
+            bits = self._reachable(self._slot(source))
+            if target is not None:
+                bits &= ~self._reachable(self._slot(target))
+            out = []
+            while bits:
+                low = bits & -bits
+                out.append(self._oid(low.bit_length() - 1))
+                bits ^= low
+        return out
+
+    def _known(self, oid: bytes) -> int:
+        if self.graph is not None:
+            pos = self.graph.position(oid)
+            if pos >= 0:
+                return pos
+        return self._extra.get(oid, -1)
+
+    def _slot(self, oid: bytes) -> int:
+        slot = self._known(oid)
+        if slot >= 0:
+            return slot
+        # Number new commits parents first, so their parent slots exist.
+        parents_of = {}
+        todo = [oid]
+        while todo:
+            current = todo[-1]
+            if self._known(current) >= 0:
+                todo.pop()
+                continue
+            parents = parents_of.get(current)
+            if parents is None:
+                parents = parents_of[current] = self.objects.commit(current).parents
+                todo.extend(p for p in parents if self._known(p) < 0)
+                continue
+            todo.pop()
+            self._extra[current] = self._base + len(self._extra_parents)
+            self._extra_oids.append(current)
+            self._extra_parents.append(tuple(self._known(p) for p in parents))
+        return self._extra[oid]
+
+    def _oid(self, slot: int) -> bytes:
+        if slot < self._base:
+            return self.graph.oid(slot)
+        return self._extra_oids[slot - self._base]
+
+    def _parents(self, slot: int) -> tuple[int, ...]:
+        if slot < self._base:
+            return self.graph.parents(slot)
+        return self._extra_parents[slot - self._base]
+
+    def _reachable(self, slot: int) -> int:
+        bitmaps = self._bitmaps
+        known = bitmaps.get(slot)
+        if known is not None:
+            bitmaps.move_to_end(slot)
+            return known
+        # Mark bits in a bytearray while walking (setting a bit in a large
+        # int copies it); fold in known bitmaps as they are met so their
+        # commits are not walked again.
+        size = (self._base + len(self._extra_parents)) // 8 + 1
+        bits = bytearray(size)
+        stack = [slot]
+        while stack:
+            s = stack.pop()
+            byte, mask = s >> 3, 1 << (s & 7)
+            if bits[byte] & mask:
+                continue
+            known = bitmaps.get(s)
+            if known is not None:
+                merged = int.from_bytes(bits, "little") | known
+                bits[:] = merged.to_bytes(size, "little")
+                continue
+            bits[byte] |= mask
+            stack.extend(self._parents(s))
+        result = int.from_bytes(bits, "little")
+        bitmaps[slot] = result
+        if len(bitmaps) > self.capacity:
+            bitmaps.popitem(last=False)
+        return result
+
+
+def pending_by_stage(repo, pipeline) -> dict[tuple[str, str], int]:
+    """Commits waiting on every edge of ``pipeline``, keyed by (source, target).
+
+    A pattern stage such as ``release/*`` stands for the union of the
+    branches it matches, so a commit on several of them counts once.
+    """
+    repo.refresh()
+    stages = pipeline.stages
+    reach = []
+    for b in stages:
+        bits = 0
+        for name in repo.branches(b.name) if b.pattern else (b.name,):
+            bits |= repo.reachability.reachable(repo.tip(name))
+        reach.append(bits)
+    return {
+        (stages[src].name, stages[dst].name): (reach[src] & ~reach[dst]).bit_count()
+        for src, dst in pipeline.transitions
+    }
@@ -0,0 +1,172 @@
+"""Changed-path Bloom filters.
+
+Each commit gets a Bloom filter of the paths it changes relative to its
+first parent, directories included, laid out as git does in the
+``BIDX``/``BDAT`` commit-graph chunks: ``hashes`` bit positions per path
+from two seeded murmur3 hashes, ``bits_per_entry`` bits per path, and a
+single all-ones byte for commits changing more than ``MAX_CHANGES`` files.
+
+``BloomIndex`` uses the commit-graph's filters where it has them and
+builds (and keeps) the others itself, so "could this commit touch
+``services/api``?" is usually a few hash probes rather than a tree diff.
+A filter only ever says "no" or "maybe".
+"""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from glisse.git.paths import changed_paths
+
+SEEDS = (0x293AE76F, 0x7E646E2C)
+DEFAULT_HASHES = 7
+DEFAULT_BITS_PER_ENTRY = 10
+MAX_CHANGES = 512
+
+_MASK = 0xFFFFFFFF
+
+
+def murmur3(data: bytes, seed: int, version: int = 2) -> int:
+    """32-bit murmur3 of ``data``.
+
+    Version 1 filters were written by git hashing bytes as signed chars,
+    which only differs for bytes above 0x7F.
+    """
+    if version == 1:
+        data = [b | 0xFFFFFF00 if b & 0x80 else b for b in data]
+    h = seed
+    n = len(data) & ~3
+    for i in range(0, n, 4):
+        k = (data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24) & _MASK
+        k = (k * 0xCC9E2D51) & _MASK
+        k = ((k << 15) | (k >> 17)) & _MASK
+        k = (k * 0x1B873593) & _MASK
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & _MASK
+        h = (h * 5 + 0xE6546B64) & _MASK
+    rest = len(data) & 3
+    if rest:
+        k = 0
+        if rest == 3:
+            k ^= data[n + 2] << 16
+        if rest >= 2:
+            k ^= data[n + 1] << 8
+        k ^= data[n]
+        k &= _MASK
+        k = (k * 0xCC9E2D51) & _MASK
+        k = ((k << 15) | (k >> 17)) & _MASK
+        k = (k * 0x1B873593) & _MASK
+        h ^= k
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & _MASK
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & _MASK
+    h ^= h >> 16
+    return h
+
+
+def _positions(path: bytes, hashes: int, version: int) -> list[int]:
+    h0 = murmur3(path, SEEDS[0], version)
+    h1 = murmur3(path, SEEDS[1], version)
+    return [(h0 + i * h1) & _MASK for i in range(hashes)]
+
+
+@lru_cache(maxsize=1024)
+def bloom_keys(path: bytes, hashes: int, version: int) -> tuple[tuple[int, ...], ...]:
+    """Hash positions of ``path`` and of each of its leading directories.
+
+    Like git's ``bloom_key``: hashed once per path and filter settings, so
+    probing the filters of many commits only tests bits.
+    """
+    out = []
+    end = len(path)
+    while end > 0:
+        out.append(tuple(_positions(path[:end], hashes, version)))
+        end = path.rfind(b"/", 0, end)
+    return tuple(out)
+
+
+class BloomFilter:
+    __slots__ = ("data", "hashes", "version")
+
+    def __init__(self, data: bytes, hashes: int = DEFAULT_HASHES, version: int = 2):
+        self.data = data
+        self.hashes = hashes
+        self.version = version
+
+    def may_contain(self, path: bytes) -> bool:
+        """``False`` only if no changed path is ``path`` or lies under it."""
+        data = self.data
+        if not data:
+            return True
+        nbits = len(data) * 8
+        # Every leading directory of a changed path was added too, so each
+        # of them must be present.
+        for key in bloom_keys(path, self.hashes, self.version):
+            for pos in key:
+                bit = pos % nbits
+                if not data[bit >> 3] & (1 << (bit & 7)):
+                    return False
+        return True
+
+
+def build_filter(paths, hashes: int = DEFAULT_HASHES, bits_per_entry: int = DEFAULT_BITS_PER_ENTRY) -> BloomFilter:
+    """Filter of the changed file ``paths`` and their leading directories."""
+    paths = list(paths)
+    if len(paths) > MAX_CHANGES:
+        return BloomFilter(b"\xff", hashes)
+    keys = set()
+    for path in paths:
+        end = len(path)
+        while end > 0 and path[:end] not in keys:
+            keys.add(path[:end])
+            end = path.rfind(b"/", 0, end)
+    nbytes = (len(keys) * bits_per_entry + 7) // 8 or 1
+    data = bytearray(nbytes)
+    nbits = nbytes * 8
+    for key in keys:
+        for pos in _positions(key, hashes, 2):
+            bit = pos % nbits
+            data[bit >> 3] |= 1 << (bit & 7)
+    return BloomFilter(bytes(data), hashes)
+
+
+class BloomIndex:
+    def __init__(self, objects, graph=None, capacity: int = 4096):
+        self.objects = objects
+        self.graph = graph
+        self.capacity = capacity
+        self._built: OrderedDict[bytes, BloomFilter] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, oid: bytes) -> BloomFilter:
+        if self.graph is not None:
+            pos = self.graph.position(oid)
+            if pos >= 0:
+                found = self.graph.bloom(pos)
+                if found is not None:
+                    return found
+        with self._lock:
+            found = self._built.get(oid)
+            if found is not None:
+                self._built.move_to_end(oid)
+                return found
+        commit = self.objects.commit(oid)
+        parent = self.objects.commit(commit.parents[0]).tree if commit.parents else None
+        changes = []
+        for path in changed_paths(self.objects, parent, commit.tree):
+            changes.append(path)
+            if len(changes) > MAX_CHANGES:
+                break
+        found = build_filter(changes)
+        with self._lock:
+            self._built[oid] = found
+            if len(self._built) > self.capacity:
+                self._built.popitem(last=False)
+        return found
+
+    def may_change(self, oid: bytes, spec) -> bool:
+        """``False`` if commit ``oid`` surely changes nothing ``spec`` matches."""
+        bloom = self.filter(oid)
+        return any(not prefix or bloom.may_contain(prefix) for prefix in spec.prefixes)
@@ -0,0 +1,114 @@
+"""A bounded, process-wide cache of decompressed objects.
+
+Promotions running side by side read much the same commits and trees (the
+history of ``main`` above all).  ``ObjectCache`` keeps recently read
+objects up to ``max_bytes``, counted as the ``sys.getsizeof`` of the
+cached key and content plus what holding them costs the cache, and evicts
+the least recently used first.  ``CachedObjects``
+puts a cache in front of any object reader; ``SHARED`` is the cache every
+``Repository`` uses unless given another one.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from glisse.git.objects import OBJ_COMMIT, OBJ_TREE, ObjectReader
+
+# Blobs are read once per merge at most and would only push history out.
+_CACHED_KINDS = frozenset((OBJ_COMMIT, OBJ_TREE))
+
+# Memory an entry takes beyond its key and content: the value tuple, its
+# cost int, and the hash table entry and list node of the OrderedDict
+# (about 80 bytes on 64-bit CPython).
+_ENTRY_OVERHEAD = sys.getsizeof((0, b"", 0)) + sys.getsizeof(1 << 20) + 80
+
+
+class ObjectCache:
+    def __init__(self, max_bytes: int = 64 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[bytes, tuple[int, bytes, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, oid: bytes):
+        """``(type, content)`` of a cached object, ``None`` otherwise."""
+        with self._lock:
+            entry = self._entries.get(oid)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(oid)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, oid: bytes, kind: int, data: bytes) -> None:
+        cost = sys.getsizeof(oid) + sys.getsizeof(data) + _ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(oid, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[oid] = (kind, data, cost)
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+SHARED = ObjectCache()
+
+
+class CachedObjects(ObjectReader):
+    """``objects`` with commits and trees served from ``cache`` when present."""
+
+    def __init__(self, objects, cache: ObjectCache = SHARED):
+        self.objects = objects
+        self.cache = cache
+        self.oid_size = objects.oid_size
+
+    def read(self, oid: bytes) -> tuple[int, memoryview]:
+        found = self.cache.get(oid)
+        if found is not None:
+            return found[0], memoryview(found[1])
+        kind, data = self.objects.read(oid)
+        if kind in _CACHED_KINDS:
+            data = bytes(data)
+            self.cache.put(oid, kind, data)
+            data = memoryview(data)
+        return kind, data
+
+    def read_many(self, oids) -> list:
+        out = [self.cache.get(oid) for oid in oids]
+        misses = [i for i, found in enumerate(out) if found is None]
+        if misses:
+            read = self.objects.read_many([oids[i] for i in misses])
+            for i, found in zip(misses, read):
+                if found is not None and found[0] in _CACHED_KINDS:
+                    data = bytes(found[1])
+                    self.cache.put(oids[i], found[0], data)
+                    found = found[0], data
+                out[i] = found
+        return [None if found is None else (found[0], memoryview(found[1])) for found in out]
+
+    def write(self, kind: int, data) -> bytes:
+        return self.objects.write(kind, data)
+
+    def __contains__(self, oid: bytes) -> bool:
+        return oid in self.objects
+
+    def close(self) -> None:
+        self.objects.close()
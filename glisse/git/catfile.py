@@ -0,0 +1,164 @@
+"""Object backend on long-lived ``git cat-file`` processes.
+
+``CatFilePool`` keeps up to ``size`` ``git cat-file --batch`` (contents) and
+``--batch-check`` (existence) processes per repository and reuses them for
+every lookup, so reading an object costs a pipe round trip instead of a
+fork and exec.  ``read_many`` pipelines a whole list of requests through
+one process; ``merge_trees`` uses it to fetch the trees and blobs of each
+tree level it merges together.  It reads anything ``git`` itself can,
+which makes it the fallback for repository layouts ``ObjectStore`` does
+not handle.
+"""
+
+import os
+import queue
+import subprocess
+import threading
+from contextlib import contextmanager
+
+from glisse.git.objects import TYPE_IDS, MissingObject, ObjectError, ObjectReader
+from glisse.git.store import LooseObjects, object_format
+
+# Requests written before reading the answers back.  Kept well under the
+# pipe buffer so that writing never blocks on git blocking on its output.
+_PIPELINE_DEPTH = 256
+
+
+class _Process:
+    def __init__(self, git_dir: str, mode: str):
+        self.proc = subprocess.Popen(
+            ["git", f"--git-dir={git_dir}", "cat-file", mode],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def send(self, oids) -> None:
+        self.proc.stdin.write(b"".join(oid.hex().encode() + b"\n" for oid in oids))
+        self.proc.stdin.flush()
+
+    def header(self, oid: bytes):
+        """``(type, size)`` from the next answer header, ``None`` if missing."""
+        line = self.proc.stdout.readline()
+        if not line:
+            raise ObjectError("git cat-file exited")
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == b"missing":
+            return None
+        if len(fields) != 3 or bytes.fromhex(fields[0].decode()) != oid:
+            raise ObjectError(f"unexpected git cat-file answer {line!r}")
+        return TYPE_IDS[fields[1]], int(fields[2])
+
+    def body(self, size: int) -> bytes:
+        data = self.proc.stdout.read(size + 1)
+        if len(data) != size + 1:
+            raise ObjectError("git cat-file exited")
+        return data[:size]
+
+    def close(self) -> None:
+        if self.alive:
+            self.proc.stdin.close()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+    def kill(self) -> None:
+        self.proc.kill()
+        self.proc.wait()
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+
+
+class CatFilePool(ObjectReader):
+    def __init__(self, git_dir: str, size: int = 4, oid_size: int | None = None):
+        self.git_dir = git_dir
+        self.size = size
+        self.oid_size = oid_size or object_format(git_dir)
+        self._idle = {"--batch": queue.LifoQueue(), "--batch-check": queue.LifoQueue()}
+        self._spawned = {"--batch": 0, "--batch-check": 0}
+        self._all: list[_Process] = []
+        self._lock = threading.Lock()
+        self._loose = LooseObjects(os.path.join(git_dir, "objects"))
+
+    def read(self, oid: bytes) -> tuple[int, memoryview]:
+        found = self.read_many([oid])[0]
+        if found is None:
+            raise MissingObject(oid)
+        return found
+
+    def read_many(self, oids) -> list:
+        """``(type, content)`` for each of ``oids``, ``None`` where missing."""
+        out = []
+        with self._process("--batch") as proc:
+            for i in range(0, len(oids), _PIPELINE_DEPTH):
+                chunk = oids[i:i + _PIPELINE_DEPTH]
+                proc.send(chunk)
+                for oid in chunk:
+                    head = proc.header(oid)
+                    if head is None:
+                        out.append(None)
+                    else:
+                        kind, size = head
+                        out.append((kind, memoryview(proc.body(size))))
+        return out
+
+    def info(self, oids) -> list:
+        """``(type, size)`` for each of ``oids``, ``None`` where missing."""
+        out = []
+        with self._process("--batch-check") as proc:
+            for i in range(0, len(oids), _PIPELINE_DEPTH):
+                chunk = oids[i:i + _PIPELINE_DEPTH]
+                proc.send(chunk)
+                out.extend(proc.header(oid) for oid in chunk)
+        return out
+
+    def __contains__(self, oid: bytes) -> bool:
+        return self.info([oid])[0] is not None
+
+    def write(self, kind: int, data) -> bytes:
+        """Store an object as a loose object, where ``git cat-file`` finds it."""
+        return self._loose.write(kind, data, self.oid_size)
+
+    def close(self) -> None:
+        with self._lock:
+            procs, self._all = self._all, []
+            for mode in self._idle:
+                self._idle[mode] = queue.LifoQueue()
+                self._spawned[mode] = 0
+        for proc in procs:
+            proc.close()
+
+    @contextmanager
+    def _process(self, mode: str):
+        idle = self._idle[mode]
+        try:
+            proc = idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                spawn = self._spawned[mode] < self.size
+                if spawn:
+                    self._spawned[mode] += 1
+            if spawn:
+                try:
+                    proc = _Process(self.git_dir, mode)
+                except BaseException:
+                    with self._lock:
+                        self._spawned[mode] -= 1
+                    raise
+                with self._lock:
+                    self._all.append(proc)
+            else:
+                proc = idle.get()
+        try:
+            yield proc
+        except BaseException:
+            # The answers left in the pipe would be read by the next user.
+            with self._lock:
+                self._spawned[mode] -= 1
+                if proc in self._all:
+                    self._all.remove(proc)
+            proc.kill()
+            raise
+        idle.put(proc)
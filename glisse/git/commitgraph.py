@@ -0,0 +1,218 @@
+"""Reader for git's ``commit-graph`` files.
+
+Handles a single ``objects/info/commit-graph`` as well as split graphs
+(``objects/info/commit-graphs/commit-graph-chain``).  Commits are addressed
+by their global position: positions in a layer follow those of all its
+base layers, which is also how parent edges refer to each other.
+
+Generation numbers come from the ``GDA2``/``GDO2`` chunks (corrected
+commit dates) when every layer has them, and from the topological levels
+in ``CDAT`` otherwise; either way a commit's generation is strictly greater
+than its parents'.
+
+Changed-path Bloom filters are read from the ``BIDX``/``BDAT`` chunks of
+layers written with ``--changed-paths``.
+"""
+
+import mmap
+import os
+import struct
+
+from glisse.git.bloom import BloomFilter
+from glisse.git.objects import ObjectError
+
+GRAPH_PARENT_NONE = 0x70000000
+GENERATION_INFINITY = 0xFFFFFFFFFFFFFFFF
+
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_CDAT_TAIL = struct.Struct(">IIII")
+_BDAT_HEADER = struct.Struct(">III")
+
+
+class _Layer:
+    def __init__(self, path: str, oid_size: int, base: int):
+        self.path = path
+        self.base = base
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = self.view = memoryview(self._map)
+        if view[:4] != b"CGPH" or view[4] != 1:
+            raise ObjectError(f"{path}: unsupported commit-graph version")
+        if {1: 20, 2: 32}.get(view[5]) != oid_size:
+            raise ObjectError(f"{path}: commit-graph hash does not match the repository")
+        self.oid_size = oid_size
+        nchunks = view[6]
+        self.chunks = {}
+        for i in range(nchunks):
+            pos = 8 + i * 12
+            chunk_id = bytes(view[pos:pos + 4])
+            start = _U64.unpack_from(view, pos + 4)[0]
+            end = _U64.unpack_from(view, pos + 16)[0]
+            self.chunks[chunk_id] = (start, end)
+        for required in (b"OIDF", b"OIDL", b"CDAT"):
+            if required not in self.chunks:
+                raise ObjectError(f"{path}: missing {required.decode()} chunk")
+        self.fanout = struct.unpack_from(">256I", view, self.chunks[b"OIDF"][0])
+        self.count = self.fanout[255]
+        self.oids = self.chunks[b"OIDL"][0]
+        self.cdat = self.chunks[b"CDAT"][0]
+        self.cdat_width = oid_size + 16
+        self.edges = self.chunks.get(b"EDGE", (None,))[0]
+        self.gda2 = self.chunks.get(b"GDA2", (None,))[0]
+        self.gdo2 = self.chunks.get(b"GDO2", (None,))[0]
+        self.bidx = self.chunks.get(b"BIDX", (None,))[0]
+        self.bdat = self.chunks.get(b"BDAT", (None,))[0]
+        if self.bidx is not None and self.bdat is not None:
+            self.bloom_version, self.bloom_hashes, _ = _BDAT_HEADER.unpack_from(view, self.bdat)
+            if self.bloom_version not in (1, 2):
+                self.bidx = self.bdat = None
+
+    def find(self, oid: bytes) -> int:
+        first = oid[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        view, base, size = self.view, self.oids, self.oid_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = base + mid * size
+            probe = bytes(view[start:start + size])
+            if probe == oid:
+                return mid
+            if probe < oid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return -1
+
+    def close(self):
+        self.view.release()
+        self._map.close()
+
+
+def graph_stamp(objects_dir: str):
+    """Changes whenever git writes a new commit-graph under ``objects_dir``.
+
+    Both files are replaced by renaming a lockfile over them, so their
+    inode and mtime move with every write.
+    """
+    info = os.path.join(objects_dir, "info")
+    out = []
+    for path in (os.path.join(info, "commit-graph"), os.path.join(info, "commit-graphs", "commit-graph-chain")):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            out.append(None)
+        else:
+            out.append((st.st_mtime_ns, st.st_size, st.st_ino))
+    return tuple(out)
+
+
+class CommitGraph:
+    def __init__(self, layers: list[_Layer]):
+        self._layers = layers
+        self._count = sum(layer.count for layer in layers)
+        self.corrected_dates = all(layer.gda2 is not None for layer in layers)
+
+    @classmethod
+    def open(cls, objects_dir: str, oid_size: int) -> "CommitGraph | None":
+        """The repository's commit-graph, or ``None`` if there is no usable one.
+
+        Like git, a graph that is missing a layer, truncated or of an
+        unsupported version is ignored rather than an error: every commit
+        is then read from the object store.
+        """
+        info = os.path.join(objects_dir, "info")
+        chain = os.path.join(info, "commit-graphs", "commit-graph-chain")
+        layers, base = [], 0
+        try:
+            if os.path.exists(chain):
+                with open(chain) as f:
+                    hashes = [line.strip() for line in f if line.strip()]
+                paths = [os.path.join(info, "commit-graphs", f"graph-{h}.graph") for h in hashes]
+            else:
+                paths = [os.path.join(info, "commit-graph")]
+            for path in paths:
+                layer = _Layer(path, oid_size, base)
+                layers.append(layer)
+                base += layer.count
+        except (OSError, ValueError, IndexError, struct.error, ObjectError):
+            for layer in layers:
+                layer.close()
+            return None
+        return cls(layers) if layers else None
+
+    def __len__(self):
+        return self._count
+
+    def position(self, oid: bytes) -> int:
+        """Global position of ``oid``, or -1 when the graph does not cover it."""
+        for layer in reversed(self._layers):
+            pos = layer.find(oid)
+            if pos >= 0:
+                return layer.base + pos
+        return -1
+
+    def oid(self, pos: int) -> bytes:
+        layer, i = self._locate(pos)
+        start = layer.oids + i * layer.oid_size
+        return bytes(layer.view[start:start + layer.oid_size])
+
+    def tree(self, pos: int) -> bytes:
+        layer, i = self._locate(pos)
+        start = layer.cdat + i * layer.cdat_width
+        return bytes(layer.view[start:start + layer.oid_size])
+
+    def parents(self, pos: int) -> tuple[int, ...]:
+        layer, i = self._locate(pos)
+        p1, p2, _, _ = _CDAT_TAIL.unpack_from(layer.view, layer.cdat + i * layer.cdat_width + layer.oid_size)
+        if p1 == GRAPH_PARENT_NONE:
+            return ()
+        if p2 == GRAPH_PARENT_NONE:
+            return (p1,)
+        if not p2 & 0x80000000:
+            return (p1, p2)
+        out = [p1]
+        edge = layer.edges + (p2 & 0x7FFFFFFF) * 4
+        while True:
+            value = _U32.unpack_from(layer.view, edge)[0]
+            out.append(value & 0x7FFFFFFF)
+            if value & 0x80000000:
+                return tuple(out)
+            edge += 4
+
+    def commit_time(self, pos: int) -> int:
+        layer, i = self._locate(pos)
+        _, _, high, low = _CDAT_TAIL.unpack_from(layer.view, layer.cdat + i * layer.cdat_width + layer.oid_size)
+        return ((high & 3) << 32) | low
+
+    def generation(self, pos: int) -> int:
+        layer, i = self._locate(pos)
+        _, _, high, low = _CDAT_TAIL.unpack_from(layer.view, layer.cdat + i * layer.cdat_width + layer.oid_size)
+        if not self.corrected_dates:
+            return high >> 2
+        offset = _U32.unpack_from(layer.view, layer.gda2 + i * 4)[0]
+        if offset & 0x80000000:
+            offset = _U64.unpack_from(layer.view, layer.gdo2 + (offset & 0x7FFFFFFF) * 8)[0]
+        return (((high & 3) << 32) | low) + offset
+
+    def bloom(self, pos: int) -> BloomFilter | None:
+        """Changed-path filter of the commit at ``pos``, if its layer has one."""
+        layer, i = self._locate(pos)
+        if layer.bidx is None or layer.bdat is None:
+            return None
+        end = _U32.unpack_from(layer.view, layer.bidx + i * 4)[0]
+        start = _U32.unpack_from(layer.view, layer.bidx + (i - 1) * 4)[0] if i else 0
+        data = layer.bdat + _BDAT_HEADER.size
+        return BloomFilter(bytes(layer.view[data + start:data + end]), layer.bloom_hashes, layer.bloom_version)
+
+    def close(self) -> None:
+        for layer in self._layers:
+            layer.close()
+        self._layers = []
+
+    def _locate(self, pos: int):
+        for layer in self._layers:
+            if pos < layer.base + layer.count:
+                return layer, pos - layer.base
+        raise IndexError(pos)
@@ -0,0 +1,196 @@
+"""Three-way merges computed from objects alone.
+
+``merge_trees`` merges two trees against their merge base the way
+``git merge-tree --write-tree`` does: unchanged subtrees are taken whole
+without being read, only paths changed on both sides are descended into,
+and files changed on both sides get a line-based three-way merge.  Each
+tree level costs one ``read_many`` for its three trees and one for the
+blobs of every file it merges, a single round trip on ``CatFilePool``.  The
+result is written straight to the object store; there is no worktree and
+no index.  Anything that would leave conflict markers raises
+``MergeConflict`` listing every conflicting path.
+"""
+
+from difflib import SequenceMatcher
+from typing import NamedTuple
+
+from glisse.git.objects import (
+    OBJ_BLOB,
+    OBJ_TREE,
+    TYPE_NAMES,
+    MissingObject,
+    ObjectError,
+    TreeEntry,
+    format_tree,
+    parse_tree,
+)
+
+_TREE_MODE = 0o40000
+# Symlinks and submodules: contents that cannot be merged line by line.
+_OPAQUE_MODES = (0o120000, 0o160000)
+
+
+class MergeConflict(ObjectError):
+    def __init__(self, paths: list[bytes]):
+        super().__init__(paths)
+        self.paths = paths
+
+    def __str__(self):
+        return "merge conflict in " + ", ".join(p.decode(errors="replace") for p in self.paths)
+
+
+class NotFastForward(ObjectError):
+    """A fast-forward-only promotion found diverged branches."""
+
+
+def merge_trees(objects, base: bytes | None, ours: bytes, theirs: bytes) -> bytes:
+    """Write the merge of trees ``ours`` and ``theirs`` and return its ID."""
+    conflicts = []
+    tree = _merge_tree(objects, base, ours, theirs, b"", conflicts)
+    if conflicts:
+        raise MergeConflict(sorted(conflicts))
+    if tree is None:
+        tree = objects.write(OBJ_TREE, b"")
+    return tree
+
+
+def _merge_tree(objects, base, ours, theirs, prefix, conflicts):
+    if ours == theirs or base == theirs:
+        return ours
+    if base == ours:
+        return theirs
+    b, o, t = (
+        {e.name: e for e in parse_tree(data, objects.oid_size)}
+        for data in _read(objects, OBJ_TREE, (base, ours, theirs))
+    )
+    merged = []
+    # Files changed on both sides, merged once all their blobs are read.
+    contents = []
+    for name in sorted(b.keys() | o.keys() | t.keys()):
+        be, oe, te = b.get(name), o.get(name), t.get(name)
+        if oe == te or be == te:
+            entry = oe
+        elif be == oe:
+            entry = te
+        else:
+            entry = _merge_entry(objects, be, oe, te, prefix + name, conflicts)
+            if isinstance(entry, _Contents):
+                contents.append(entry)
+                continue
+        if entry is not None:
+            merged.append(entry)
+    if contents:
+        blobs = iter(_read(objects, OBJ_BLOB, [
+            oid
+            for c in contents
+            for oid in (c.base.oid if c.base is not None else None, c.ours.oid, c.theirs.oid)
+        ]))
+        for c in contents:
+            text = merge3(next(blobs), next(blobs), next(blobs))
+            if text is None:
+                conflicts.append(c.path)
+            else:
+                merged.append(TreeEntry(c.mode, c.ours.name, objects.write(OBJ_BLOB, text)))
+    if not merged:
+        return None
+    return objects.write(OBJ_TREE, format_tree(merged))
+
+
+class _Contents(NamedTuple):
+    mode: int
+    base: TreeEntry | None
+    ours: TreeEntry
+    theirs: TreeEntry
+    path: bytes
+
+
+def _merge_entry(objects, be, oe, te, path, conflicts):
+    """Both sides changed ``path``, and differently.
+
+    Returns the merged entry, ``None`` for no entry, or ``_Contents`` when
+    the file contents need a line merge.
+    """
+    if oe is not None and te is not None and oe.is_tree and te.is_tree:
+        base = be.oid if be is not None and be.is_tree else None
+        sub = _merge_tree(objects, base, oe.oid, te.oid, path + b"/", conflicts)
+        return None if sub is None else TreeEntry(_TREE_MODE, oe.name, sub)
+    if (
+        oe is None or te is None or oe.is_tree or te.is_tree
+        or (be is not None and be.is_tree)
+    ):
+        conflicts.append(path)
+        return None
+    if oe.mode == te.mode:
+        mode = oe.mode
+    elif be is not None and be.mode == oe.mode:
+        mode = te.mode
+    elif be is not None and be.mode == te.mode:
+        mode = oe.mode
+    else:
+        conflicts.append(path)
+        return None
+    if oe.oid == te.oid:
+        return TreeEntry(mode, oe.name, oe.oid)
+    if mode in _OPAQUE_MODES:
+        conflicts.append(path)
+        return None
+    return _Contents(mode, be, oe, te, path)
+
+
+def _read(objects, kind, oids):
+    """Contents of ``oids`` (empty for ``None``), fetched in one ``read_many``."""
+    found = iter(objects.read_many([oid for oid in oids if oid is not None]))
+    out = []
+    for oid in oids:
+        if oid is None:
+            out.append(b"")
+            continue
+        obj = next(found)
+        if obj is None:
+            raise MissingObject(oid)
+        if obj[0] != kind:
+            raise ObjectError(f"{oid.hex()} is not a {TYPE_NAMES[kind].decode()}")
+        out.append(bytes(obj[1]))
+    return out
+
+
+def merge3(base: bytes, ours: bytes, theirs: bytes) -> bytes | None:
+    """Line-based three-way merge; ``None`` on conflict or binary content."""
+    if b"\0" in base or b"\0" in ours or b"\0" in theirs:
+        return None
+    z = base.splitlines(keepends=True)
+    a = ours.splitlines(keepends=True)
+    b = theirs.splitlines(keepends=True)
+    out = []
+    iz = ia = ib = 0
+    for zmatch, zend, amatch, bmatch in _sync_regions(z, a, b):
+        matchlen = zend - zmatch
+        a_side, b_side, z_side = a[ia:amatch], b[ib:bmatch], z[iz:zmatch]
+        if a_side == b_side or b_side == z_side:
+            out.extend(a_side)
+        elif a_side == z_side:
+            out.extend(b_side)
+        else:
+            return None
+        out.extend(z[zmatch:zend])
+        iz, ia, ib = zend, amatch + matchlen, bmatch + matchlen
+    return b"".join(out)
+
+
+def _sync_regions(z, a, b):
+    """Base ranges unchanged on both sides, as (base start, base end, a start, b start)."""
+    amatches = SequenceMatcher(None, z, a, autojunk=False).get_matching_blocks()
+    bmatches = SequenceMatcher(None, z, b, autojunk=False).get_matching_blocks()
+    ia = ib = 0
+    while ia < len(amatches) and ib < len(bmatches):
+        abase, amatch, alen = amatches[ia]
+        bbase, bmatch, blen = bmatches[ib]
+        start = max(abase, bbase)
+        end = min(abase + alen, bbase + blen)
+        if start < end:
+            yield start, end, amatch + start - abase, bmatch + start - bbase
+        if abase + alen < bbase + blen:
+            ia += 1
+        else:
+            ib += 1
+    yield len(z), len(z), len(a), len(b)
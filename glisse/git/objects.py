@@ -0,0 +1,145 @@
+"""Git object types and parsers."""
+
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: b"commit", OBJ_TREE: b"tree", OBJ_BLOB: b"blob", OBJ_TAG: b"tag"}
+TYPE_IDS = {name: kind for kind, name in TYPE_NAMES.items()}
+
+
+class ObjectError(Exception):
+    pass
+
+
+class MissingObject(ObjectError, KeyError):
+    def __init__(self, oid: bytes):
+        super().__init__(oid)
+        self.oid = oid
+
+    def __str__(self):
+        return f"object {self.oid.hex()} not found"
+
+
+class Commit(NamedTuple):
+    tree: bytes
+    parents: tuple[bytes, ...]
+    author: bytes
+    committer: bytes
+    message: bytes
+
+
+class TreeEntry(NamedTuple):
+    mode: int
+    name: bytes
+    oid: bytes
+
+    @property
+    def is_tree(self) -> bool:
+        return self.mode == 0o40000
+
+
+def parse_commit(data) -> Commit:
+    data = bytes(data)
+    head, _, message = data.partition(b"\n\n")
+    tree = None
+    parents = []
+    author = committer = b""
+    for line in head.split(b"\n"):
+        key, _, value = line.partition(b" ")
+        if key == b"tree":
+            tree = bytes.fromhex(value.decode())
+        elif key == b"parent":
+            parents.append(bytes.fromhex(value.decode()))
+        elif key == b"author":
+            author = value
+        elif key == b"committer":
+            committer = value
+    if tree is None:
+        raise ObjectError("commit without a tree")
+    return Commit(tree, tuple(parents), author, committer, message)
+
+
+def format_commit(commit: Commit) -> bytes:
+    lines = [b"tree " + commit.tree.hex().encode()]
+    lines += [b"parent " + p.hex().encode() for p in commit.parents]
+    lines.append(b"author " + commit.author)
+    lines.append(b"committer " + commit.committer)
+    return b"\n".join(lines) + b"\n\n" + commit.message
+
+
+def parse_tree(data, oid_size: int) -> list[TreeEntry]:
+    entries = []
+    pos, end = 0, len(data)
+    data = bytes(data)
+    while pos < end:
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        mode = int(data[pos:space], 8)
+        name = data[space + 1:nul]
+        pos = nul + 1 + oid_size
+        entries.append(TreeEntry(mode, name, data[nul + 1:pos]))
+    return entries
+
+
+class ObjectReader(ABC):
+    """Base of the object backends: typed accessors built on ``read``."""
+
+    oid_size: int
+
+    @abstractmethod
+    def read(self, oid: bytes) -> tuple[int, memoryview]:
+        """``(type, content)`` of an object; raises ``MissingObject``."""
+
+    @abstractmethod
+    def write(self, kind: int, data) -> bytes:
+        """Store an object and return its ID."""
+
+    @abstractmethod
+    def __contains__(self, oid: bytes) -> bool: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+    def read_many(self, oids) -> list:
+        """``(type, content)`` for each of ``oids``, ``None`` where missing.
+
+        Backends that can answer several lookups in one round trip override
+        this; the default reads them one by one.
+        """
+        out = []
+        for oid in oids:
+            try:
+                out.append(self.read(oid))
+            except MissingObject:
+                out.append(None)
+        return out
+
+    def commit(self, oid: bytes) -> Commit:
+        kind, data = self.read(oid)
+        if kind != OBJ_COMMIT:
+            raise ObjectError(f"{oid.hex()} is not a commit")
+        return parse_commit(data)
+
+    def tree(self, oid: bytes) -> list[TreeEntry]:
+        kind, data = self.read(oid)
+        if kind != OBJ_TREE:
+            raise ObjectError(f"{oid.hex()} is not a tree")
+        return parse_tree(data, self.oid_size)
+
+
+def tree_sort_key(entry: TreeEntry) -> bytes:
+    # git orders subtrees as if their name ended with "/".
+    return entry.name + b"/" if entry.is_tree else entry.name
+
+
+def format_tree(entries) -> bytes:
+    return b"".join(
+        b"%o %s\0" % (e.mode, e.name) + e.oid for e in sorted(entries, key=tree_sort_key)
+    )
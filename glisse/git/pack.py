@@ -0,0 +1,203 @@
+"""Packfile access over ``mmap``.
+
+``PackIndex`` reads a version 2 ``.idx`` file and ``Pack`` the matching
+``.pack``.  Both keep their file mapped; object IDs and compressed entries
+are read straight out of the mapping through ``memoryview`` slices, so the
+only copies made are the inflated objects themselves.
+"""
+
+import mmap
+import struct
+import zlib
+
+from glisse.git.objects import OBJ_OFS_DELTA, OBJ_REF_DELTA, ObjectError
+
+_IDX_MAGIC = b"\377tOc"
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+# Compressed input fed to zlib per step once an entry outgrows its first guess.
+_CHUNK = 64 * 1024
+
+
+def _map(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackIndex:
+    def __init__(self, path: str, oid_size: int):
+        self.path = path
+        self.oid_size = oid_size
+        self._map = _map(path)
+        view = self._view = memoryview(self._map)
+        if view[:4] != _IDX_MAGIC or _U32.unpack_from(view, 4)[0] != 2:
+            raise ObjectError(f"{path}: unsupported pack index version")
+        self._fanout = struct.unpack_from(">256I", view, 8)
+        self.count = count = self._fanout[255]
+        self._oids = 8 + 256 * 4
+        self._crcs = self._oids + count * oid_size
+        self._offsets = self._crcs + count * 4
+        self._large = self._offsets + count * 4
+
+    def __len__(self):
+        return self.count
+
+    def find(self, oid: bytes) -> int:
+        """Position of ``oid`` in the index, or -1."""
+        first = oid[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        view, base, size = self._view, self._oids, self.oid_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = base + mid * size
+            probe = view[start:start + size]
+            if probe == oid:
+                return mid
+            if bytes(probe) < oid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return -1
+
+    def oid(self, pos: int) -> bytes:
+        start = self._oids + pos * self.oid_size
+        return bytes(self._view[start:start + self.oid_size])
+
+    def offset(self, pos: int) -> int:
+        off = _U32.unpack_from(self._view, self._offsets + pos * 4)[0]
+        if off & 0x80000000:
+            off = _U64.unpack_from(self._view, self._large + (off & 0x7FFFFFFF) * 8)[0]
+        return off
+
+    def __iter__(self):
+        """Object IDs in sorted order."""
+        for pos in range(self.count):
+            yield self.oid(pos)
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+
+class Pack:
+    def __init__(self, path: str, oid_size: int):
+        self.path = path
+        self.index = PackIndex(path[:-5] + ".idx", oid_size)
+        self._map = _map(path)
+        self._view = memoryview(self._map)
+        if self._view[:4] != b"PACK":
+            raise ObjectError(f"{path}: not a packfile")
+
+    def __contains__(self, oid: bytes) -> bool:
+        return self.index.find(oid) >= 0
+
+    def offset(self, oid: bytes) -> int:
+        pos = self.index.find(oid)
+        return -1 if pos < 0 else self.index.offset(pos)
+
+    def entry(self, offset: int):
+        """``(type, size, data_offset, base)`` of the entry at ``offset``.
+
+        ``base`` is the base offset for an offset delta, the base object ID
+        for a ref delta and ``None`` otherwise.
+        """
+        view = self._view
+        start = offset
+        c = view[offset]
+        offset += 1
+        kind = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        while c & 0x80:
+            c = view[offset]
+            offset += 1
+            size |= (c & 0x7F) << shift
+            shift += 7
+        base = None
+        if kind == OBJ_OFS_DELTA:
+            c = view[offset]
+            offset += 1
+            rel = c & 0x7F
+            while c & 0x80:
+                c = view[offset]
+                offset += 1
+                rel = ((rel + 1) << 7) | (c & 0x7F)
+            base = start - rel
+        elif kind == OBJ_REF_DELTA:
+            end = offset + self.index.oid_size
+            base = bytes(view[offset:end])
+            offset = end
+        return kind, size, offset, base
+
+    def inflate(self, data_offset: int, size: int) -> bytes:
+        """Inflate the entry whose zlib stream starts at ``data_offset``.
+
+        zlib copies whatever input it does not consume, so the stream is fed
+        in pieces rather than as the rest of the pack: first ``size`` plus
+        room for the zlib framing, which holds any object deflate cannot
+        shrink, then ``_CHUNK`` at a time until the stream ends.
+        """
+        d = zlib.decompressobj()
+        view = self._view
+        pos, step = data_offset, size + 64
+        parts = []
+        while not d.eof and pos < len(view):
+            parts.append(d.decompress(view[pos:pos + step]))
+            pos += step
+            step = _CHUNK
+        out = b"".join(parts)
+        if len(out) != size:
+            raise ObjectError(f"{self.path}: truncated entry at {data_offset}")
+        return out
+
+    def close(self):
+        self.index.close()
+        self._view.release()
+        self._map.close()
+
+
+def apply_delta(base, delta) -> bytes:
+    """Rebuild an object from its ``base`` and a git binary ``delta``."""
+    pos = 0
+    src_size, pos = _delta_size(delta, pos)
+    dst_size, pos = _delta_size(delta, pos)
+    if src_size != len(base):
+        raise ObjectError("delta base size mismatch")
+    out = bytearray()
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            off = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    off |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if not size:
+                size = 0x10000
+            out += base[off:off + size]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise ObjectError("invalid delta opcode 0")
+    if len(out) != dst_size:
+        raise ObjectError("delta result size mismatch")
+    return bytes(out)
+
+
+def _delta_size(delta, pos: int):
+    size = shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
@@ -0,0 +1,88 @@
+"""Path patterns and tree diffs limited to them.
+
+Patterns are ``/``-separated paths from the repository root.  ``*`` and
+``?`` match within one component, ``**`` across any number of them, and a
+pattern matching a directory matches everything below it, so
+``services/api`` and ``services/api/**`` are the same filter.
+"""
+
+import re
+from functools import lru_cache
+
+_WILDCARD = re.compile(rb"\*\*/|/\*\*$|\*\*|\*|\?")
+_TRANSLATE = {b"**/": rb"(?:.*/)?", b"/**": rb"(?:/.*)?", b"**": rb".*", b"*": rb"[^/]*", b"?": rb"[^/]"}
+
+
+class PathSpec:
+    def __init__(self, patterns):
+        self.patterns = tuple(p.encode() if isinstance(p, str) else p for p in patterns)
+        self._regex = re.compile(b"|".join(_translate(p) for p in self.patterns), re.DOTALL)
+        # Leading components of each pattern without a wildcard.
+        self.prefixes = tuple(_literal_prefix(p) for p in self.patterns)
+
+    def match(self, path: bytes) -> bool:
+        return self._regex.fullmatch(path) is not None
+
+    def descend(self, folder: bytes) -> bool:
+        """Whether anything under directory ``folder`` can match."""
+        for prefix in self.prefixes:
+            if (
+                not prefix
+                or folder == prefix
+                or folder.startswith(prefix + b"/")
+                or prefix.startswith(folder + b"/")
+            ):
+                return True
+        return False
+
+    def __repr__(self):
+        return f"PathSpec({[p.decode(errors='replace') for p in self.patterns]!r})"
+
+
+@lru_cache(maxsize=256)
+def path_spec(patterns: tuple) -> PathSpec:
+    """``PathSpec`` for ``patterns``, shared between lookups."""
+    return PathSpec(patterns)
+
+
+def changed_paths(objects, old: bytes | None, new: bytes | None, spec: PathSpec | None = None, prefix: bytes = b""):
+    """Paths of the files that differ between trees ``old`` and ``new``.
+
+    Subtrees with equal IDs are skipped without being read, and with a
+    ``spec`` only directories that can hold a match are entered.
+    """
+    if old == new:
+        return
+    before = {e.name: e for e in objects.tree(old)} if old is not None else {}
+    after = {e.name: e for e in objects.tree(new)} if new is not None else {}
+    for name in sorted(before.keys() | after.keys()):
+        b, a = before.get(name), after.get(name)
+        if b == a:
+            continue
+        path = prefix + name
+        b_tree = b.oid if b is not None and b.is_tree else None
+        a_tree = a.oid if a is not None and a.is_tree else None
+        if (b_tree is not None or a_tree is not None) and (spec is None or spec.descend(path)):
+            yield from changed_paths(objects, b_tree, a_tree, spec, path + b"/")
+        if (b is not None and not b.is_tree) or (a is not None and not a.is_tree):
+            if spec is None or spec.match(path):
+                yield path
+
+
+def _translate(pattern: bytes) -> bytes:
+    out, pos = [], 0
+    for m in _WILDCARD.finditer(pattern):
+        out.append(re.escape(pattern[pos:m.start()]))
+        out.append(_TRANSLATE[m.group()])
+        pos = m.end()
+    out.append(re.escape(pattern[pos:]))
+    return b"(?:" + b"".join(out) + rb")(?:/.*)?"
+
+
+def _literal_prefix(pattern: bytes) -> bytes:
+    parts = []
+    for part in pattern.strip(b"/").split(b"/"):
+        if b"*" in part or b"?" in part:
+            break
+        parts.append(part)
+    return b"/".join(parts)
@@ -0,0 +1,612 @@
+"""Reading and updating refs.
+
+Updates follow git's lockfile protocol: ``<ref>.lock`` is created
+exclusively, the expected old value is checked while holding it, and the
+new value is renamed into place.  A concurrent git process therefore either
+waits for us or makes us fail; it never sees a half-written ref.
+``RefTransaction`` takes the locks of every ref it updates before it
+changes any of them.
+
+``RefSnapshot`` keeps ``packed-refs`` and the loose branches parsed in
+memory for as long as none of their files change.  Its ``RefTrie`` of
+branch names answers glob patterns such as ``release/*`` by walking only
+the components the pattern can match.
+"""
+
+import os
+import re
+import threading
+from functools import lru_cache
+
+from glisse.git.objects import ObjectError
+
+
+class RefError(ObjectError):
+    pass
+
+
+class RefConflict(RefError):
+    """The ref did not have the expected old value."""
+
+
+def read_ref(git_dir: str, name: str, packed=None) -> bytes | None:
+    """Object ID ``name`` points to, following symbolic refs.
+
+    ``packed`` is ``packed-refs`` as a name -> object ID mapping, if the
+    caller has it parsed already; otherwise the file is scanned.
+    """
+    for _ in range(5):
+        try:
+            with open(os.path.join(git_dir, name), "rb") as f:
+                value = f.read().strip()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            if packed is not None:
+                return packed.get(name)
+            return _packed_ref(git_dir, name.encode())
+        if not value.startswith(b"ref: "):
+            return bytes.fromhex(value.decode())
+        name = value[5:].decode()
+    raise RefError(f"symbolic ref loop at {name}")
+
+
+class RefTransaction:
+    """Ref updates committed together or not at all.
+
+    ``prepare`` locks every ref, checks every expected old value and
+    writes the new values into the lockfiles; ``commit`` then renames them
+    into place.  Nothing is changed unless all of them could be locked
+    and checked.  Like ``git update-ref --stdin``, whose ``start``,
+    ``prepare`` and ``commit`` these mirror, updates leave ``packed-refs``
+    alone: a loose ref shadows its packed value.  Only deleting a packed
+    ref rewrites it.  Readers that do not take locks may see the renames
+    land one after another.
+
+    With ``snapshot`` (a ``RefSnapshot``), packed values are looked up in
+    it instead of scanning ``packed-refs``, and committed updates are
+    applied to it.
+    """
+
+    def __init__(self, git_dir: str, snapshot: "RefSnapshot | None" = None):
+        self.git_dir = git_dir
+        self.snapshot = snapshot
+        self._updates: dict[str, tuple[bytes | None, bytes | None]] = {}
+        self._locks: list[str] = []
+        self._packed_lock: str | None = None
+        self._prepared = False
+
+    def update(self, name: str, new: bytes | None, old: bytes | None) -> None:
+        """Point ``name`` at ``new`` (``None``: delete) if it points at ``old``."""
+        if self._prepared:
+            raise RefError("transaction already prepared")
+        if name in self._updates:
+            raise RefError(f"{name} updated twice in one transaction")
+        self._updates[name] = (new, old)
+
+    def prepare(self) -> None:
+        """Lock and check every ref; raise, holding nothing, if any cannot be updated."""
+        if self._prepared:
+            return
+        git_dir = self.git_dir
+        packed = self.snapshot.packed() if self.snapshot is not None else None
+        try:
+            for name in sorted(self._updates):
+                new, old = self._updates[name]
+                lock = _lock(git_dir, name)
+                self._locks.append(lock)
+                path = os.path.join(git_dir, name)
+                if os.path.isdir(path):
+                    raise RefError(f"{name} is a directory of refs")
+                current = self._current(name, path, packed)
+                if current != old:
+                    raise RefConflict(
+                        f"{name} is at {current.hex() if current else 'nothing'}, "
+                        f"expected {old.hex() if old else 'nothing'}"
+                    )
+                if new is not None:
+                    _write(lock, new.hex().encode() + b"\n")
+                elif self._packed_lock is None and self._is_packed(name, packed):
+                    self._packed_lock = _lock(git_dir, "packed-refs")
+        except BaseException:
+            self.abort()
+            raise
+        self._prepared = True
+
+    def commit(self) -> None:
+        self.prepare()
+        git_dir = self.git_dir
+        updates = self._updates
+        snapshot = self.snapshot
+        try:
+            if self._packed_lock is not None:
+                refs = _read_packed(git_dir)
+                for name, (new, _) in updates.items():
+                    if new is None:
+                        refs.pop(name.encode(), None)
+                _write_packed(self._packed_lock, refs)
+                os.replace(self._packed_lock, os.path.join(git_dir, "packed-refs"))
+                self._packed_lock = None
+            for name in sorted(updates):
+                path = os.path.join(git_dir, name)
+                lock = path + ".lock"
+                if updates[name][0] is None:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    os.unlink(lock)
+                else:
+                    os.replace(lock, path)
+                self._locks.remove(lock)
+        except BaseException:
+            if snapshot is not None:
+                snapshot.invalidate()
+            raise
+        else:
+            if snapshot is not None:
+                snapshot.updated((name, new) for name, (new, _) in updates.items())
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Release every lock without changing anything not yet committed."""
+        locks, self._locks = self._locks, []
+        if self._packed_lock is not None:
+            locks.append(self._packed_lock)
+            self._packed_lock = None
+        for lock in locks:
+            try:
+                os.unlink(lock)
+            except FileNotFoundError:
+                pass
+        self._updates = {}
+        self._prepared = False
+
+    def _current(self, name: str, path: str, packed) -> bytes | None:
+        try:
+            with open(path, "rb") as f:
+                value = f.read().strip()
+        except FileNotFoundError:
+            if packed is not None:
+                return packed.get(name)
+            return _packed_ref(self.git_dir, name.encode())
+        if value.startswith(b"ref: "):
+            raise RefError(f"{name} is a symbolic ref")
+        return bytes.fromhex(value.decode())
+
+    def _is_packed(self, name: str, packed) -> bool:
+        if packed is not None:
+            return name in packed
+        return _packed_ref(self.git_dir, name.encode()) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class RefSnapshot:
+    """Branches and packed refs, re-read only when their files change.
+
+    Freshness is checked against the ``stat`` of ``packed-refs`` and of
+    the directories under ``refs/heads``: git writes refs by renaming a
+    lockfile into place, which always changes the directory.  ``get`` only
+    checks the directories on the way to the branch asked for; ``refs``
+    and ``trie`` check them all.  Only what changed is read again: a
+    directory whose stamp moved has its own entries re-listed, and a new
+    ``packed-refs`` is compared with the last one.  The refs and the
+    ``RefTrie`` are patched with the difference rather than rebuilt.
+
+    A ``RefTransaction`` given the snapshot applies its updates to it in
+    place and re-stats only the directories it wrote to.  A change another
+    process makes to one of those directories at that very moment can go
+    unseen until the directory changes again.  ``version`` is bumped on
+    every change.
+    """
+
+    def __init__(self, git_dir: str):
+        self.git_dir = git_dir
+        self.version = 0
+        self._packed: dict[str, bytes] = {}
+        self._packed_stamp = _UNREAD
+        self._refs: dict[str, bytes] = {}
+        # Per directory under refs/heads: its stamp, its subdirectories
+        # and the loose branches directly in it.
+        self._stamps: dict[str, tuple] | None = None
+        self._subdirs: dict[str, set[str]] = {}
+        self._loose: dict[str, dict[str, bytes]] = {}
+        # Inode of each loose branch file as last read: git replaces the
+        # file to move a branch, so an unchanged inode is an unchanged ref.
+        self._inodes: dict[str, int] = {}
+        self._trie: RefTrie | None = None
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> bytes | None:
+        """Object ID of ``name``, a branch or a packed ref."""
+        with self._lock:
+            self._load_packed()
+            if self._stamps is None:
+                self._load()
+            elif name.startswith("refs/heads/"):
+                self._refresh(self._path(name))
+            return self._refs.get(name)
+
+    def refs(self) -> dict[str, bytes]:
+        """The current snapshot; do not modify it, it is updated in place."""
+        with self._lock:
+            self._load_packed()
+            if self._stamps is None:
+                self._load()
+            else:
+                self._refresh(None)
+            return self._refs
+
+    def packed(self) -> dict[str, bytes]:
+        """``packed-refs`` as name -> object ID; do not modify it."""
+        with self._lock:
+            self._load_packed()
+            return self._packed
+
+    def trie(self) -> "RefTrie":
+        """Branch names of the current snapshot, without ``refs/heads/``."""
+        refs = self.refs()
+        with self._lock:
+            if self._trie is None:
+                self._trie = RefTrie(name[11:] for name in refs if name.startswith("refs/heads/"))
+            return self._trie
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stamps = None
+
+    def updated(self, changes) -> None:
+        """Apply ``(name, new object ID or None)`` pairs just committed to disk."""
+        git_dir = self.git_dir
+        with self._lock:
+            if self._stamps is None:
+                return
+            packed = os.path.join(git_dir, "packed-refs")
+            for name, new in changes:
+                if new is None and self._packed.pop(name, None) is not None:
+                    self._packed_stamp = _stamp(packed)
+                    if not name.startswith("refs/heads/"):
+                        self._refs.pop(name, None)
+                if not name.startswith("refs/heads/"):
+                    continue
+                folder = os.path.join(git_dir, "refs", "heads")
+                for part in name.split("/")[2:-1]:
+                    self._stamps[folder] = _stamp(folder)
+                    child = os.path.join(folder, part)
+                    if child not in self._stamps:
+                        self._subdirs.setdefault(folder, set()).add(child)
+                    folder = child
+                self._stamps[folder] = _stamp(folder)
+                loose = self._loose.setdefault(folder, {})
+                self._inodes.pop(name, None)
+                if new is None:
+                    loose.pop(name, None)
+                    if self._refs.pop(name, None) is not None:
+                        self._trie_discard(name)
+                else:
+                    loose[name] = new
+                    if name not in self._refs:
+                        self._trie_add(name)
+                    self._refs[name] = new
+            self.version += 1
+
+    def _path(self, name: str) -> list[str]:
+        """The directories a loose ``name`` would be in, outermost first."""
+        folder = os.path.join(self.git_dir, "refs", "heads")
+        out = [folder]
+        for part in name.split("/")[2:-1]:
+            folder = os.path.join(folder, part)
+            out.append(folder)
+        return out
+
+    def _refresh(self, folders) -> None:
+        """Re-read the directories among ``folders`` (``None``: all) that changed.
+
+        A directory missing when its parent was read is new only if the
+        parent changed too, so the check stops at the first unknown one.
+        """
+        stamps = self._stamps
+        changed = []
+        for folder in list(stamps) if folders is None else folders:
+            known = stamps.get(folder, _UNREAD)
+            if known is _UNREAD:
+                break
+            if _stamp(folder) != known:
+                changed.append(folder)
+        for folder in changed:
+            if folder in self._stamps:
+                self._scan(folder)
+        if changed:
+            self.version += 1
+
+    def _load_packed(self) -> None:
+        path = os.path.join(self.git_dir, "packed-refs")
+        # Stamp before reading, so a change made during the read is seen
+        # on the next lookup rather than lost.
+        stamp = _stamp(path)
+        if stamp == self._packed_stamp:
+            return
+        old = self._packed
+        new = self._packed = {name.decode(): oid for name, (oid, _) in _read_packed(self.git_dir).items()}
+        self._packed_stamp = stamp
+        if self._stamps is None:
+            return
+        # Loose branches shadow their packed values.
+        for name in old.keys() - new.keys():
+            if not self._is_loose(name):
+                self._refs.pop(name, None)
+                self._trie_discard(name)
+        for name, oid in new.items():
+            if old.get(name) != oid and not self._is_loose(name):
+                if name not in self._refs:
+                    self._trie_add(name)
+                self._refs[name] = oid
+        self.version += 1
+
+    def _load(self) -> None:
+        self._refs = dict(self._packed)
+        self._stamps, self._subdirs, self._loose, self._inodes = {}, {}, {}, {}
+        self._trie = None
+        heads = os.path.join(self.git_dir, "refs", "heads")
+        self._scan(heads)
+        self._stamps.setdefault(heads, None)
+        self.version += 1
+
+    def _scan(self, folder: str) -> None:
+        """Read the loose branches directly in ``folder`` and its new subdirectories."""
+        git_dir = self.git_dir
+        # Stamp before listing, as in ``_load_packed``.
+        stamp = _stamp(folder)
+        try:
+            entries = list(os.scandir(folder))
+        except (FileNotFoundError, NotADirectoryError):
+            entries = None
+        if entries is None or stamp is None:
+            self._drop(folder)
+            return
+        known, inodes = self._loose.get(folder, {}), self._inodes
+        loose, subdirs = {}, set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.add(entry.path)
+            elif not entry.name.endswith(".lock"):
+                name = os.path.relpath(entry.path, git_dir).replace(os.sep, "/")
+                inode = entry.inode()
+                if name in known and inodes.get(name) == inode:
+                    loose[name] = known[name]
+                    continue
+                oid = read_ref(git_dir, name, self._packed)
+                if oid is not None:
+                    loose[name] = oid
+                    inodes[name] = inode
+        for gone in self._subdirs.get(folder, set()) - subdirs:
+            self._drop(gone)
+        self._stamps[folder] = stamp
+        self._subdirs[folder] = subdirs
+        self._set_loose(folder, loose)
+        for sub in subdirs:
+            if sub not in self._stamps or self._stamps[sub] is None:
+                self._scan(sub)
+
+    def _drop(self, folder: str) -> None:
+        """Forget ``folder`` and everything below it, once git removed it."""
+        for sub in self._subdirs.pop(folder, ()):
+            self._drop(sub)
+        self._set_loose(folder, {})
+        if folder == os.path.join(self.git_dir, "refs", "heads"):
+            self._stamps[folder] = None
+        else:
+            self._stamps.pop(folder, None)
+
+    def _set_loose(self, folder: str, loose: dict[str, bytes]) -> None:
+        """Make ``loose`` the branches of ``folder``; removed ones fall back to packed values."""
+        old = self._loose.pop(folder, {})
+        if loose:
+            self._loose[folder] = loose
+        refs = self._refs
+        for name in old.keys() - loose.keys():
+            self._inodes.pop(name, None)
+            packed = self._packed.get(name)
+            if packed is None:
+                refs.pop(name, None)
+                self._trie_discard(name)
+            else:
+                refs[name] = packed
+        for name, oid in loose.items():
+            if name not in refs:
+                self._trie_add(name)
+            refs[name] = oid
+
+    def _is_loose(self, name: str) -> bool:
+        if not name.startswith("refs/heads/"):
+            return False
+        return name in self._loose.get(self._path(name)[-1], ())
+
+    def _trie_add(self, name: str) -> None:
+        if self._trie is not None and name.startswith("refs/heads/"):
+            self._trie.add(name[11:])
+
+    def _trie_discard(self, name: str) -> None:
+        if self._trie is not None and name.startswith("refs/heads/"):
+            self._trie.discard(name[11:])
+
+
+class _Node:
+    __slots__ = ("children", "name")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.name: str | None = None
+
+
+class RefTrie:
+    """Ref names as a tree of their ``/``-separated components.
+
+    In patterns, ``*`` and ``?`` match within one component and ``**``
+    across any number of them.  Literal components are a dictionary
+    lookup, so ``release/*`` reads the children of ``release`` and never
+    looks at ``feature/...``.
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self, names=()):
+        self._root = _Node()
+        self._size = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, name: str) -> None:
+        node = self._root
+        for part in name.split("/"):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _Node()
+            node = child
+        if node.name is None:
+            self._size += 1
+        node.name = name
+
+    def discard(self, name: str) -> None:
+        """Remove ``name``, and the components only it was using."""
+        path = [self._root]
+        parts = name.split("/")
+        for part in parts:
+            node = path[-1].children.get(part)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].name is None:
+            return
+        path[-1].name = None
+        self._size -= 1
+        for i in range(len(parts), 0, -1):
+            if path[i].children or path[i].name is not None:
+                break
+            del path[i - 1].children[parts[i - 1]]
+
+    def match(self, pattern: str) -> list[str]:
+        """Names matching ``pattern``, sorted."""
+        parts = pattern.split("/")
+        found = set()
+        seen = set()
+        todo = [(self._root, 0)]
+        while todo:
+            node, i = todo.pop()
+            if (id(node), i) in seen:
+                continue
+            seen.add((id(node), i))
+            if i == len(parts):
+                if node.name is not None:
+                    found.add(node.name)
+                continue
+            part = parts[i]
+            if part == "**":
+                todo.append((node, i + 1))
+                todo.extend((child, i) for child in node.children.values())
+            elif "*" not in part and "?" not in part:
+                child = node.children.get(part)
+                if child is not None:
+                    todo.append((child, i + 1))
+            else:
+                regex = _component(part)
+                todo.extend(
+                    (child, i + 1) for key, child in node.children.items() if regex.fullmatch(key)
+                )
+        return sorted(found)
+
+
+@lru_cache(maxsize=256)
+def _component(part: str) -> re.Pattern:
+    regex = "".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in part)
+    return re.compile(regex, re.DOTALL)
+
+
+# Stamp of a file never looked at, unlike ``None`` for a missing one.
+_UNREAD = object()
+
+
+def _stamp(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _lock(git_dir: str, name: str) -> str:
+    lock = os.path.join(git_dir, name) + ".lock"
+    try:
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+    except (FileExistsError, NotADirectoryError):
+        raise RefError(f"{name} conflicts with an existing ref") from None
+    try:
+        os.close(os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+    except FileExistsError:
+        raise RefError(f"{name} is locked") from None
+    return lock
+
+
+def _write(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_packed(git_dir: str) -> dict[bytes, tuple[bytes, bytes | None]]:
+    """``packed-refs`` as name -> (object ID, peeled object ID or ``None``)."""
+    refs = {}
+    last = None
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), "rb") as f:
+            for line in f:
+                line = line.rstrip(b"\n")
+                if line[:1] == b"#":
+                    continue
+                if line[:1] == b"^":
+                    if last is not None:
+                        refs[last] = (refs[last][0], bytes.fromhex(line[1:].decode()))
+                    continue
+                oid, _, last = line.partition(b" ")
+                refs[last] = (bytes.fromhex(oid.decode()), None)
+    except FileNotFoundError:
+        pass
+    return refs
+
+
+def _write_packed(path: str, refs) -> None:
+    # Refs written here carry no peeled value, so only "sorted" is claimed:
+    # git then peels what it has no "^" line for instead of assuming it
+    # is not a tag.
+    out = [b"# pack-refs with: sorted \n"]
+    for name in sorted(refs):
+        oid, peeled = refs[name]
+        out.append(b"%s %s\n" % (oid.hex().encode(), name))
+        if peeled is not None:
+            out.append(b"^%s\n" % peeled.hex().encode())
+    _write(path, b"".join(out))
+
+
+def _packed_ref(git_dir: str, name: bytes) -> bytes | None:
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), "rb") as f:
+            for line in f:
+                if line[:1] in (b"#", b"^"):
+                    continue
+                oid, _, ref = line.rstrip(b"\n").partition(b" ")
+                if ref == name:
+                    return bytes.fromhex(oid.decode())
+    except FileNotFoundError:
+        pass
+    return None
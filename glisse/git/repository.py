@@ -0,0 +1,218 @@
+"""A git repository as a promotion backend."""
+
+import os
+import threading
+import time
+
+from glisse.git.ancestry import Ancestry
+from glisse.git.bitmap import ReachabilityIndex
+from glisse.git.bloom import BloomIndex
+from glisse.git.cache import SHARED, CachedObjects
+from glisse.git.catfile import CatFilePool
+from glisse.git.commitgraph import CommitGraph, graph_stamp
+from glisse.git.merge import NotFastForward, merge_trees
+from glisse.git.objects import OBJ_COMMIT, Commit, ObjectError, format_commit
+from glisse.git.paths import changed_paths, path_spec
+from glisse.git.refs import RefSnapshot, RefTransaction, read_ref
+from glisse.git.store import ObjectStore
+from glisse.pipeline import interned
+
+# Object backends selectable by name.
+BACKENDS = {"native": ObjectStore, "cat-file": CatFilePool}
+
+# Bookkeeping refs: the source commit of the last merge commit promoted
+# into each branch.  A fast-forward leaves it alone, its tip being the
+# promoted commit itself.
+PROMOTED_PREFIX = "refs/glisse/promoted/"
+
+
+def find_git_dir(path: str) -> str:
+    """Canonical path of the git directory of the repository at ``path``."""
+    path = os.path.realpath(path)
+    dot_git = os.path.join(path, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    if os.path.isfile(dot_git):
+        with open(dot_git) as f:
+            line = f.readline().strip()
+        if line.startswith("gitdir:"):
+            return os.path.realpath(os.path.join(path, line[7:].strip()))
+    if os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "objects")):
+        return path
+    raise ObjectError(f"{path} is not a git repository")
+
+
+class Repository:
+    """A repository as a promotion ``Backend``.
+
+    ``objects`` is a backend name from ``BACKENDS`` or an object reader.
+    Commits and trees are cached in ``cache`` (an ``ObjectCache``, by default
+    the one shared by the whole process; ``None`` to read through).
+    Merge commits are authored and committed by ``identity`` (``Name
+    <email>``), by default taken from ``GIT_COMMITTER_NAME`` and
+    ``GIT_COMMITTER_EMAIL``.
+    """
+
+    def __init__(self, path: str, objects="native", identity: str | None = None, cache=SHARED):
+        self.path = path
+        self.identity = identity or "{} <{}>".format(
+            os.environ.get("GIT_COMMITTER_NAME", "glisse"),
+            os.environ.get("GIT_COMMITTER_EMAIL", "glisse@localhost"),
+        )
+        self.git_dir = find_git_dir(path)
+        if isinstance(objects, str):
+            objects = BACKENDS[objects](self.git_dir)
+        if cache is not None:
+            objects = CachedObjects(objects, cache)
+        self.objects = objects
+        self.oid_size = self.objects.oid_size
+        self.graph = None
+        self._graph_stamp = None
+        self._graph_lock = threading.Lock()
+        self.refresh()
+        self.refs = RefSnapshot(self.git_dir)
+
+    def refresh(self) -> None:
+        """Re-open the commit-graph if git has written a new one since.
+
+        Commits outside the graph have an infinite generation and no Bloom
+        filter, so a graph read once would prune less and less over the
+        life of a daemon.  The walkers are rebuilt on the new graph, which
+        drops what they had parsed from the object store and the bitmap
+        slots of commits the new graph numbers itself.  The old graph is
+        not closed, as a walk in another thread may still be reading it;
+        its files are unmapped once it is dropped.
+        """
+        objects_dir = os.path.join(self.git_dir, "objects")
+        stamp = graph_stamp(objects_dir)
+        if stamp == self._graph_stamp:
+            return
+        with self._graph_lock:
+            if stamp == self._graph_stamp:
+                return
+            graph = CommitGraph.open(objects_dir, self.oid_size)
+            self.ancestry = Ancestry(self.objects, graph)
+            self.reachability = ReachabilityIndex(self.objects, graph)
+            self.bloom = BloomIndex(self.objects, graph)
+            self.graph = graph
+            self._graph_stamp = stamp
+
+    def read_ref(self, name: str) -> bytes | None:
+        if name.startswith("refs/heads/"):
+            return self.refs.get(name)
+        return read_ref(self.git_dir, name, self.refs.packed())
+
+    def tip(self, branch: str) -> bytes:
+        """Tip of ``branch``; stages naming it are told when it moved.
+
+        Those are ``branch(name, repo)`` for this repository and plain
+        ``branch(name)``, which stands for whichever repository is asked.
+        """
+        oid = self.read_ref(f"refs/heads/{branch}")
+        if oid is None:
+            raise ObjectError(f"no branch {branch!r}")
+        for stage in (interned(self, branch), interned(None, branch)):
+            if stage is not None:
+                stage.moved(oid)
+        return oid
+
+    def branches(self, pattern: str) -> list[str]:
+        """Names of the branches matching glob ``pattern``, e.g. ``release/*``."""
+        return self.refs.trie().match(pattern)
+
+    def tree(self, commit: bytes) -> bytes:
+        return self.objects.commit(commit).tree
+
+    def merge(self, source: str, target: str, fast_forward_only: bool = False) -> bytes:
+        """Merge branch ``source`` into ``target`` without a worktree or index.
+
+        When ``target`` is an ancestor of ``source`` it is just moved to the
+        source tip with a single compare-and-swap, and no object is written.
+        Otherwise the merge commit and the ``PROMOTED_PREFIX`` bookkeeping
+        ref are committed in one ref transaction.  Criss-cross histories are
+        merged against their first merge base rather than a recursively
+        merged virtual one.
+        """
+        src, dst = self.tip(source), self.tip(target)
+        if self.is_ancestor(src, dst):
+            return dst
+        if self.is_ancestor(dst, src):
+            self._advance(target, src, dst)
+            return src
+        if fast_forward_only:
+            raise NotFastForward(f"{target} has diverged from {source}")
+        base = self.merge_base(src, dst)
+        tree = merge_trees(
+            self.objects,
+            self.tree(base) if base is not None else None,
+            self.tree(dst),
+            self.tree(src),
+        )
+        signature = self._signature()
+        message = f"Merge branch '{source}' into {target}\n".encode()
+        commit = self.objects.write(
+            OBJ_COMMIT, format_commit(Commit(tree, (dst, src), signature, signature, message))
+        )
+        self._advance(target, commit, dst, src)
+        return commit
+
+    def transaction(self) -> RefTransaction:
+        """Ref updates to commit atomically, e.g. ``with repo.transaction() as tx:``.
+
+        This is a transaction of its own: tags that hooks create with it
+        land after the branch they were merged into has already moved.
+        """
+        return RefTransaction(self.git_dir, self.refs)
+
+    def is_ancestor(self, ancestor: bytes, descendant: bytes) -> bool:
+        self.refresh()
+        return self.ancestry.is_ancestor(ancestor, descendant)
+
+    def merge_base(self, a: bytes, b: bytes) -> bytes | None:
+        self.refresh()
+        return self.ancestry.merge_base(a, b)
+
+    def pending(self, source: str, target: str) -> int:
+        """Commits on branch ``source`` that are not yet in branch ``target``."""
+        self.refresh()
+        return self.reachability.pending(self.tip(source), self.tip(target))
+
+    def touches(self, base: bytes | None, commit: bytes, paths) -> bool:
+        """Whether a commit in ``commit`` but not in ``base`` changes a path matching ``paths``.
+
+        Changed-path Bloom filters rule out most commits without reading
+        them; the rest are diffed against their parents, restricted to the
+        directories ``paths`` can match.  A merge commit counts only if it
+        differs from every parent.
+        """
+        self.refresh()
+        spec = path_spec(tuple(paths))
+        objects = self.objects
+        for oid in self.reachability.missing(commit, base):
+            if not self.bloom.may_change(oid, spec):
+                continue
+            c = objects.commit(oid)
+            parents = [objects.commit(p).tree for p in c.parents] or [None]
+            if all(any(changed_paths(objects, p, c.tree, spec)) for p in parents):
+                return True
+        return False
+
+    def close(self) -> None:
+        if self.graph is not None:
+            self.graph.close()
+        self.objects.close()
+
+    def _advance(self, target: str, new: bytes, old: bytes, source: bytes | None = None) -> None:
+        """Move ``target``, and its bookkeeping ref to ``source`` if given, together."""
+        with self.transaction() as tx:
+            tx.update(f"refs/heads/{target}", new, old)
+            if source is not None:
+                promoted = PROMOTED_PREFIX + target
+                tx.update(promoted, source, self.read_ref(promoted))
+
+    def _signature(self) -> bytes:
+        now = time.time()
+        offset = time.localtime(now).tm_gmtoff // 60
+        sign = "+" if offset >= 0 else "-"
+        offset = abs(offset)
+        return f"{self.identity} {int(now)} {sign}{offset // 60:02d}{offset % 60:02d}".encode()
@@ -0,0 +1,175 @@
+"""Reading git objects without spawning ``git``.
+
+``ObjectStore`` looks objects up in the packs under ``objects/pack`` and
+then in the loose object directories, following ``info/alternates``.
+``read`` returns the object type and a ``memoryview`` of its content.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import zlib
+
+from glisse.git.objects import (
+    OBJ_OFS_DELTA,
+    OBJ_REF_DELTA,
+    TYPE_IDS,
+    TYPE_NAMES,
+    MissingObject,
+    ObjectError,
+    ObjectReader,
+)
+from glisse.git.pack import Pack, apply_delta
+
+
+def object_format(git_dir: str) -> int:
+    """Object ID size of the repository, from ``extensions.objectFormat``."""
+    try:
+        with open(os.path.join(git_dir, "config"), "rb") as f:
+            for line in f:
+                key, _, value = line.strip().partition(b"=")
+                if key.strip().lower() == b"objectformat" and value.strip().lower() == b"sha256":
+                    return 32
+    except FileNotFoundError:
+        pass
+    return 20
+
+
+class LooseObjects:
+    def __init__(self, objects_dir: str):
+        self.path = objects_dir
+
+    def _file(self, oid: bytes) -> str:
+        h = oid.hex()
+        return os.path.join(self.path, h[:2], h[2:])
+
+    def __contains__(self, oid: bytes) -> bool:
+        return os.path.exists(self._file(oid))
+
+    def read(self, oid: bytes):
+        try:
+            with open(self._file(oid), "rb") as f:
+                raw = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+        nul = raw.index(b"\0")
+        kind, _, size = raw[:nul].partition(b" ")
+        data = memoryview(raw)[nul + 1:]
+        if len(data) != int(size):
+            raise ObjectError(f"loose object {oid.hex()} has the wrong size")
+        return TYPE_IDS[kind], data
+
+    def write(self, kind: int, data, oid_size: int) -> bytes:
+        raw = b"%s %d\0" % (TYPE_NAMES[kind], len(data)) + bytes(data)
+        oid = (hashlib.sha1 if oid_size == 20 else hashlib.sha256)(raw).digest()
+        path = self._file(oid)
+        if os.path.exists(path):
+            return oid
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix="tmp_obj_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(raw))
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return oid
+
+
+class ObjectStore(ObjectReader):
+    def __init__(self, git_dir: str, oid_size: int | None = None):
+        self.git_dir = git_dir
+        self.oid_size = oid_size or object_format(git_dir)
+        self._dirs = _object_dirs(os.path.join(git_dir, "objects"))
+        self._loose = [LooseObjects(d) for d in self._dirs]
+        self._packs = []
+        self._pack_paths = set()
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Pick up packs written since the store was opened."""
+        for d in self._dirs:
+            for path in sorted(glob.glob(os.path.join(d, "pack", "*.pack"))):
+                if path not in self._pack_paths and os.path.exists(path[:-5] + ".idx"):
+                    self._packs.append(Pack(path, self.oid_size))
+                    self._pack_paths.add(path)
+
+    def __contains__(self, oid: bytes) -> bool:
+        return any(oid in p for p in self._packs) or any(oid in d for d in self._loose)
+
+    def write(self, kind: int, data) -> bytes:
+        """Store an object as a loose object and return its ID."""
+        return self._loose[0].write(kind, data, self.oid_size)
+
+    def read(self, oid: bytes) -> tuple[int, memoryview]:
+        """``(type, content)`` of an object."""
+        found = self._read_packed(oid)
+        if found is None:
+            for loose in self._loose:
+                found = loose.read(oid)
+                if found is not None:
+                    break
+            else:
+                self.refresh()
+                found = self._read_packed(oid)
+                if found is None:
+                    raise MissingObject(oid)
+        return found
+
+    def close(self) -> None:
+        for pack in self._packs:
+            pack.close()
+        self._packs.clear()
+        self._pack_paths.clear()
+
+    def _read_packed(self, oid: bytes):
+        for pack in self._packs:
+            offset = pack.offset(oid)
+            if offset >= 0:
+                kind, data = self._resolve(pack, offset)
+                return kind, memoryview(data)
+        return None
+
+    def _resolve(self, pack, offset: int):
+        deltas = []
+        while True:
+            kind, size, data_offset, base = pack.entry(offset)
+            if kind == OBJ_OFS_DELTA:
+                deltas.append(pack.inflate(data_offset, size))
+                offset = base
+            elif kind == OBJ_REF_DELTA:
+                deltas.append(pack.inflate(data_offset, size))
+                base_offset = pack.offset(base)
+                if base_offset < 0:
+                    kind, data = self.read(base)
+                    break
+                offset = base_offset
+            else:
+                data = pack.inflate(data_offset, size)
+                break
+        for delta in reversed(deltas):
+            data = apply_delta(data, delta)
+        return kind, data
+
+
+def _object_dirs(objects_dir: str) -> list[str]:
+    dirs, todo = [], [objects_dir]
+    while todo:
+        d = os.path.realpath(todo.pop(0))
+        if d in dirs or not os.path.isdir(d):
+            continue
+        dirs.append(d)
+        try:
+            with open(os.path.join(d, "info", "alternates")) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        todo.append(os.path.join(d, line))
+        except FileNotFoundError:
+            pass
+    return dirs
@@ -0,0 +1,148 @@
+"""Promotion history as a persistent cons list.
+
+Every ``prom`` step prepends one ``(commit, branch)`` pair; the tail is shared
+with the previous state, so a step costs one cell regardless of how long the
+chain already is.
+
+Cells live in a ``HistoryStore`` arena rather than as Python objects: the
+object IDs are packed back to back in one ``bytearray`` and the tail, branch
+and length columns are ``array``s, so a cell costs a few dozen bytes.
+``History`` is a small handle on a cell; ``Entry`` views and hex strings are
+only built when the history is read.
+"""
+
+import threading
+from array import array
+
+from glisse.oid import SHA1_SIZE, short
+
+
+class HistoryStore:
+    __slots__ = ("width", "nil", "_oids", "_tails", "_branches", "_lens", "_names", "_name_ids", "_lock")
+
+    def __init__(self, width: int = SHA1_SIZE):
+        self.width = width
+        self._oids = bytearray()
+        self._tails = array("q")
+        self._branches = array("I")
+        self._lens = array("I")
+        self._names: list[str] = []
+        self._name_ids: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.nil = History(self, -1)
+
+    def __len__(self):
+        return len(self._tails)
+
+    def cons(self, tail: int, oid: bytes, branch: str) -> int:
+        if len(oid) != self.width:
+            raise ValueError(f"expected a {self.width}-byte object id, got {len(oid)} bytes")
+        with self._lock:
+            name_id = self._name_ids.get(branch)
+            if name_id is None:
+                name_id = self._name_ids[branch] = len(self._names)
+                self._names.append(branch)
+            node = len(self._tails)
+            self._oids += oid
+            self._tails.append(tail)
+            self._branches.append(name_id)
+            self._lens.append(1 if tail < 0 else self._lens[tail] + 1)
+        return node
+
+    def oid(self, node: int) -> bytes:
+        start = node * self.width
+        return bytes(self._oids[start:start + self.width])
+
+    def branch(self, node: int) -> str:
+        return self._names[self._branches[node]]
+
+    def compacted(self, histories) -> tuple["HistoryStore", list["History"]]:
+        """A new store holding only ``histories``, and their copies in it.
+
+        The arena never frees a cell, so a long-lived owner moves the
+        histories it still needs to a fresh store from time to time.  Tails
+        shared in the old store (or stores) stay shared in the new one.
+        """
+        store = HistoryStore(self.width)
+        copied: dict[tuple, int] = {}
+        out = []
+        for history in histories:
+            old, node, todo = history.store, history.node, []
+            while node >= 0 and (old, node) not in copied:
+                todo.append(node)
+                node = old._tails[node]
+            tail = copied[(old, node)] if node >= 0 else -1
+            for node in reversed(todo):
+                tail = copied[(old, node)] = store.cons(tail, old.oid(node), old.branch(node))
+            out.append(History(store, tail))
+        return store, out
+
+
+class Entry:
+    """One ``commit:branch`` pair, read out of the store on demand."""
+
+    __slots__ = ("_store", "_node")
+
+    def __init__(self, store: HistoryStore, node: int):
+        self._store = store
+        self._node = node
+
+    @property
+    def oid(self) -> bytes:
+        return self._store.oid(self._node)
+
+    @property
+    def hex(self) -> str:
+        return self.oid.hex()
+
+    @property
+    def branch(self) -> str:
+        return self._store.branch(self._node)
+
+    def __iter__(self):
+        yield self.oid
+        yield self.branch
+
+    def __repr__(self):
+        return f"{short(self.oid)}:{self.branch}"
+
+
+class History:
+    __slots__ = ("store", "node")
+
+    def __init__(self, store: HistoryStore, node: int):
+        self.store = store
+        self.node = node
+
+    def cons(self, oid: bytes, branch: str) -> "History":
+        return History(self.store, self.store.cons(self.node, oid, branch))
+
+    @property
+    def head(self) -> Entry:
+        if self.node < 0:
+            raise IndexError("empty history")
+        return Entry(self.store, self.node)
+
+    @property
+    def tail(self) -> "History":
+        if self.node < 0:
+            raise IndexError("empty history")
+        return History(self.store, self.store._tails[self.node])
+
+    def __len__(self):
+        return 0 if self.node < 0 else self.store._lens[self.node]
+
+    def __bool__(self):
+        return self.node >= 0
+
+    def __iter__(self):
+        store, node = self.store, self.node
+        tails = store._tails
+        while node >= 0:
+            yield Entry(store, node)
+            node = tails[node]
+
+    def __repr__(self):
+        if self.node < 0:
+            return "nil"
+        return "[" + ", ".join(map(repr, self)) + "]"
@@ -0,0 +1,296 @@
+"""Append-only promotion journal.
+
+The journal is a directory of numbered segments::
+
+    00000003.log      records, appended
+    00000003.snap     live promotions as of the start of segment 3
+    00000003.summary  promotions that ended before segment 3
+
+Records are framed as ``length:u32 crc32:u32 op:u8 payload`` (little
+endian, the CRC covering op and payload).  A torn or corrupt tail left by a
+crash is cut off when the journal is opened.  Snapshots and summaries use
+the same framing and are written to a temporary file and renamed into
+place, so they are either complete or absent.
+
+Startup reads the newest snapshot and only the segments from its sequence
+number on; ``retire`` drops everything older once a snapshot and summary
+cover it.
+
+Durability uses group commit: ``append`` only buffers and returns the log
+sequence number (a byte count that keeps growing across segments),
+``sync(lsn)`` makes it durable.  The first caller to find no flush in
+progress becomes the leader and writes and fsyncs everything buffered so
+far; callers arriving meanwhile wait and are usually covered by that same
+fsync or the next one.
+
+A failed write or fsync leaves the file in an unknown state (the kernel may
+already have dropped the dirty pages), so it is never retried: the journal
+is marked failed and every ``append``, ``sync`` and ``rotate`` from then on
+raises ``JournalError``.  Reopening the journal cuts off whatever part of
+the lost records did reach the disk.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from enum import IntEnum
+
+_HEADER = struct.Struct("<IIB")
+
+
+class Op(IntEnum):
+    START = 1
+    MERGE = 2
+    EFF = 3
+    END = 4
+    SNAPSHOT = 5
+    SUMMARY = 6
+    EFFECT = 7
+    FORK = 8
+    SKIP = 9
+    GROUP = 10
+    JOIN = 11
+    INTENT = 12
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal:
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.fspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        segments = self.segments()
+        self._seq = segments[-1] if segments else max(self.snapshot_seq(), 1)
+        fd = self._open_segment(self._seq)
+        try:
+            end = _valid_end(fd)
+            if os.fstat(fd).st_size != end:
+                os.ftruncate(fd, end)
+                os.fsync(fd)
+            os.lseek(fd, end, os.SEEK_SET)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._buf = bytearray()
+        # Bytes appended in total: LSNs count these, not what was written,
+        # since a flush in progress has taken its data out of ``_buf``.
+        self._appended = end
+        self._written = end
+        self._durable = end
+        self._flushing = False
+        self._error: BaseException | None = None
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the segment being appended to."""
+        return self._seq
+
+    @property
+    def lsn(self) -> int:
+        with self._cond:
+            return self._appended
+
+    def append(self, op: int, payload: bytes) -> int:
+        record = _frame(op, payload)
+        with self._cond:
+            self._check()
+            self._buf += record
+            self._appended += len(record)
+            return self._appended
+
+    def sync(self, lsn: int | None = None) -> None:
+        """Block until every record up to ``lsn`` (default: all appended) is on disk."""
+        with self._cond:
+            if lsn is None:
+                lsn = self._appended
+            while self._durable < lsn:
+                self._check()
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                data, self._buf = self._buf, bytearray()
+                target = self._written + len(data)
+                fd = self._fd
+                error = None
+                self._cond.release()
+                try:
+                    _write_all(fd, data)
+                    os.fsync(fd)
+                except BaseException as exc:
+                    error = exc
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+                if error is not None:
+                    self._error = error
+                    raise JournalError("journal write failed") from error
+                self._written = self._durable = target
+
+    def rotate(self) -> int:
+        """Flush the current segment and start appending to a new one."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._check()
+            try:
+                _write_all(self._fd, self._buf)
+                os.fsync(self._fd)
+            except BaseException as exc:
+                self._error = exc
+                raise JournalError("journal write failed") from exc
+            self._written = self._durable = self._written + len(self._buf)
+            self._buf = bytearray()
+            fd = self._open_segment(self._seq + 1)
+            os.close(self._fd)
+            self._fd = fd
+            self._seq += 1
+            _fsync_dir(self.path)
+            return self._seq
+
+    def segments(self) -> list[int]:
+        return self._numbered(".log")
+
+    def snapshot_seq(self) -> int:
+        """Sequence number of the newest snapshot, 0 if there is none."""
+        snaps = self._numbered(".snap")
+        return snaps[-1] if snaps else 0
+
+    def records(self, seq: int, suffix: str = ".log"):
+        """Yield ``(op, payload)`` for every valid record of one file."""
+        try:
+            with open(self._file(seq, suffix), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        yield from _records(data)
+
+    def replay(self):
+        """Yield the newest snapshot, then every durable record written after it."""
+        self.sync()
+        start = self.snapshot_seq()
+        if start:
+            yield from self.records(start, ".snap")
+        for seq in self.segments():
+            if seq >= start:
+                yield from self.records(seq)
+
+    def write_snapshot(self, seq: int, records) -> None:
+        self._write_atomic(seq, ".snap", records)
+
+    def write_summary(self, seq: int, records) -> None:
+        self._write_atomic(seq, ".summary", records)
+
+    def summaries(self):
+        """Yield every summary record, oldest first."""
+        for seq in self._numbered(".summary"):
+            yield from self.records(seq, ".summary")
+
+    def drop_summaries(self, after: int) -> None:
+        for seq in self._numbered(".summary"):
+            if seq > after:
+                os.unlink(self._file(seq, ".summary"))
+
+    def retire(self, seq: int) -> None:
+        """Delete the segments and snapshots older than ``seq``."""
+        for suffix in (".log", ".snap"):
+            for old in self._numbered(suffix):
+                if old < seq:
+                    os.unlink(self._file(old, suffix))
+        _fsync_dir(self.path)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            try:
+                if self._error is None:
+                    self.sync()
+            finally:
+                os.close(self._fd)
+                self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise JournalError("journal failed; reopen it to recover") from self._error
+        if self._fd < 0:
+            raise JournalError("journal is closed")
+
+    def _file(self, seq: int, suffix: str) -> str:
+        return os.path.join(self.path, f"{seq:08d}{suffix}")
+
+    def _numbered(self, suffix: str) -> list[int]:
+        out = []
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext == suffix and stem.isdigit():
+                out.append(int(stem))
+        return sorted(out)
+
+    def _open_segment(self, seq: int) -> int:
+        return os.open(self._file(seq, ".log"), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _write_atomic(self, seq: int, suffix: str, records) -> None:
+        final = self._file(seq, suffix)
+        tmp = final + ".tmp"
+        data = bytearray()
+        for op, payload in records:
+            data += _frame(op, payload)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _write_all(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, final)
+        _fsync_dir(self.path)
+
+
+def _frame(op: int, payload: bytes) -> bytes:
+    crc = zlib.crc32(payload, zlib.crc32(bytes((op,))))
+    return _HEADER.pack(len(payload), crc, op) + payload
+
+
+def _write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _records(data):
+    offset, size = 0, len(data)
+    while offset + _HEADER.size <= size:
+        length, crc, op = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        end = start + length
+        if end > size or zlib.crc32(data[start - 1:end]) != crc:
+            return
+        yield Op(op), bytes(data[start:end])
+        offset = end
+
+
+def _valid_end(fd: int) -> int:
+    size = os.fstat(fd).st_size
+    data = os.pread(fd, size, 0)
+    end = 0
+    for _, payload in _records(data):
+        end += _HEADER.size + len(payload)
+    return end
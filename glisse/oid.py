@@ -0,0 +1,13 @@
+"""Git object IDs.
+
+Object IDs are kept as raw ``bytes`` (20 for SHA-1, 32 for SHA-256
+repositories) and only turned into hex at the edges, for display and for
+talking to ``git``.
+"""
+
+SHA1_SIZE = 20
+SHA256_SIZE = 32
+
+
+def short(oid: bytes, length: int = 7) -> str:
+    return oid.hex()[:length]
@@ -0,0 +1,587 @@
+"""Pipeline DSL.
+
+    branch("dev") > transition() > branch("staging") > branch("main")
+
+Python evaluates ``a > b > c`` as ``a > b and b > c``.  The ``and`` asks the
+first ``Chain`` for its truth value; the chain then remembers (per thread)
+where it was asked, and the next comparison extends it only if it starts
+from its last item and is the rest of that same chained comparison: the
+same frame, further on, at the same source position.  Any other truth
+test, as in ``if x:`` or ``assert x``, is not followed by such a
+comparison, so ``x = a > b`` and a later ``y = b > c`` build separate
+chains.  The explicit form ``(a > b) > c`` works as well, and is the only
+one when Python runs without column positions (``-X no_debug_ranges``):
+a comparison following a truth test on the same line then raises.
+``Chain.compile()`` freezes the result into a ``Pipeline`` with
+precomputed lookup tables.
+
+A tuple of branches fans out and back in::
+
+    branch("dev") > (branch("staging_eu"), branch("staging_us")) > branch("main")
+
+Every stage of one step is linked to every stage of the next, so the
+pipeline is a DAG rather than a chain.  ``combine(*chains)`` compiles
+several chains into one graph, a ``Branch`` object used in more than one
+place being a single stage.
+
+Compiling checks the whole graph in linear time (Tarjan's strongly
+connected components for cycles, a sweep from the entry stages for
+unreachable ones) and raises one ``PipelineError`` listing every problem.
+
+A branch name with ``*``, ``?`` or ``**`` is a pattern standing for every
+branch it matches when the promotion runs::
+
+    branch("release/*") > branch("main")
+
+Pattern stages can only start a pipeline: they are merged from, never
+into.
+
+``branch(name, repo)`` is interned: while any pipeline or caller holds
+it, the same ``Branch`` comes back for the same repository and name, so
+its hooks, last known tip and counters are shared by every pipeline it
+is part of, and a move of the branch reaches all of them at once.  A
+branch with hooks is held for the life of the process, so that
+``branch("staging").when_merged(bump)`` on its own still registers the
+hook.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import weakref
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, NamedTuple
+
+_local = threading.local()
+
+
+class Hook(NamedTuple):
+    fn: Callable
+    cache: str | None = None
+    paths: tuple[str, ...] | None = None
+
+    @property
+    def name(self) -> str:
+        """Qualified name of ``fn``, which stays the same across restarts."""
+        fn = self.fn
+        qualname = getattr(fn, "__qualname__", None) or type(fn).__qualname__
+        return f"{getattr(fn, '__module__', None) or type(fn).__module__}.{qualname}"
+
+    def __call__(self, ctx):
+        return self.fn(ctx)
+
+
+class Guard(NamedTuple):
+    """A check a promotion must pass to cross a transition.
+
+    Guards of a transition run cheapest ``cost`` first, in declaration
+    order among equal costs, and the first one to fail stops the others.
+    """
+
+    fn: Callable
+    cost: float = 0
+
+    def __call__(self, crossing):
+        return self.fn(crossing)
+
+
+class Branch:
+    """A pipeline stage backed by a git branch.
+
+    ``tip`` is the last commit the branch was seen at, ``moves`` how often
+    it was seen to move and ``merges`` how many promotions merged into it.
+    """
+
+    __slots__ = ("name", "repo", "tip", "moves", "merges", "_hooks", "_pipelines", "__weakref__")
+
+    def __init__(self, name: str, repo=None):
+        self.name = name
+        self.repo = repo
+        self.tip: bytes | None = None
+        self.moves = 0
+        self.merges = 0
+        self._hooks = []
+        self._pipelines = weakref.WeakSet()
+
+    @property
+    def pattern(self) -> bool:
+        """Whether the name is a glob pattern rather than a single branch."""
+        return "*" in self.name or "?" in self.name
+
+    @property
+    def pipelines(self) -> tuple["Pipeline", ...]:
+        """Compiled pipelines this branch is a stage of."""
+        return tuple(self._pipelines)
+
+    def moved(self, tip: bytes) -> bool:
+        """Record that the branch points at ``tip`` and notify its pipelines if that is new."""
+        if tip == self.tip:
+            return False
+        self.tip = tip
+        self.moves += 1
+        for pipeline in tuple(self._pipelines):
+            pipeline._notify(self)
+        return True
+
+    @property
+    def hooks(self) -> tuple[Hook, ...]:
+        return tuple(self._hooks)
+
+    def when_merged(self, hook=None, *, cache: str | None = None, paths=None):
+        """Register ``hook(ctx)`` to run once a promotion merged into this branch.
+
+        Hooks sharing a ``cache`` name reuse each other's result when the
+        merge produced a tree they already succeeded on.  With ``paths``
+        (patterns such as ``"services/api/**"``), the hook is skipped when
+        no promoted commit changes a matching path.  Without ``hook``,
+        returns a decorator.
+        """
+        if hook is None:
+            return lambda fn: self.when_merged(fn, cache=cache, paths=paths)
+        with _branches_lock:
+            # Hooks must outlive the statement that registered them.
+            _hooked.setdefault((self.repo, self.name), self)
+        self._hooks.append(Hook(hook, cache, _paths(paths)))
+        return hook
+
+    def __gt__(self, other):
+        return _link(self, other)
+
+    def __lt__(self, other):
+        return _link(other, self)
+
+    def __repr__(self):
+        return f"branch({self.name!r})"
+
+
+class Transition:
+    """An edge between two stages.
+
+    ``fast_forward_only`` refuses to promote unless the target can simply
+    be moved to the source tip.  With ``paths``, a promotion only crosses
+    the edge when a commit it would bring changes a matching path.
+    ``guards`` are then checked, ordered by cost, until one fails; a
+    failing guard does not skip the edge but holds the promotion at its
+    source until a later step finds every guard passing.
+    """
+
+    __slots__ = ("fast_forward_only", "paths", "guards")
+
+    def __init__(
+        self,
+        fast_forward_only: bool = False,
+        paths: tuple[str, ...] | None = None,
+        guards: tuple[Guard, ...] = (),
+    ):
+        object.__setattr__(self, "fast_forward_only", fast_forward_only)
+        object.__setattr__(self, "paths", paths)
+        object.__setattr__(self, "guards", guards)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __gt__(self, other):
+        return _link(self, other)
+
+    def __lt__(self, other):
+        return _link(other, self)
+
+    def __repr__(self):
+        args = []
+        if self.fast_forward_only:
+            args.append("fast_forward_only=True")
+        if self.paths is not None:
+            args.append(f"paths={self.paths!r}")
+        if self.guards:
+            args.append(f"guards={list(self.guards)!r}")
+        return f"transition({', '.join(args)})"
+
+
+class Chain:
+    """Stages and transitions collected by ``>``, in declaration order."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: tuple):
+        object.__setattr__(self, "items", items)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Chain is immutable")
+
+    def __gt__(self, other):
+        return _link(self, other)
+
+    def __bool__(self):
+        # In ``a > b > c`` this runs between ``a > b`` and ``b > c``.
+        _local.pending = (self.items[-1], self, _site(1))
+        return True
+
+    def __repr__(self):
+        return " > ".join(map(repr, self.items))
+
+    def compile(self, name: str | None = None) -> "Pipeline":
+        return combine(self, name=name)
+
+
+# Interned branches by (repository, name), and the ones with hooks, which
+# are kept alive even when no pipeline or caller holds them.
+_branches: "weakref.WeakValueDictionary[tuple, Branch]" = weakref.WeakValueDictionary()
+_hooked: dict[tuple, Branch] = {}
+_branches_lock = threading.Lock()
+
+
+def branch(name: str, repo=None) -> Branch:
+    """The ``Branch`` for ``name`` in ``repo``.
+
+    ``repo`` is a ``Repository``, a path into one, or any other hashable
+    naming the repository; a repository and the paths leading to it name
+    the same one.  ``None`` stands for the repository the pipeline is run
+    against.
+    """
+    key = (_repo_key(repo), name)
+    with _branches_lock:
+        found = _branches.get(key)
+        if found is None:
+            found = _branches[key] = Branch(name, key[0])
+        return found
+
+
+def interned(repo, name: str) -> Branch | None:
+    """The live ``branch(name, repo)``, without creating one."""
+    return _branches.get((_repo_key(repo), name))
+
+
+def _repo_key(repo):
+    git_dir = getattr(repo, "git_dir", None)
+    if git_dir is not None:
+        return git_dir
+    if isinstance(repo, (str, os.PathLike)):
+        from glisse.git.objects import ObjectError
+        from glisse.git.repository import find_git_dir
+
+        try:
+            return find_git_dir(os.fspath(repo))
+        except ObjectError:
+            return os.path.realpath(repo)
+    return repo
+
+
+def combine(*chains: Chain, name: str | None = None) -> "Pipeline":
+    """Compile ``chains`` into one pipeline."""
+    return Pipeline(chains, name)
+
+
+_DEFAULT_TRANSITION = Transition()
+
+
+def transition(*, fast_forward_only: bool = False, paths=None, guards=()) -> Transition:
+    """An edge; ``guards`` are ``Guard``s or plain callables, which cost 0."""
+    if not fast_forward_only and paths is None and not guards:
+        return _DEFAULT_TRANSITION
+    return Transition(fast_forward_only, _paths(paths), _guards(guards))
+
+
+def guard(fn=None, *, cost: float = 0):
+    """``Guard(fn, cost)``; without ``fn``, returns a decorator."""
+    if fn is None:
+        return lambda fn: Guard(fn, cost)
+    return Guard(fn, cost)
+
+
+def _guards(guards) -> tuple[Guard, ...]:
+    guards = (g if isinstance(g, Guard) else Guard(g) for g in guards)
+    return tuple(sorted(guards, key=lambda g: g.cost))
+
+
+def _paths(paths) -> tuple[str, ...] | None:
+    if paths is None:
+        return None
+    if isinstance(paths, str):
+        return (paths,)
+    return tuple(paths)
+
+
+def _link(left, right):
+    if not isinstance(right, (Branch, Transition)) and not _is_group(right):
+        return NotImplemented
+    pending = getattr(_local, "pending", None)
+    _local.pending = None
+    if pending is not None and pending[0] is left and _continues(pending[2], _site(2)):
+        items = pending[1].items
+    elif isinstance(left, Chain):
+        items = left.items
+    elif isinstance(left, (Branch, Transition)) or _is_group(left):
+        items = (left,)
+    else:
+        return NotImplemented
+    return Chain(items + (right,))
+
+
+def _site(depth: int):
+    """Frame ID, code, instruction offset and source position of the caller ``depth`` frames up.
+
+    The frame itself is not kept, so that a pending truth test does not
+    hold on to its locals.
+    """
+    frame = sys._getframe(depth + 1)
+    code, lasti = frame.f_code, frame.f_lasti
+    return id(frame), code, lasti, _positions(code)[lasti // 2]
+
+
+def _continues(asked, compared) -> bool:
+    """Whether the comparison at ``compared`` is the rest of the chain tested at ``asked``.
+
+    Every instruction a chained comparison adds carries the position of
+    the whole comparison.  Without column information (``-X
+    no_debug_ranges``) a chain cannot be told from ``(a > b) and (b > c)``
+    on the same line, so that raises rather than guessing.
+    """
+    frame, code, lasti, position = asked
+    if compared[0] != frame or compared[1] is not code or compared[2] <= lasti:
+        return False
+    if position[2] is None:
+        if position[:2] == compared[3][:2]:
+            raise PipelineError([
+                "chained comparisons cannot be told apart without column positions "
+                "(-X no_debug_ranges); write (a > b) > c"
+            ])
+        return False
+    return position == compared[3]
+
+
+@lru_cache(maxsize=256)
+def _positions(code) -> tuple:
+    return tuple(code.co_positions())
+
+
+class PipelineError(ValueError):
+    def __init__(self, problems: list[str]):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+def _is_group(item) -> bool:
+    return isinstance(item, tuple) and bool(item) and all(isinstance(b, Branch) for b in item)
+
+
+class Pipeline:
+    """A compiled, immutable pipeline.
+
+    Stages are numbered in declaration order; ``succ`` and ``pred`` are
+    tuples of stage indices so traversal never touches the DSL objects.
+    A stage may have several successors (fan-out) and several
+    predecessors (fan-in).  ``digest``, a 16-byte hash of ``name``, stands
+    for the pipeline in journal records, whatever the length of its name.
+    """
+
+    __slots__ = (
+        "name",
+        "digest",
+        "stages",
+        "index",
+        "succ",
+        "pred",
+        "transitions",
+        "_succ_by_name",
+        "_pred_by_name",
+        "_reach",
+        "_watchers",
+        "__weakref__",
+    )
+
+    def __init__(self, chain, name: str | None = None):
+        chains = chain if isinstance(chain, (list, tuple)) else (chain,)
+        stages = []
+        index = {}
+        edges = {}
+        names = []
+        problems = []
+        for chain in chains:
+            names.append(_compile_chain(chain, stages, index, edges, problems))
+        if not stages:
+            problems.append("pipeline has no stages")
+
+        succ = [[] for _ in stages]
+        pred = [[] for _ in stages]
+        for src, dst in edges:
+            succ[src].append(dst)
+            pred[dst].append(src)
+        for i, b in enumerate(stages):
+            if b.pattern and pred[i]:
+                problems.append(f"pattern stage {b.name!r} can only start a pipeline")
+        cyclic = set()
+        for component in _cycles(succ):
+            cyclic.update(component)
+            problems.append("cycle through " + ", ".join(stages[i].name for i in component))
+        unreachable = [i for i in _unreachable(succ, pred) if i not in cyclic]
+        if unreachable:
+            problems.append("unreachable stages " + ", ".join(stages[i].name for i in unreachable))
+        if problems:
+            raise PipelineError(problems)
+        succ = tuple(map(tuple, succ))
+        pred = tuple(map(tuple, pred))
+
+        stages = tuple(stages)
+        init = object.__setattr__
+        name = name or ";".join(names)
+        init(self, "name", name)
+        init(self, "digest", hashlib.blake2b(name.encode(), digest_size=16).digest())
+        init(self, "stages", stages)
+        init(self, "index", MappingProxyType(index))
+        init(self, "succ", succ)
+        init(self, "pred", pred)
+        init(self, "transitions", MappingProxyType(edges))
+        init(self, "_succ_by_name", {
+            b.name: tuple(stages[j] for j in succ[i]) for i, b in enumerate(stages)
+        })
+        init(self, "_pred_by_name", {
+            b.name: tuple(stages[j] for j in pred[i]) for i, b in enumerate(stages)
+        })
+        init(self, "_reach", {})
+        init(self, "_watchers", [])
+        for b in stages:
+            b._pipelines.add(self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Pipeline is immutable")
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __repr__(self):
+        return f"<Pipeline {self.name}>"
+
+    def watch(self, fn: Callable) -> Callable:
+        """Call ``fn(pipeline, branch)`` whenever a stage is seen at a new tip."""
+        self._watchers.append(fn)
+        return fn
+
+    def _notify(self, branch: Branch) -> None:
+        for fn in tuple(self._watchers):
+            fn(self, branch)
+
+    def successors(self, name: str) -> tuple[Branch, ...]:
+        return self._succ_by_name[name]
+
+    def predecessors(self, name: str) -> tuple[Branch, ...]:
+        return self._pred_by_name[name]
+
+    def next(self, name: str) -> Branch | None:
+        """The first stage after ``name``, or ``None`` at the end of the pipeline."""
+        succ = self._succ_by_name[name]
+        return succ[0] if succ else None
+
+    def reachable(self, stage: int) -> frozenset[int]:
+        """Indices of ``stage`` and every stage downstream of it."""
+        found = self._reach.get(stage)
+        if found is None:
+            seen, todo = {stage}, [stage]
+            while todo:
+                for j in self.succ[todo.pop()]:
+                    if j not in seen:
+                        seen.add(j)
+                        todo.append(j)
+            found = self._reach[stage] = frozenset(seen)
+        return found
+
+    def transition(self, src: str, dst: str) -> Transition:
+        return self.transitions[(self.index[src], self.index[dst])]
+
+
+def _compile_chain(chain: Chain, stages, index, edges, problems) -> str:
+    """Add the stages and edges of ``chain`` to the tables; return its name."""
+    names = []
+    prev = ()
+    edge = None
+    for item in chain.items:
+        if isinstance(item, Transition):
+            if not prev or edge is not None:
+                problems.append(f"misplaced transition in {chain!r}")
+            edge = item
+            continue
+        layer = item if isinstance(item, tuple) else (item,)
+        for b in layer:
+            i = index.get(b.name)
+            if i is None:
+                i = index[b.name] = len(stages)
+                stages.append(b)
+            elif stages[i] is not b:
+                problems.append(f"duplicate branch {b.name!r} in {chain!r}")
+            t = edge if edge is not None else _DEFAULT_TRANSITION
+            for src in prev:
+                if edges.setdefault((index[src.name], i), t) is not t:
+                    problems.append(f"conflicting transitions from {src.name!r} to {b.name!r}")
+        if isinstance(item, tuple):
+            names.append("(" + ",".join(b.name for b in layer) + ")")
+        else:
+            names.append(item.name)
+        prev, edge = layer, None
+    if edge is not None or not prev:
+        problems.append(f"pipeline must start and end with a branch: {chain!r}")
+    return ">".join(names)
+
+
+def _cycles(succ) -> list[list[int]]:
+    """Strongly connected components that contain a cycle (Tarjan, iterative)."""
+    n = len(succ)
+    order = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack, found, counter = [], [], 0
+    for root in range(n):
+        if order[root] >= 0:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, i = work[-1]
+            if i < len(succ[v]):
+                work[-1] = (v, i + 1)
+                w = succ[v][i]
+                if order[w] < 0:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, 0))
+                elif on_stack[w]:
+                    low[v] = min(low[v], order[w])
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                low[u] = min(low[u], low[v])
+            if low[v] == order[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                if len(component) > 1 or v in succ[v]:
+                    found.append(sorted(component))
+    return sorted(found)
+
+
+def _unreachable(succ, pred) -> list[int]:
+    """Stages no stage without predecessors leads to."""
+    seen = [not p for p in pred]
+    todo = [i for i, s in enumerate(seen) if s]
+    while todo:
+        for j in succ[todo.pop()]:
+            if not seen[j]:
+                seen[j] = True
+                todo.append(j)
+    return [i for i, s in enumerate(seen) if not s]
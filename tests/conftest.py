@@ -0,0 +1,151 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+import pytest
+
+_GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "Test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+    "HOME": os.devnull,
+}
+
+
+class FakeBackend:
+    """Branches as a dict of made-up commit IDs; merges just mint a new one."""
+
+    oid_size = 20
+
+    def __init__(self, *names):
+        self.tips = {name: _oid(name) for name in names}
+        self.merges = []
+
+    def tip(self, branch):
+        return self.tips[branch]
+
+    def tree(self, commit):
+        return _oid(commit.hex() + "^{tree}")
+
+    def merge(self, source, target, fast_forward_only=False):
+        self.merges.append((source, target))
+        commit = _oid(f"{source}>{target}#{len(self.merges)}")
+        self.tips[target] = commit
+        return commit
+
+    def touches(self, base, commit, paths):
+        return True
+
+    def branches(self, pattern):
+        import fnmatch
+
+        return sorted(n for n in self.tips if fnmatch.fnmatchcase(n, pattern))
+
+
+def _oid(text):
+    return hashlib.sha1(text.encode()).digest()
+
+
+@pytest.fixture
+def make_backend():
+    """A ``FakeBackend`` with the given branches."""
+    return FakeBackend
+
+
+@pytest.fixture
+def backend(make_backend):
+    return make_backend("dev", "staging", "main")
+
+
+class Git:
+    """A scratch repository driven through the git CLI."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        # Every command runs one second later, so commit dates differ.
+        self.time = 1700000000
+        os.makedirs(self.path, exist_ok=True)
+        self("init", "-q", "-b", "main")
+
+    def __call__(self, *args, input=None) -> str:
+        out = self.run(*args, input=input)
+        if out.returncode:
+            raise subprocess.CalledProcessError(out.returncode, out.args, out.stdout, out.stderr)
+        return out.stdout.decode().strip()
+
+    def run(self, *args, input=None) -> subprocess.CompletedProcess:
+        self.time += 1
+        date = f"{self.time} +0000"
+        return subprocess.run(
+            ["git", "-C", self.path, *args],
+            input=input,
+            capture_output=True,
+            env={**os.environ, **_GIT_ENV, "GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date},
+        )
+
+    def write(self, files: dict) -> None:
+        """Write ``files`` (path -> text, bytes, ``(content, mode)`` or ``None`` to delete)."""
+        for name, content in files.items():
+            path = os.path.join(self.path, name)
+            if content is None:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+                continue
+            mode = 0o644
+            if isinstance(content, tuple):
+                content, mode = content
+            if isinstance(content, str):
+                content = content.encode()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(content)
+            os.chmod(path, mode)
+
+    def commit(self, message: str, files: dict | None = None) -> bytes:
+        self.write(files or {})
+        self("add", "-A")
+        self("commit", "-q", "--allow-empty", "-m", message)
+        return bytes.fromhex(self("rev-parse", "HEAD"))
+
+
+@pytest.fixture
+def git(tmp_path):
+    return Git(tmp_path / "repo")
+
+
+def random_history(git, rng, commits=60, branches=4) -> list[bytes]:
+    """Commits on ``branches`` branches that edit their own directory and merge each other.
+
+    Merges of two and three branches occur; the last commit is an octopus
+    merge of every branch into ``main``.  Merges never conflict.
+    """
+    names = ["main"] + [f"b{i}" for i in range(1, branches)]
+    git.commit("root", {"README": "root\n"})
+    for name in names[1:]:
+        git("branch", name)
+    out = []
+    for i in range(commits):
+        name = rng.choice(names)
+        git("checkout", "-q", name)
+        others = [n for n in names if n != name]
+        if i > 5 and rng.random() < 0.25:
+            merged = rng.sample(others, rng.choice((1, 1, 2)))
+            git("merge", "-q", "--no-ff", "--no-edit", *merged)
+        else:
+            files = {f"{name}/f{rng.randrange(4)}": f"{i}\n"}
+            if rng.random() < 0.2:
+                files[f"{name}/deep/er/g{rng.randrange(3)}"] = f"{i}\n"
+            git.commit(f"{name} {i}", files)
+        out.append(bytes.fromhex(git("rev-parse", "HEAD")))
+    for name in names[1:]:
+        git("checkout", "-q", name)
+        out.append(git.commit(f"{name} before octopus", {f"{name}/octopus": "1\n"}))
+    git("checkout", "-q", "main")
+    git("merge", "-q", "--no-ff", "--no-edit", *names[1:])
+    out.append(bytes.fromhex(git("rev-parse", "HEAD")))
+    return out
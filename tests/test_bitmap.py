@@ -0,0 +1,57 @@
+import itertools
+import os
+import random
+
+import pytest
+from conftest import random_history
+
+from glisse.git import CommitGraph, ObjectStore, ReachabilityIndex
+
+
+@pytest.mark.parametrize("with_graph", [True, False])
+def test_pending_and_missing_match_rev_list(git, with_graph):
+    commits = random_history(git, random.Random(11), commits=40)
+    git("commit-graph", "write", "--reachable")
+    git("checkout", "-q", "-b", "after")
+    commits.append(git.commit("after the graph", {"new": "1\n"}))
+    git_dir = os.path.join(git.path, ".git")
+    store = ObjectStore(git_dir)
+    graph = CommitGraph.open(os.path.join(git_dir, "objects"), 20) if with_graph else None
+    index = ReachabilityIndex(store, graph, capacity=8)
+    pairs = random.Random(2).sample(list(itertools.product(commits, commits)), 40)
+    try:
+        for a, b in pairs:
+            expected = git("rev-list", a.hex(), f"^{b.hex()}").split()
+            count = git("rev-list", "--count", f"{b.hex()}..{a.hex()}")
+            assert index.pending(a, b) == int(count) == len(expected)
+            assert sorted(c.hex() for c in index.missing(a, b)) == sorted(expected)
+        tip = commits[-1]
+        everything = git("rev-list", tip.hex()).split()
+        assert sorted(c.hex() for c in index.missing(tip, None)) == sorted(everything)
+    finally:
+        if graph is not None:
+            graph.close()
+        store.close()
+
+
+def test_rewritten_graph_drops_slots_after_it(git):
+    from glisse.git import Repository
+
+    random_history(git, random.Random(11), commits=20)
+    git("commit-graph", "write", "--reachable")
+    repo = Repository(git.path, cache=None)
+    try:
+        base = repo.tip("b1")
+        for i in range(5):
+            git.commit(f"after the graph {i}", {"new": f"{i}\n"})
+        assert repo.pending("main", "b1") == int(git("rev-list", "--count", "b1..main"))
+        index = repo.reachability
+        assert len(index._extra) == 5
+        git("commit-graph", "write", "--reachable")
+        assert repo.pending("main", "b1") == int(git("rev-list", "--count", "b1..main"))
+        assert repo.reachability is not index
+        assert repo.reachability._extra == {}
+        assert repo.reachability._base == len(repo.graph)
+        assert repo.reachability.reachable(base).bit_length() <= len(repo.graph)
+    finally:
+        repo.close()
@@ -0,0 +1,124 @@
+import os
+import random
+
+from conftest import random_history
+
+from glisse.git import BloomIndex, CommitGraph, ObjectStore, Repository
+from glisse.git.bloom import build_filter, murmur3
+from glisse.git.paths import changed_paths
+
+
+def test_murmur3_reference_values():
+    # Published MurmurHash3_x86_32 vectors.
+    assert murmur3(b"", 0) == 0
+    assert murmur3(b"", 1) == 0x514E28B7
+    assert murmur3(b"hello", 0) == 0x248BFA47
+    assert murmur3(b"The quick brown fox jumps over the lazy dog", 0x9747B28C) == 0x2FA826CD
+    # Version 1 filters hashed bytes as signed chars.
+    assert murmur3(b"\xe9t\xe9", 0x293AE76F, 1) != murmur3(b"\xe9t\xe9", 0x293AE76F, 2)
+    assert murmur3(b"ascii", 0x293AE76F, 1) == murmur3(b"ascii", 0x293AE76F, 2)
+
+
+def _graph_repo(git):
+    random_history(git, random.Random(11), commits=40)
+    git("commit-graph", "write", "--reachable", "--changed-paths")
+    return os.path.join(git.path, ".git")
+
+
+def test_filters_match_the_ones_git_wrote(git):
+    git_dir = _graph_repo(git)
+    store = ObjectStore(git_dir)
+    graph = CommitGraph.open(os.path.join(git_dir, "objects"), 20)
+    try:
+        built = BloomIndex(store)
+        for pos in range(len(graph)):
+            oid = graph.oid(pos)
+            theirs = graph.bloom(pos)
+            assert theirs is not None
+            assert built.filter(oid).data == theirs.data, oid.hex()
+    finally:
+        graph.close()
+        store.close()
+
+
+def test_filter_never_misses_a_changed_path(git):
+    git_dir = _graph_repo(git)
+    store = ObjectStore(git_dir)
+    graph = CommitGraph.open(os.path.join(git_dir, "objects"), 20)
+    try:
+        for pos in range(len(graph)):
+            commit = store.commit(graph.oid(pos))
+            parent = store.commit(commit.parents[0]).tree if commit.parents else None
+            bloom = graph.bloom(pos)
+            for path in changed_paths(store, parent, commit.tree):
+                assert bloom.may_contain(path)
+                assert bloom.may_contain(path.rpartition(b"/")[0] or path)
+    finally:
+        graph.close()
+        store.close()
+
+
+def test_non_ascii_paths(git):
+    git.commit("root", {"a": "1\n"})
+    git.commit("accents", {"café/menü": "1\n"})
+    git("commit-graph", "write", "--reachable", "--changed-paths")
+    git_dir = os.path.join(git.path, ".git")
+    graph = CommitGraph.open(os.path.join(git_dir, "objects"), 20)
+    try:
+        bloom = graph.bloom(graph.position(bytes.fromhex(git("rev-parse", "HEAD"))))
+        assert bloom.may_contain("café/menü".encode())
+        assert bloom.may_contain("café".encode())
+    finally:
+        graph.close()
+    # Filters built here use version 2 hashing; they find the same paths.
+    assert build_filter(["café/menü".encode()]).may_contain("café".encode())
+
+
+def test_touches_matches_git_log(git):
+    commits = random_history(git, random.Random(5), commits=40)
+    git("commit-graph", "write", "--reachable", "--changed-paths")
+    # Newer than the graph, so their filters are built on the fly.
+    git("checkout", "-q", "b1")
+    commits.append(git.commit("late", {"b1/f0": "late\n"}))
+    repo = Repository(git.path, cache=None)
+    rng = random.Random(9)
+    patterns = [["b1/f0"], ["b2/**"], ["b*/deep/**"], ["main/f?"], ["README"], ["b3/deep/er"]]
+    outcomes = set()
+    try:
+        for _ in range(60):
+            base, commit = rng.sample(commits, 2)
+            paths = rng.choice(patterns)
+            # Files a commit of the range changed against every parent; a
+            # merge that took a path from one side as is does not count,
+            # even when that side is outside the range.
+            changed = git(
+                "log", "--full-history", "-c", "--name-only", "--format=",
+                f"{base.hex()}..{commit.hex()}", "--", *_git_pathspecs(paths),
+            )
+            found = repo.touches(base, commit, paths)
+            assert found == bool(changed), (base.hex(), commit.hex(), paths)
+            outcomes.add(found)
+    finally:
+        repo.close()
+    assert outcomes == {True, False}
+
+
+def _git_pathspecs(patterns):
+    # ``**`` and a directory matching everything below it mean the same in
+    # git's glob magic as in ``PathSpec``.
+    return [f":(glob){p}" for p in patterns]
+
+
+def test_probing_many_filters_hashes_each_path_once(monkeypatch):
+    from glisse.git import bloom
+
+    bloom.bloom_keys.cache_clear()
+    hashed = []
+    monkeypatch.setattr(bloom, "murmur3", lambda data, seed, version=2: hashed.append(data) or 0)
+    filters = [build_filter([f"services/api/{i}".encode()]) for i in range(100)]
+    hashed.clear()
+    for f in filters:
+        f.may_contain(b"services/api/handlers")
+    assert sorted(set(hashed)) == [b"services", b"services/api", b"services/api/handlers"]
+    assert len(hashed) == 6
+    bloom.bloom_keys.cache_clear()
@@ -0,0 +1,48 @@
+import os
+import sys
+import tracemalloc
+
+from glisse.git.cache import ObjectCache
+from glisse.git.objects import OBJ_TREE
+
+
+def _entries(n, size=100):
+    return [(os.urandom(20), os.urandom(size)) for _ in range(n)]
+
+
+def test_evicts_least_recently_used_within_max_bytes():
+    entries = _entries(10)
+    one = ObjectCache()
+    one.put(entries[0][0], OBJ_TREE, entries[0][1])
+    cost = one.size
+    cache = ObjectCache(max_bytes=cost * 3)
+    for oid, data in entries[:3]:
+        cache.put(oid, OBJ_TREE, data)
+    assert cache.get(entries[0][0]) == (OBJ_TREE, entries[0][1])
+    cache.put(entries[3][0], OBJ_TREE, entries[3][1])
+    assert (len(cache), cache.size, cache.evictions) == (3, cost * 3, 1)
+    assert cache.get(entries[1][0]) is None
+    assert cache.get(entries[0][0]) is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache.put(entries[0][0], OBJ_TREE, entries[0][1])
+    assert (len(cache), cache.size) == (3, cost * 3)
+    cache.put(os.urandom(20), OBJ_TREE, os.urandom(cost * 3))
+    assert len(cache) == 3
+    cache.clear()
+    assert (len(cache), cache.size) == (0, 0)
+
+
+def test_size_accounts_for_what_entries_really_take():
+    entries = _entries(5000)
+    cache = ObjectCache(max_bytes=1 << 30)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for oid, data in entries:
+            cache.put(oid, OBJ_TREE, data)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    held = sum(sys.getsizeof(oid) + sys.getsizeof(data) for oid, data in entries)
+    assert abs(cache.size - (held + used)) < 0.1 * (held + used)
@@ -0,0 +1,151 @@
+import itertools
+import os
+import random
+
+import pytest
+from conftest import random_history
+
+from glisse.git import Ancestry, CommitGraph, ObjectStore
+
+
+def _commits(git):
+    """``{oid: (tree, parents, commit time)}`` for every commit, as git sees them."""
+    out = {}
+    for line in git("log", "--all", "--format=%H %T %ct %P").splitlines():
+        oid, tree, time, *parents = line.split()
+        parents = tuple(bytes.fromhex(p) for p in parents)
+        out[bytes.fromhex(oid)] = (bytes.fromhex(tree), parents, int(time))
+    return out
+
+
+@pytest.fixture(params=["single", "split"])
+def graph_repo(request, git):
+    rng = random.Random(7)
+    if request.param == "single":
+        random_history(git, rng)
+        git("commit-graph", "write", "--reachable")
+    else:
+        random_history(git, rng, commits=30)
+        git("commit-graph", "write", "--reachable", "--split")
+        for i in range(10):
+            git.commit(f"layer 2 #{i}", {"top": f"{i}\n"})
+        git("commit-graph", "write", "--reachable", "--split=no-merge")
+    objects = os.path.join(git.path, ".git", "objects")
+    if request.param == "split":
+        assert os.path.exists(os.path.join(objects, "info", "commit-graphs", "commit-graph-chain"))
+    graph = CommitGraph.open(objects, 20)
+    yield git, graph
+    graph.close()
+
+
+def test_graph_matches_git(graph_repo):
+    git, graph = graph_repo
+    commits = _commits(git)
+    assert len(graph) == len(commits)
+    for oid, (tree, parents, time) in commits.items():
+        pos = graph.position(oid)
+        assert pos >= 0 and graph.oid(pos) == oid
+        assert graph.tree(pos) == tree
+        assert tuple(graph.oid(p) for p in graph.parents(pos)) == parents
+        assert graph.commit_time(pos) == time
+        assert all(graph.generation(pos) > graph.generation(p) for p in graph.parents(pos))
+    assert graph.position(b"\0" * 20) == -1
+    assert any(len(parents) > 2 for _, parents, _ in commits.values())
+
+
+@pytest.mark.parametrize("with_graph", [True, False])
+def test_ancestry_matches_git(graph_repo, with_graph):
+    git, graph = graph_repo
+    # Commits made after the graph was written are read from the objects.
+    git("checkout", "-q", "main")
+    git.commit("after the graph", {"new": "1\n"})
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    ancestry = Ancestry(store, graph if with_graph else None)
+    commits = list(_commits(git))
+    rng = random.Random(3)
+    pairs = rng.sample(list(itertools.product(commits, commits)), 60)
+    try:
+        for a, b in pairs:
+            expected = git.run("merge-base", "--is-ancestor", a.hex(), b.hex()).returncode == 0
+            assert ancestry.is_ancestor(a, b) == expected
+            bases = git.run("merge-base", "--all", a.hex(), b.hex()).stdout.decode().split()
+            assert sorted(x.hex() for x in ancestry.merge_bases(a, b)) == sorted(bases)
+    finally:
+        store.close()
+
+
+def test_commit_newer_than_the_graph_is_not_an_ancestor_of_one_in_it(git):
+    random_history(git, random.Random(5))
+    git("commit-graph", "write", "--reachable")
+    tip = bytes.fromhex(git("rev-parse", "main"))
+    git("checkout", "-q", "-b", "dev")
+    new = git.commit("after the graph", {"new": "1\n"})
+    git_dir = os.path.join(git.path, ".git")
+    store = ObjectStore(git_dir)
+    graph = CommitGraph.open(os.path.join(git_dir, "objects"), 20)
+    ancestry = Ancestry(store, graph)
+    walked = []
+    parents = ancestry.parents
+    ancestry.parents = lambda oid: walked.append(oid) or parents(oid)
+    try:
+        assert not ancestry.is_ancestor(new, tip)
+        assert walked == []
+        assert ancestry.is_ancestor(tip, new)
+        assert len(walked) <= 2
+    finally:
+        graph.close()
+        store.close()
+
+
+def test_repository_picks_up_a_rewritten_graph(git):
+    from glisse.git import Repository
+    from glisse.git.commitgraph import GENERATION_INFINITY
+
+    random_history(git, random.Random(5), commits=20)
+    git("commit-graph", "write", "--reachable")
+    repo = Repository(git.path, cache=None)
+    try:
+        tip = repo.tip("main")
+        new = git.commit("after the graph", {"new": "1\n"})
+        assert repo.is_ancestor(tip, new)
+        assert repo.ancestry.generation(new) == GENERATION_INFINITY
+        assert new in repo.ancestry._parsed
+        git("commit-graph", "write", "--reachable", "--split")
+        assert repo.is_ancestor(tip, new)
+        assert repo.ancestry.generation(new) < GENERATION_INFINITY
+        assert repo.ancestry._parsed == {}
+        ancestry = repo.ancestry
+        repo.refresh()
+        assert repo.ancestry is ancestry
+    finally:
+        repo.close()
+
+
+@pytest.mark.parametrize("damage", ["truncated", "version", "missing layer"])
+def test_unusable_graph_is_ignored(git, damage):
+    from glisse.git import Repository
+
+    random_history(git, random.Random(5), commits=10)
+    info = os.path.join(git.path, ".git", "objects", "info")
+    if damage == "missing layer":
+        git("commit-graph", "write", "--reachable", "--split")
+        chain = os.path.join(info, "commit-graphs", "commit-graph-chain")
+        with open(chain) as f:
+            (layer,) = f.read().split()
+        os.unlink(os.path.join(info, "commit-graphs", f"graph-{layer}.graph"))
+    else:
+        git("commit-graph", "write", "--reachable")
+        path = os.path.join(info, "commit-graph")
+        with open(path, "r+b") as f:
+            if damage == "truncated":
+                f.truncate(6)
+            else:
+                f.seek(4)
+                f.write(b"\x07")
+    assert CommitGraph.open(os.path.join(git.path, ".git", "objects"), 20) is None
+    repo = Repository(git.path, cache=None)
+    try:
+        assert repo.graph is None
+        assert repo.is_ancestor(repo.tip("b1"), repo.tip("main"))
+    finally:
+        repo.close()
@@ -0,0 +1,140 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from glisse import Context, EffectCache, EffectError, EffectRunner, Engine, branch, command
+
+
+def _ctx(commit, target="main"):
+    pipeline = (branch("dev") > branch(target)).compile()
+    return Context(pipeline, branch("dev"), branch(target), commit, b"key")
+
+
+def test_triggers_within_a_window_run_the_hook_once_with_the_last_context():
+    calls = []
+
+    def hook(ctx):
+        calls.append(ctx.commit)
+        return ctx.commit
+
+    async def main():
+        runner = EffectRunner(window=0.05)
+        ctxs = [_ctx(bytes([i]) * 20) for i in range(3)]
+        first = asyncio.ensure_future(runner.run(hook, ctxs[0]))
+        await asyncio.sleep(0)
+        rest = [runner.run(hook, ctx) for ctx in ctxs[1:]]
+        results = await asyncio.gather(first, *rest)
+        later = await runner.run(hook, ctxs[0])
+        return ctxs, results, later
+
+    ctxs, results, later = asyncio.run(main())
+    assert calls == [ctxs[-1].commit, ctxs[0].commit]
+    assert results == [ctxs[-1].commit] * 3
+    assert later == ctxs[0].commit
+
+
+def test_hooks_of_one_target_share_their_window(backend):
+    staging = branch("staging", "windows")
+    ran = []
+    for i in range(4):
+        staging.when_merged(lambda ctx, i=i: ran.append(i))
+    pipeline = (branch("dev", "windows") > staging).compile()
+    engine = Engine(backend, runner=EffectRunner(window=0.2))
+
+    async def main():
+        p = await engine.astart(pipeline, "dev")
+        started = time.monotonic()
+        p = await engine.arun(p)
+        return p, time.monotonic() - started
+
+    _, elapsed = asyncio.run(main())
+    assert sorted(ran) == [0, 1, 2, 3]
+    assert elapsed < 0.6
+
+
+def test_commands_are_spawned_and_checked():
+    ok = command(sys.executable, "-c", "print('tagged')")
+    fails = command(sys.executable, "-c", "import sys; sys.exit(3)")
+    unchecked = fails._replace(check=False)
+    runner = EffectRunner()
+    ctx = _ctx(b"\1" * 20)
+
+    assert runner.run_sync(lambda ctx: ok, ctx).stdout == b"tagged\n"
+    assert asyncio.run(runner.run(lambda ctx: ok, ctx)).stdout == b"tagged\n"
+    for run in (runner.run_sync, lambda hook, ctx: asyncio.run(runner.run(hook, ctx))):
+        with pytest.raises(EffectError) as err:
+            run(lambda ctx: fails, ctx)
+        assert err.value.result.returncode == 3
+        assert run(lambda ctx: unchecked, ctx).returncode == 3
+    assert command("git tag -a 'v 1'").argv == ("git", "tag", "-a", "v 1")
+
+
+def test_awaitable_hooks_are_awaited():
+    async def hook(ctx):
+        await asyncio.sleep(0)
+        return ctx.commit
+
+    runner = EffectRunner()
+    ctx = _ctx(b"\2" * 20)
+    assert asyncio.run(runner.run(hook, ctx)) == ctx.commit
+    assert runner.run_sync(hook, ctx) == ctx.commit
+
+
+def test_concurrency_limits_hooks_in_flight():
+    running, peak = [0], [0]
+
+    async def hook(ctx):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    async def main():
+        runner = EffectRunner(concurrency=2)
+        await asyncio.gather(*(runner.run(hook, _ctx(bytes([i]) * 20)) for i in range(6)))
+
+    asyncio.run(main())
+    assert peak[0] == 2
+
+
+def test_effect_cache_keeps_the_most_recently_used_results():
+    cache = EffectCache(max_entries=2)
+    for i in range(2):
+        cache.put("build", bytes([i]) * 20, i)
+    assert cache.get("build", b"\0" * 20) == (True, 0)
+    cache.put("build", b"\2" * 20, 2)
+    assert len(cache) == 2
+    assert cache.get("build", b"\1" * 20) == (False, None)
+    assert cache.get("build", b"\0" * 20) == (True, 0)
+    assert cache.get("test", b"\0" * 20) == (False, None)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_fast_forward_to_a_processed_tree_hits_the_cache(git):
+    from glisse.git import Repository
+
+    git.commit("init", {"a": "1"})
+    git("branch", "staging")
+    git("checkout", "-q", "-b", "dev")
+    git.commit("change", {"a": "2"})
+    repo = Repository(git.path)
+    builds = []
+    staging, main = branch("staging", repo), branch("main", repo)
+    for stage in (staging, main):
+        stage.when_merged(lambda ctx: builds.append(ctx.target.name) or ctx.tree, cache="build")
+    pipeline = (branch("dev", repo) > staging > main).compile()
+    cache = EffectCache()
+    engine = Engine(repo, runner=EffectRunner(cache=cache))
+    try:
+        engine.run(engine.start(pipeline, "dev"))
+        assert builds == ["staging"]
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        git.commit("another", {"a": "3"})
+        engine.run(engine.start(pipeline, "dev"))
+        assert builds == ["staging", "staging"]
+        assert (cache.hits, cache.misses) == (2, 2)
+    finally:
+        repo.close()
@@ -0,0 +1,355 @@
+import asyncio
+import threading
+
+import pytest
+
+from glisse import Engine, Journal, Phase, branch
+
+
+def _pipeline(name="dev>staging>main"):
+    return (branch("dev") > branch("staging") > branch("main")).compile(name)
+
+
+def test_run_walks_every_stage(backend):
+    pipeline = _pipeline()
+    engine = Engine(backend)
+    p = engine.run(engine.start(pipeline, "dev"))
+    assert p.phase is Phase.END
+    assert backend.merges == [("dev", "staging"), ("staging", "main")]
+    assert [e.branch for e in p.history] == ["main", "staging"]
+
+
+def test_recover_resumes_in_flight_promotion(tmp_path, backend):
+    pipeline = _pipeline()
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal)
+        p = engine.start(pipeline, "dev")
+        while p.phase is not Phase.EFF:
+            p = engine.step(p)
+        expected = p
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, [pipeline])
+        (q,) = engine.recover()
+        assert (q.id, q.phase, q.stage, q.target, q.merged) == (
+            expected.id, expected.phase, expected.stage, expected.target, expected.merged,
+        )
+        q = engine.run(q)
+        assert q.phase is Phase.END
+        assert not engine.live
+
+
+def test_checkpoint_round_trip(tmp_path, backend):
+    pipeline = _pipeline()
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal)
+        finished = engine.run(engine.start(pipeline, "dev"))
+        p = engine.start(pipeline, "dev")
+        for _ in range(4):
+            p = engine.step(p)
+        engine.checkpoint()
+        assert len(journal.segments()) == 1
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, [pipeline])
+        (q,) = engine.recover()
+        assert (q.id, q.phase, q.stage) == (p.id, p.phase, p.stage)
+        assert [tuple(e) for e in q.history] == [tuple(e) for e in p.history]
+        summaries = list(journal.summaries())
+        assert len(summaries) == 1
+        assert engine.start(pipeline, "dev").id > max(finished.id, p.id)
+
+
+def test_checkpoint_every(tmp_path, backend):
+    pipeline = _pipeline()
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, checkpoint_every=2)
+        for _ in range(3):
+            engine.run(engine.start(pipeline, "dev"))
+        assert journal.snapshot_seq() > 1
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, [pipeline])
+        assert engine.recover() == []
+
+
+def test_async_api_syncs_off_the_event_loop(tmp_path, backend, monkeypatch):
+    pipeline = _pipeline()
+    loop_thread = threading.get_ident()
+    synced_on = []
+    with Journal(tmp_path) as journal:
+        sync = journal.sync
+        monkeypatch.setattr(
+            journal, "sync", lambda lsn=None: (synced_on.append(threading.get_ident()), sync(lsn))
+        )
+        engine = Engine(backend, journal)
+
+        async def main():
+            p = await engine.astart(pipeline, "dev")
+            assert synced_on and loop_thread not in synced_on
+            return await engine.arun(p)
+
+        p = asyncio.run(main())
+        assert p.phase is Phase.END
+        assert loop_thread not in synced_on
+
+
+class _Crash(Exception):
+    pass
+
+
+def test_retried_merge_keeps_pre_merge_base(tmp_path, backend):
+    """A merge that moved the ref before the crash still runs path-scoped hooks."""
+    backend.touches = lambda base, commit, paths: base != commit
+    fired = []
+    dev, staging = branch("dev", str(tmp_path)), branch("staging", str(tmp_path))
+    staging.when_merged(lambda ctx: fired.append(ctx.commit), paths="services/api/**")
+    pipeline = (dev > staging).compile("scoped")
+    merge = backend.merge
+
+    def crash(source, target, fast_forward_only=False):
+        merge(source, target, fast_forward_only)
+        raise _Crash
+
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal)
+        p = engine.step(engine.step(engine.start(pipeline, "dev")))
+        assert p.phase is Phase.MERGE
+        backend.merge = crash
+        try:
+            engine.step(p)
+        except _Crash:
+            pass
+    backend.merge = lambda source, target, ff=False: backend.tips[target]
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, [pipeline])
+        (q,) = engine.recover()
+        assert q.phase is Phase.MERGE
+        engine.run(q)
+    assert fired == [backend.tips["staging"]]
+
+
+def test_guard_blocks_fan_in_until_it_passes(tmp_path, make_backend):
+    from glisse import combine, transition
+
+    backend = make_backend("dev", "eu", "us", "main")
+    repo = str(tmp_path)
+    dev, eu, us, main = (branch(n, repo) for n in ("dev", "eu", "us", "main"))
+    frozen = [True]
+    pipeline = combine(
+        dev > transition(guards=[lambda c: not frozen[0]]) > eu,
+        dev > us,
+        eu > main,
+        us > main,
+    )
+    engine = Engine(backend)
+    p = engine.run(engine.start(pipeline, "dev"))
+    assert p.phase is Phase.PROM and p.blocked == (pipeline.index["eu"],)
+    assert engine.blocked() == [p]
+    assert backend.merges == [("dev", "us")]
+
+    assert engine.run(p).blocked
+    assert backend.merges == [("dev", "us")]
+
+    frozen[0] = False
+    p = engine.run(p)
+    assert p.phase is Phase.END and not engine.blocked()
+    assert backend.merges == [("dev", "us"), ("dev", "eu"), ("eu", "main"), ("us", "main")]
+
+
+def test_guards_run_cheapest_first_and_stop_at_first_failure(backend):
+    from glisse import Guard, transition
+
+    calls = []
+
+    def check(name, ok):
+        return lambda crossing: calls.append(name) or ok
+
+    t = transition(
+        guards=[Guard(check("ci", True), 10), Guard(check("approved", False), 5), check("frozen", True)]
+    )
+    pipeline = (branch("dev") > t > branch("staging")).compile("guarded")
+    engine = Engine(backend)
+    p = engine.run(engine.start(pipeline, "dev"))
+    assert p.blocked
+    assert calls == ["frozen", "approved"]
+    assert backend.merges == []
+
+
+def test_pattern_branches_deleted_before_merge(tmp_path, make_backend):
+    backend = make_backend("release/1", "release/2", "main", "prod")
+    repo = str(tmp_path)
+    pipeline = (branch("release/*", repo) > branch("main", repo) > branch("prod", repo)).compile()
+    engine = Engine(backend)
+    p = engine.step(engine.step(engine.start(pipeline, "release/*")))
+    assert p.phase is Phase.MERGE
+    del backend.tips["release/1"], backend.tips["release/2"]
+    p = engine.run(p)
+    assert p.phase is Phase.END
+    assert backend.merges == []
+    assert not engine.live
+
+
+def test_pipeline_names_of_any_length_are_journaled(tmp_path, backend):
+    pipeline = _pipeline("x" * 70000)
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, checkpoint_every=3)
+        engine.run(engine.start(pipeline, "dev"))
+        p = engine.start(pipeline, "dev")
+        while p.phase is not Phase.EFF:
+            p = engine.step(p)
+        engine.checkpoint()
+        assert len(list(journal.summaries())) == 1
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal, [pipeline])
+        (q,) = engine.recover()
+        assert (q.id, q.pipeline, q.phase) == (p.id, pipeline, p.phase)
+
+
+def test_checkpoint_drops_histories_of_finished_promotions(tmp_path, backend):
+    pipeline = _pipeline()
+    with Journal(tmp_path) as journal:
+        engine = Engine(backend, journal)
+        for _ in range(5):
+            engine.run(engine.start(pipeline, "dev"))
+        p = engine.start(pipeline, "dev")
+        while not p.history:
+            p = engine.step(p)
+        assert len(engine.history) == 11
+        engine.checkpoint()
+        assert len(engine.history) == 1
+        (q,) = engine.live.values()
+        assert [tuple(e) for e in q.history] == [tuple(e) for e in p.history]
+        assert engine.run(q).phase is Phase.END
+
+
+def test_recovery_runs_only_the_hooks_that_had_not_finished(tmp_path, backend):
+    repo = str(tmp_path)
+    staging = branch("staging", repo)
+    ran = []
+
+    def tag(ctx):
+        ran.append("tag")
+
+    def notify(ctx):
+        ran.append("notify")
+        if len(ran) == 2:
+            raise _Crash
+
+    staging.when_merged(tag)
+    staging.when_merged(notify)
+    pipeline = (branch("dev", repo) > staging).compile("resumed")
+    with Journal(tmp_path / "journal") as journal:
+        engine = Engine(backend, journal)
+        p = engine.start(pipeline, "dev")
+        while p.phase is not Phase.EFF:
+            p = engine.step(p)
+        try:
+            engine.step(p)
+        except _Crash:
+            pass
+    assert ran == ["tag", "notify"]
+
+    def audit(ctx):
+        ran.append("audit")
+
+    # A hook registered before the restart does not shift the others' keys.
+    staging._hooks.insert(0, staging._hooks[0]._replace(fn=audit))
+    with Journal(tmp_path / "journal") as journal:
+        engine = Engine(backend, journal, [pipeline])
+        (q,) = engine.recover()
+        assert q.phase is Phase.EFF
+        assert engine.run(q).phase is Phase.END
+    assert ran == ["tag", "notify", "audit", "notify"]
+
+
+def test_arun_merges_fanned_out_stages_concurrently(tmp_path, make_backend):
+    backend = make_backend("dev", "eu", "us", "main")
+    barrier = threading.Barrier(2, timeout=5)
+    merge = backend.merge
+
+    def merge_together(source, target, fast_forward_only=False):
+        if target in ("eu", "us"):
+            barrier.wait()
+        return merge(source, target, fast_forward_only)
+
+    backend.merge = merge_together
+    repo = str(tmp_path)
+    dev, eu, us, main = (branch(n, repo) for n in ("dev", "eu", "us", "main"))
+    pipeline = (dev > (eu, us) > main).compile()
+    engine = Engine(backend)
+
+    async def run():
+        return await engine.arun(await engine.astart(pipeline, "dev"))
+
+    assert asyncio.run(run()).phase is Phase.END
+    assert sorted(backend.merges[:2]) == [("dev", "eu"), ("dev", "us")]
+    assert sorted(backend.merges[2:]) == [("eu", "main"), ("us", "main")]
+    assert not engine.live and not engine.groups
+
+
+def test_arun_failing_fork_stops_the_other_walks(tmp_path, make_backend):
+    from glisse import combine
+
+    backend = make_backend("dev", "eu", "us", "qa")
+    failed = threading.Event()
+    merge = backend.merge
+
+    def merge_eu_fails(source, target, fast_forward_only=False):
+        if target == "eu" and not failed.is_set():
+            failed.set()
+            raise RuntimeError("eu is down")
+        if target == "us":
+            failed.wait(5)
+        return merge(source, target, fast_forward_only)
+
+    backend.merge = merge_eu_fails
+    repo = str(tmp_path)
+    dev, eu, us, qa = (branch(n, repo) for n in ("dev", "eu", "us", "qa"))
+    pipeline = combine(dev > eu, dev > us, us > qa)
+    engine = Engine(backend)
+
+    async def run():
+        p = await engine.astart(pipeline, "dev")
+        with pytest.raises(RuntimeError, match="eu is down"):
+            await engine.arun(p)
+        # The us walk was cancelled and does not go on to qa.
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert ("us", "qa") not in backend.merges
+    for q in list(engine.live.values()):
+        engine.run(q)
+    assert set(backend.merges) == {("dev", "eu"), ("dev", "us"), ("us", "qa")}
+    assert not engine.live and not engine.groups
+
+
+@pytest.mark.parametrize("checkpoint", [False, True])
+def test_recover_fan_out_with_forks_and_skips_in_flight(tmp_path, make_backend, checkpoint):
+    from glisse import combine, transition
+    from glisse.journal import Op
+
+    backend = make_backend("dev", "eu", "us", "ap", "main")
+    backend.touches = lambda base, commit, paths: False
+    repo = str(tmp_path)
+    dev, eu, us, ap, main = (branch(n, repo) for n in ("dev", "eu", "us", "ap", "main"))
+    pipeline = combine(
+        dev > transition(paths="docs/**") > eu, dev > us, dev > ap, eu > main, us > main, ap > main,
+    )
+    with Journal(tmp_path / "journal") as journal:
+        engine = Engine(backend, journal)
+        p = engine.step(engine.step(engine.start(pipeline, "dev")))
+        assert p.phase is Phase.MERGE and len(engine.live) == 2
+        if checkpoint:
+            engine.checkpoint()
+    with Journal(tmp_path / "journal") as journal:
+        if checkpoint:
+            records = {op for op, _ in journal.records(journal.snapshot_seq(), ".snap")}
+            assert {Op.GROUP, Op.JOIN} <= records
+        else:
+            records = {op for op, _ in journal.records(journal.seq)}
+            assert {Op.FORK, Op.SKIP} <= records
+        engine = Engine(backend, journal, [pipeline])
+        recovered = engine.recover()
+        assert sorted(q.id for q in recovered) == [p.id, p.id + 1]
+        for q in recovered:
+            engine.run(q)
+    assert sorted(backend.merges) == [("ap", "main"), ("dev", "ap"), ("dev", "us"), ("us", "main")]
+    assert not engine.live and not engine.groups
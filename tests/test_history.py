@@ -0,0 +1,57 @@
+import pytest
+
+from glisse.history import HistoryStore
+from glisse.oid import SHA256_SIZE
+
+
+def _oid(i):
+    return bytes([i]) * 20
+
+
+def test_cons_shares_the_tail():
+    store = HistoryStore()
+    base = store.nil.cons(_oid(1), "staging")
+    left = base.cons(_oid(2), "main")
+    right = base.cons(_oid(3), "prod")
+    assert len(store) == 3
+    assert left.tail.node == right.tail.node == base.node
+    assert [e.branch for e in left] == ["main", "staging"]
+    assert [e.branch for e in right] == ["prod", "staging"]
+    assert (len(base), len(left), len(store.nil)) == (1, 2, 0)
+    assert not store.nil and left
+    assert [e.branch for e in base] == ["staging"]
+
+
+def test_object_ids_are_raw_bytes_with_a_hex_view():
+    store = HistoryStore()
+    oid = bytes(range(20))
+    entry = store.nil.cons(oid, "main").head
+    assert entry.oid == oid
+    assert entry.hex == oid.hex()
+    assert tuple(entry) == (oid, "main")
+    assert repr(entry) == f"{oid.hex()[:7]}:main"
+    with pytest.raises(ValueError):
+        store.nil.cons(oid.hex().encode(), "main")
+
+    wide = HistoryStore(SHA256_SIZE)
+    oid = bytes(range(32))
+    assert wide.nil.cons(oid, "main").head.hex == oid.hex()
+    with pytest.raises(ValueError):
+        wide.nil.cons(bytes(20), "main")
+
+
+def test_compacted_keeps_only_the_given_histories_and_their_sharing():
+    store = HistoryStore()
+    trunk = store.nil.cons(_oid(1), "staging").cons(_oid(2), "main")
+    left = trunk.cons(_oid(3), "eu")
+    right = trunk.cons(_oid(4), "us")
+    for i in range(10):
+        store.nil.cons(_oid(10 + i), "dead")
+    assert len(store) == 14
+
+    new, (l2, r2) = store.compacted([left, right])
+    assert len(new) == 4
+    assert [tuple(e) for e in l2] == [tuple(e) for e in left]
+    assert [tuple(e) for e in r2] == [tuple(e) for e in right]
+    assert l2.tail.node == r2.tail.node
+    assert (len(l2), len(r2)) == (3, 3)
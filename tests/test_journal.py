@@ -0,0 +1,163 @@
+import os
+import threading
+
+import pytest
+
+from glisse.journal import Journal, JournalError, Op
+
+
+def test_records_survive_reopen(tmp_path):
+    with Journal(tmp_path) as j:
+        j.append(Op.START, b"one")
+        j.append(Op.END, b"two")
+    with Journal(tmp_path) as j:
+        assert list(j.replay()) == [(Op.START, b"one"), (Op.END, b"two")]
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    with Journal(tmp_path) as j:
+        j.append(Op.START, b"kept")
+        lsn = j.append(Op.END, b"torn")
+    path = os.path.join(tmp_path, "00000001.log")
+    with open(path, "r+b") as f:
+        f.truncate(lsn - 2)
+    with Journal(tmp_path) as j:
+        assert list(j.replay()) == [(Op.START, b"kept")]
+        j.append(Op.EFF, b"after")
+    with Journal(tmp_path) as j:
+        assert list(j.replay()) == [(Op.START, b"kept"), (Op.EFF, b"after")]
+
+
+def test_corrupt_record_ends_the_log(tmp_path):
+    with Journal(tmp_path) as j:
+        j.append(Op.START, b"kept")
+        j.append(Op.END, b"flipped")
+        j.append(Op.END, b"lost")
+    path = os.path.join(tmp_path, "00000001.log")
+    with open(path, "r+b") as f:
+        data = bytearray(f.read())
+        data[data.index(b"flipped")] ^= 0xFF
+        f.seek(0)
+        f.write(data)
+    with Journal(tmp_path) as j:
+        assert list(j.replay()) == [(Op.START, b"kept")]
+
+
+def test_group_commit_shares_fsyncs(tmp_path, monkeypatch):
+    calls = []
+    fsync = os.fsync
+    gate = threading.Event()
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        gate.wait(1)
+        fsync(fd)
+
+    with Journal(tmp_path) as j:
+        monkeypatch.setattr(os, "fsync", slow_fsync)
+
+        def writer(i):
+            j.sync(j.append(Op.EFFECT, b"%d" % i))
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+        monkeypatch.setattr(os, "fsync", fsync)
+        assert len(calls) < 16
+        assert sorted(p for _, p in j.replay()) == sorted(b"%d" % i for i in range(16))
+
+
+def test_append_during_flush_is_synced(tmp_path, monkeypatch):
+    fsync = os.fsync
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_fsync(fd):
+        entered.set()
+        release.wait(1)
+        fsync(fd)
+
+    with Journal(tmp_path) as j:
+        monkeypatch.setattr(os, "fsync", slow_fsync)
+        first = j.append(Op.START, b"x" * 1000)
+        leader = threading.Thread(target=j.sync, args=(first,))
+        leader.start()
+        entered.wait(1)
+        lsn = j.append(Op.END, b"y")
+        assert lsn > first
+        assert j.lsn == lsn
+        release.set()
+        leader.join(2)
+        monkeypatch.setattr(os, "fsync", fsync)
+        j.sync(lsn)
+        assert os.path.getsize(os.path.join(tmp_path, "00000001.log")) == lsn
+
+
+def test_failed_fsync_fails_the_journal(tmp_path, monkeypatch):
+    j = Journal(tmp_path)
+    lsn = j.append(Op.START, b"lost")
+
+    def broken(fd):
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(os, "fsync", broken)
+    with pytest.raises(JournalError):
+        j.sync(lsn)
+    monkeypatch.undo()
+    with pytest.raises(JournalError):
+        j.sync(lsn)
+    with pytest.raises(JournalError):
+        j.append(Op.END, b"more")
+    j.close()
+    with Journal(tmp_path) as j:
+        j.append(Op.END, b"next")
+    with Journal(tmp_path) as j:
+        records = list(j.replay())
+    assert records[-1] == (Op.END, b"next")
+
+
+def test_waiters_see_the_failure(tmp_path, monkeypatch):
+    j = Journal(tmp_path)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def broken(fd):
+        entered.set()
+        release.wait(1)
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(os, "fsync", broken)
+    errors = []
+
+    def sync(lsn):
+        try:
+            j.sync(lsn)
+        except JournalError as exc:
+            errors.append(exc)
+
+    leader = threading.Thread(target=sync, args=(j.append(Op.START, b"a"),))
+    leader.start()
+    entered.wait(1)
+    waiter = threading.Thread(target=sync, args=(j.append(Op.START, b"b"),))
+    waiter.start()
+    release.set()
+    leader.join(2)
+    waiter.join(2)
+    assert not leader.is_alive() and not waiter.is_alive()
+    assert len(errors) == 2
+    monkeypatch.undo()
+    j.close()
+
+
+def test_rotate_and_retire(tmp_path):
+    with Journal(tmp_path) as j:
+        j.append(Op.START, b"old")
+        seq = j.rotate()
+        j.append(Op.START, b"new")
+        j.write_snapshot(seq, [(Op.SNAPSHOT, b"snap")])
+        j.retire(seq)
+        assert j.segments() == [seq]
+        assert list(j.replay()) == [(Op.SNAPSHOT, b"snap"), (Op.START, b"new")]
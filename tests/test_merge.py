@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from glisse.git import CatFilePool, MergeConflict, Repository
+from glisse.git.merge import merge3, merge_trees
+
+LINES = "".join(f"line {i}\n" for i in range(20))
+
+
+def _edit(text, i, new):
+    lines = text.splitlines(keepends=True)
+    lines[i] = new
+    return "".join(lines)
+
+
+# name: (base, ours, theirs) as file maps; ``None`` deletes a file.
+CASES = {
+    "different files": ({"a": "a\n", "b": "b\n"}, {"a": "A\n"}, {"b": "B\n"}),
+    "same file, separate hunks": (
+        {"f": LINES}, {"f": _edit(LINES, 2, "ours\n")}, {"f": _edit(LINES, 15, "theirs\n")}
+    ),
+    "same change on both sides": ({"f": LINES}, {"f": "x\n" + LINES}, {"f": "x\n" + LINES}),
+    "conflicting hunks": (
+        {"f": LINES}, {"f": _edit(LINES, 5, "ours\n")}, {"f": _edit(LINES, 5, "theirs\n")}
+    ),
+    "mode change and content change": (
+        {"f": LINES}, {"f": (LINES, 0o755)}, {"f": _edit(LINES, 3, "theirs\n")}
+    ),
+    "delete and keep": ({"a": "a\n", "b": "b\n"}, {"a": None}, {"b": "B\n"}),
+    "delete on both sides": ({"a": "a\n", "b": "b\n"}, {"a": None}, {"a": None, "b": "B\n"}),
+    "delete and modify": ({"a": LINES, "b": "b\n"}, {"a": None}, {"a": _edit(LINES, 1, "x\n")}),
+    "subtree additions": (
+        {"d/a": "a\n"}, {"d/x": "x\n", "d/e/y": "y\n"}, {"d/z": "z\n", "d/e/w": "w\n"}
+    ),
+    "subtree edits in one file": (
+        {"d/e/f": LINES}, {"d/e/f": _edit(LINES, 0, "o\n")}, {"d/e/f": _edit(LINES, 19, "t\n")}
+    ),
+    "file against directory": ({"a": "a\n"}, {"d": "file\n"}, {"d/f": "in dir\n"}),
+    "add/add identical": ({"a": "a\n"}, {"n": "same\n"}, {"n": "same\n"}),
+    "add/add different": ({"a": "a\n"}, {"n": "ours\n"}, {"n": "theirs\n"}),
+    "binary on both sides": ({"b": b"\0\1\2"}, {"b": b"\0\1\3"}, {"b": b"\0\1\4"}),
+    "directory deleted against modified": (
+        {"d/a": LINES, "d/b": "b\n"}, {"d/a": None, "d/b": None}, {"d/a": _edit(LINES, 4, "x\n")}
+    ),
+}
+
+
+@pytest.mark.parametrize("objects", ["native", "cat-file"])
+@pytest.mark.parametrize("name", CASES)
+def test_merge_trees_matches_git(git, monkeypatch, name, objects):
+    base, ours, theirs = CASES[name]
+    git.commit("base", base)
+    git("checkout", "-q", "-b", "theirs")
+    git.commit("theirs", theirs)
+    git("checkout", "-q", "main")
+    git.commit("ours", ours)
+    expected = git.run("merge-tree", "--write-tree", "--no-messages", "main", "theirs")
+    repo = Repository(git.path, objects, cache=None)
+    try:
+        ours_c, theirs_c = repo.tip("main"), repo.tip("theirs")
+        base_c = repo.merge_base(ours_c, theirs_c)
+        args = (repo.objects, repo.tree(base_c), repo.tree(ours_c), repo.tree(theirs_c))
+        if objects == "cat-file":
+            # Every lookup of the merge itself is pipelined through ``read_many``.
+            monkeypatch.setattr(CatFilePool, "read", None)
+        if expected.returncode:
+            with pytest.raises(MergeConflict):
+                merge_trees(*args)
+        else:
+            assert merge_trees(*args).hex() == expected.stdout.decode().split()[0]
+    finally:
+        repo.close()
+
+
+def test_conflict_lists_every_path(git):
+    git.commit("base", {"a": LINES, "d/b": LINES})
+    git("checkout", "-q", "-b", "theirs")
+    git.commit("theirs", {"a": _edit(LINES, 0, "t\n"), "d/b": _edit(LINES, 1, "t\n")})
+    git("checkout", "-q", "main")
+    git.commit("ours", {"a": _edit(LINES, 0, "o\n"), "d/b": _edit(LINES, 1, "o\n")})
+    repo = Repository(git.path, cache=None)
+    try:
+        ours, theirs = repo.tip("main"), repo.tip("theirs")
+        base = repo.merge_base(ours, theirs)
+        with pytest.raises(MergeConflict) as err:
+            merge_trees(repo.objects, repo.tree(base), repo.tree(ours), repo.tree(theirs))
+        assert err.value.paths == [b"a", b"d/b"]
+    finally:
+        repo.close()
+
+
+def _mutate(rng, lines):
+    lines = list(lines)
+    for _ in range(rng.randint(1, 3)):
+        op = rng.choice("idr")
+        i = rng.randrange(len(lines) + 1)
+        if op == "i":
+            lines.insert(i, f"new {rng.randrange(5)}\n")
+        elif lines and i < len(lines):
+            if op == "d":
+                del lines[i]
+            else:
+                lines[i] = f"changed {rng.randrange(5)}\n"
+    return lines
+
+
+def test_merge3_agrees_with_git_merge_file(git):
+    rng = random.Random(1234)
+    for case in range(200):
+        base = [f"line {i}\n" for i in range(rng.randint(0, 12))]
+        texts = ["".join(base), "".join(_mutate(rng, base)), "".join(_mutate(rng, base))]
+        git.write({"base": texts[0], "ours": texts[1], "theirs": texts[2]})
+        expected = git.run("merge-file", "-p", "ours", "base", "theirs")
+        merged = merge3(*(t.encode() for t in texts))
+        if expected.returncode:
+            assert merged is None, (case, texts)
+        else:
+            assert merged == expected.stdout, (case, texts)
@@ -0,0 +1,137 @@
+import pytest
+
+from glisse import PipelineError, branch, combine, transition
+
+
+def test_chained_comparison_builds_one_chain():
+    dev, staging, main = branch("dev"), branch("staging"), branch("main")
+    chain = dev > staging > main
+    assert chain.items == (dev, staging, main)
+    pipeline = (dev > transition() > staging > main).compile()
+    assert pipeline.name == "dev>staging>main"
+
+
+def test_separate_statements_build_separate_chains():
+    dev, staging, main = branch("dev"), branch("staging"), branch("main")
+    first = dev > staging
+    second = staging > main
+    assert first.items == (dev, staging)
+    assert second.items == (staging, main)
+    chains = [a > b for a, b in ((dev, staging), (staging, main))]
+    assert [c.items for c in chains] == [(dev, staging), (staging, main)]
+    assert combine(*chains).name == "dev>staging;staging>main"
+
+
+def test_truth_tests_do_not_extend_chains():
+    dev, staging, main = branch("dev"), branch("staging"), branch("main")
+    x = dev > staging
+    if x:
+        y = staging > main
+    assert y.items == (staging, main)
+    assert x
+    y = staging > main
+    assert y.items == (staging, main)
+    z = (dev > staging) and (staging > main)
+    assert z.items == (staging, main)
+
+
+def test_truth_test_does_not_keep_its_frame_alive():
+    import weakref
+
+    class Local:
+        pass
+
+    def build():
+        local = Local()
+        assert branch("dev") > branch("staging")
+        return weakref.ref(local)
+
+    assert build()() is None
+
+
+@pytest.mark.parametrize("flag", ["-Xno_debug_ranges", "-Xdev"])
+def test_without_column_positions_ambiguous_chains_raise(flag):
+    import subprocess
+    import sys
+
+    script = """
+from glisse import PipelineError, branch
+dev, staging, main = branch("dev"), branch("staging"), branch("main")
+assert ((dev > staging) > main).items == (dev, staging, main)
+x = dev > staging
+y = staging > main
+assert y.items == (staging, main)
+try:
+    z = (dev > staging) and (staging > main)
+except PipelineError:
+    print("raised")
+else:
+    print(z.items == (staging, main))
+"""
+    out = subprocess.run([sys.executable, flag, "-c", script], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ("raised" if flag == "-Xno_debug_ranges" else "True")
+
+
+def test_long_chains_with_calls_in_between():
+    dev, staging = branch("dev"), branch("staging")
+    chain = dev > transition(fast_forward_only=True) > staging > branch("main") > branch("prod")
+    assert [getattr(i, "name", None) for i in chain.items] == [
+        "dev", None, "staging", "main", "prod",
+    ]
+
+
+def test_explicit_parentheses():
+    dev, staging, main = branch("dev"), branch("staging"), branch("main")
+    chain = (dev > staging) > main
+    assert chain.items == (dev, staging, main)
+
+
+def test_fan_out_and_in():
+    dev, eu, us, main = branch("dev"), branch("eu"), branch("us"), branch("main")
+    pipeline = (dev > (eu, us) > main).compile()
+    assert pipeline.name == "dev>(eu,us)>main"
+    assert pipeline.successors("dev") == (eu, us)
+    assert pipeline.predecessors("main") == (eu, us)
+
+
+def test_compile_reports_every_problem():
+    a, b, c = branch("a"), branch("b"), branch("c")
+    with pytest.raises(PipelineError) as err:
+        combine(a > b, b > c, c > b, a > transition(fast_forward_only=True) > b)
+    problems = err.value.problems
+    assert any("cycle" in p for p in problems)
+    assert any("conflicting" in p for p in problems)
+
+
+def test_branches_with_hooks_outlive_their_statement():
+    import gc
+
+    def bump(ctx):
+        pass
+
+    branch("staging", "hooked").when_merged(bump)
+    branch("other", "hooked")
+    gc.collect()
+    assert [h.fn for h in branch("staging", "hooked").hooks] == [bump]
+    assert branch("other", "hooked").hooks == ()
+
+
+def test_compile_reports_structural_problems_together():
+    a, b, c = branch("p1"), branch("p2"), branch("p3")
+    x, y, z = branch("q1"), branch("q2"), branch("q3")
+    releases = branch("release/*")
+    with pytest.raises(PipelineError) as err:
+        combine(
+            a > b,
+            a > branch("p2", "elsewhere"),
+            x > y,
+            y > x,
+            y > z,
+            c > releases,
+        )
+    problems = err.value.problems
+    assert any("duplicate branch 'p2'" in p for p in problems)
+    assert "cycle through q1, q2" in problems
+    assert "unreachable stages q3" in problems
+    assert "pattern stage 'release/*' can only start a pipeline" in problems
+    assert len(problems) == 4
@@ -0,0 +1,244 @@
+import os
+
+import pytest
+
+from glisse.git import RefConflict, RefError, RefSnapshot, RefTransaction
+
+
+def _setup(git):
+    """``main`` and ``dev`` one commit apart; returns their tips."""
+    first = git.commit("init", {"a": "1"})
+    git("branch", "dev")
+    second = git.commit("second", {"a": "2"})
+    return second, first
+
+
+def _git_dir(git):
+    return os.path.join(git.path, ".git")
+
+
+def _locks(git_dir):
+    return [f for _, _, files in os.walk(git_dir) for f in files if f.endswith(".lock")]
+
+
+def test_conflict_changes_nothing(git):
+    main, dev = _setup(git)
+    git_dir = _git_dir(git)
+    tx = RefTransaction(git_dir)
+    tx.update("refs/heads/dev", main, dev)
+    tx.update("refs/heads/main", dev, dev)
+    with pytest.raises(RefConflict):
+        tx.commit()
+    assert git("rev-parse", "dev", "main").split() == [dev.hex(), main.hex()]
+    assert _locks(git_dir) == []
+
+
+def test_rollback_on_error_releases_every_lock(git):
+    main, dev = _setup(git)
+    git_dir = _git_dir(git)
+    with pytest.raises(ZeroDivisionError):
+        with RefTransaction(git_dir) as tx:
+            tx.update("refs/heads/dev", main, dev)
+            tx.update("refs/tags/v1", main, None)
+            1 / 0
+    assert git("rev-parse", "dev").split() == [dev.hex()]
+    assert git.run("rev-parse", "--verify", "-q", "v1").returncode
+    assert _locks(git_dir) == []
+
+    tx = RefTransaction(git_dir)
+    tx.update("refs/heads/dev", main, dev)
+    tx.update("refs/heads/main/sub", main, None)
+    with pytest.raises(RefError):
+        tx.commit()
+    assert git("rev-parse", "dev").split() == [dev.hex()]
+    assert _locks(git_dir) == []
+
+
+def test_updates_leave_packed_refs_alone(git):
+    main, dev = _setup(git)
+    git("tag", "v1", "dev")
+    git("pack-refs", "--all")
+    git_dir = _git_dir(git)
+    packed = os.path.join(git_dir, "packed-refs")
+    with open(packed, "rb") as f:
+        before = f.read()
+    snapshot = RefSnapshot(git_dir)
+    with RefTransaction(git_dir, snapshot) as tx:
+        tx.update("refs/heads/dev", main, dev)
+        tx.update("refs/tags/v2", main, None)
+    with open(packed, "rb") as f:
+        assert f.read() == before
+    assert os.path.isfile(os.path.join(git_dir, "refs", "heads", "dev"))
+    assert git("rev-parse", "dev", "v1", "v2").split() == [main.hex(), dev.hex(), main.hex()]
+
+    # A ref both packed and loose is deleted from both.
+    with RefTransaction(git_dir, snapshot) as tx:
+        tx.update("refs/heads/dev", None, main)
+        tx.update("refs/tags/v1", None, dev)
+    assert git.run("rev-parse", "--verify", "-q", "dev").returncode
+    assert git.run("rev-parse", "--verify", "-q", "v1").returncode
+    assert git("rev-parse", "main", "v2").split() == [main.hex(), main.hex()]
+    git("fsck", "--strict")
+
+
+def test_prepared_updates_are_invisible_and_locked_until_commit(git):
+    main, dev = _setup(git)
+    git_dir = _git_dir(git)
+    tx = RefTransaction(git_dir)
+    tx.update("refs/heads/dev", main, dev)
+    tx.update("refs/heads/main", dev, main)
+    tx.prepare()
+    assert git("rev-parse", "dev", "main").split() == [dev.hex(), main.hex()]
+    assert git.run("update-ref", "refs/heads/main", main.hex(), main.hex()).returncode
+    with pytest.raises(RefError):
+        with RefTransaction(git_dir) as other:
+            other.update("refs/heads/dev", main, dev)
+    tx.commit()
+    assert git("rev-parse", "dev", "main").split() == [main.hex(), dev.hex()]
+    assert _locks(git_dir) == []
+
+
+def test_snapshot_sees_changes_made_by_git(git):
+    main, dev = _setup(git)
+    snapshot = RefSnapshot(_git_dir(git))
+    assert snapshot.get("refs/heads/dev") == dev
+    git("update-ref", "refs/heads/dev", main.hex())
+    assert snapshot.get("refs/heads/dev") == main
+    git("branch", "release/1", dev.hex())
+    assert snapshot.get("refs/heads/release/1") == dev
+    assert snapshot.trie().match("release/*") == ["release/1"]
+    git("pack-refs", "--all")
+    git("branch", "-D", "release/1")
+    assert snapshot.get("refs/heads/release/1") is None
+    assert snapshot.trie().match("**") == ["dev", "main"]
+
+
+def test_snapshot_applies_own_transactions_in_place(git, monkeypatch):
+    from glisse.git import refs
+
+    main, dev = _setup(git)
+    for i in range(10):
+        git("branch", f"team{i}/feature", dev.hex())
+    git_dir = _git_dir(git)
+    snapshot = RefSnapshot(git_dir)
+    assert snapshot.trie().match("*/feature") == [f"team{i}/feature" for i in range(10)]
+    loads = []
+    load = snapshot._load
+    monkeypatch.setattr(snapshot, "_load", lambda: loads.append(1) or load())
+    with RefTransaction(git_dir, snapshot) as tx:
+        tx.update("refs/heads/dev", main, dev)
+        tx.update("refs/heads/team3/feature", None, dev)
+        tx.update("refs/heads/new/branch", main, None)
+    assert snapshot.get("refs/heads/dev") == main
+    assert snapshot.get("refs/heads/new/branch") == main
+    assert snapshot.get("refs/heads/team3/feature") is None
+    assert "team3/feature" not in snapshot.trie().match("*/feature")
+    assert snapshot.trie().match("new/*") == ["new/branch"]
+    assert loads == []
+
+    # A lookup stats packed-refs and the directories on the way to the branch.
+    stamped = []
+    stamp = refs._stamp
+    monkeypatch.setattr(refs, "_stamp", lambda path: stamped.append(path) or stamp(path))
+    assert snapshot.get("refs/heads/team4/feature") == dev
+    assert len(stamped) == 3
+    assert loads == []
+
+
+def test_snapshot_rereads_only_what_git_changed(git, monkeypatch):
+    from glisse.git import refs
+
+    main, dev = _setup(git)
+    for i in range(10):
+        git("branch", f"team{i}/feature", dev.hex())
+    git("pack-refs", "--all")
+    for i in range(10):
+        git("branch", f"team{i}/loose", dev.hex())
+    snapshot = RefSnapshot(_git_dir(git))
+    trie = snapshot.trie()
+    assert len(trie) == 22
+    loads, reads = [], []
+    load = snapshot._load
+    monkeypatch.setattr(snapshot, "_load", lambda: loads.append(1) or load())
+    read = refs.read_ref
+    monkeypatch.setattr(refs, "read_ref", lambda git_dir, name, packed=None: reads.append(name) or read(git_dir, name, packed))
+
+    git("update-ref", "refs/heads/team3/loose", main.hex())
+    git("branch", "team3/new", main.hex())
+    git("branch", "-D", "team5/loose")
+    git("branch", "fresh/one", main.hex())
+    assert snapshot.trie() is trie
+    assert trie.match("team3/*") == ["team3/feature", "team3/loose", "team3/new"]
+    assert trie.match("team5/*") == ["team5/feature"]
+    assert trie.match("fresh/*") == ["fresh/one"]
+    assert sorted(reads) == ["refs/heads/fresh/one", "refs/heads/team3/loose", "refs/heads/team3/new"]
+    assert snapshot.get("refs/heads/team3/loose") == main
+
+    # A rewritten packed-refs is compared with the last one.
+    reads.clear()
+    git("branch", "-D", "team7/feature")
+    git("pack-refs", "--all")
+    assert snapshot.trie() is trie
+    assert "team7/feature" not in trie.match("*/feature")
+    assert reads == []
+    assert loads == []
+    assert snapshot.refs() == _for_each_ref(git)
+
+
+def test_snapshot_follows_random_ref_changes(git):
+    import random
+
+    main, dev = _setup(git)
+    rng = random.Random(4)
+    names = [f"{a}/{b}" for a in ("x", "y", "x/z") for b in ("p", "q", "r")] + ["s", "t"]
+    snapshot = RefSnapshot(_git_dir(git))
+    for _ in range(60):
+        name = rng.choice(names)
+        action = rng.random()
+        if action < 0.5:
+            git("branch", "-f", name, rng.choice((main, dev)).hex())
+        elif action < 0.8:
+            git.run("branch", "-D", name)
+        elif action < 0.9:
+            git("pack-refs", "--all")
+        else:
+            git("pack-refs", "--all", "--prune")
+        if rng.random() < 0.5:
+            assert snapshot.get(f"refs/heads/{name}") == _for_each_ref(git).get(f"refs/heads/{name}")
+        else:
+            refs = _for_each_ref(git)
+            assert snapshot.refs() == refs
+            heads = sorted(n[11:] for n in refs if n.startswith("refs/heads/"))
+            assert snapshot.trie().match("**") == heads
+
+
+def _for_each_ref(git):
+    out = git("for-each-ref", "--format=%(objectname) %(refname)")
+    return {name: bytes.fromhex(oid) for oid, name in (line.split() for line in out.splitlines())}
+
+
+def test_ref_trie_patterns():
+    from glisse.git import RefTrie
+
+    trie = RefTrie([
+        "main", "release/1", "release/2", "release/10", "release/1/hotfix",
+        "feature/a/x", "feature/b/c/x", "x",
+    ])
+    assert len(trie) == 8
+    assert trie.match("release/*") == ["release/1", "release/10", "release/2"]
+    assert trie.match("release/?") == ["release/1", "release/2"]
+    assert trie.match("release/??") == ["release/10"]
+    assert trie.match("release/**") == [
+        "release/1", "release/1/hotfix", "release/10", "release/2",
+    ]
+    assert trie.match("**/x") == ["feature/a/x", "feature/b/c/x", "x"]
+    assert trie.match("feature/**/x") == ["feature/a/x", "feature/b/c/x"]
+    assert trie.match("m?i*") == ["main"]
+    assert trie.match("release/3") == []
+    assert trie.match("main") == ["main"]
+    trie.discard("feature/b/c/x")
+    trie.discard("nothing/here")
+    assert trie.match("feature/**") == ["feature/a/x"]
+    assert "b" not in trie._root.children["feature"].children
+    trie.add("feature/b")
+    assert trie.match("feature/*") == ["feature/b"] and len(trie) == 8
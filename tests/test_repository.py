@@ -0,0 +1,105 @@
+import pytest
+
+from glisse import Engine, branch
+from glisse.git import Repository
+
+
+def test_plain_stages_see_branch_moves(git):
+    git.commit("init", {"a": "1"})
+    git("branch", "dev")
+    dev = branch("dev")
+    seen = []
+    pipeline = (dev > branch("main")).compile()
+    pipeline.watch(lambda pipeline, stage: seen.append(stage.name))
+    repo = Repository(git.path)
+    tip = repo.tip("dev")
+    assert (dev.tip, dev.moves) == (tip, 1)
+    repo.tip("dev")
+    assert dev.moves == 1
+    assert seen == ["dev"]
+    repo.close()
+
+
+def test_repository_and_path_name_the_same_stage(git):
+    git.commit("init")
+    repo = Repository(git.path)
+    assert branch("main", repo) is branch("main", git.path)
+    assert branch("main", repo) is branch("main", repo.git_dir)
+    assert branch("main", repo) is not branch("main")
+    repo.close()
+
+
+def test_merges_counts_only_merges_that_moved_the_target(git):
+    git.commit("init", {"a": "1"})
+    git("branch", "dev")
+    git("checkout", "-q", "dev")
+    git.commit("change", {"a": "2"})
+    repo = Repository(git.path)
+    dev, main = branch("dev", repo), branch("main", repo)
+    pipeline = (dev > main).compile("counted")
+    engine = Engine(repo)
+    engine.run(engine.start(pipeline, "dev"))
+    assert main.merges == 1
+    engine.run(engine.start(pipeline, "dev"))
+    assert main.merges == 1
+    repo.close()
+
+
+def test_pending_by_stage_expands_patterns(git):
+    from glisse.git import pending_by_stage
+
+    git.commit("init", {"a": "1"})
+    for name, files in (("release/1", {"b": "1"}), ("release/2", {"c": "1"})):
+        git("checkout", "-q", "-b", name, "main")
+        git.commit(name, files)
+    git("checkout", "-q", "-b", "release/3", "release/2")
+    git("checkout", "-q", "main")
+    repo = Repository(git.path)
+    pipeline = (branch("release/*", repo) > branch("main", repo)).compile()
+    assert pending_by_stage(repo, pipeline) == {("release/*", "main"): 2}
+    repo.close()
+
+
+def _objects(git):
+    return {
+        line.split(": ")[0]: line.split(": ")[1]
+        for line in git("count-objects", "-v").splitlines()
+    }
+
+
+def test_fast_forward_writes_no_objects_and_moves_only_the_branch(git):
+    git.commit("init", {"a": "1"})
+    git("checkout", "-q", "-b", "dev")
+    tip = git.commit("change", {"a": "2"})
+    before = _objects(git)
+    repo = Repository(git.path)
+    try:
+        assert repo.merge("dev", "main", fast_forward_only=True) == tip
+    finally:
+        repo.close()
+    assert _objects(git)["count"] == before["count"]
+    assert git("rev-parse", "main") == tip.hex()
+    assert git("for-each-ref", "refs/glisse") == ""
+
+
+def test_fast_forward_only_refuses_diverged_branches(git):
+    from glisse.git import NotFastForward
+
+    git.commit("init", {"a": "1"})
+    git("branch", "dev")
+    main = git.commit("on main", {"b": "1"})
+    git("checkout", "-q", "dev")
+    git.commit("on dev", {"c": "1"})
+    before = _objects(git)
+    repo = Repository(git.path)
+    try:
+        with pytest.raises(NotFastForward):
+            repo.merge("dev", "main", fast_forward_only=True)
+        assert _objects(git)["count"] == before["count"]
+        assert git("rev-parse", "main") == main.hex()
+        merged = repo.merge("dev", "main")
+    finally:
+        repo.close()
+    assert git("rev-parse", "main", "refs/glisse/promoted/main").split() == [
+        merged.hex(), git("rev-parse", "dev"),
+    ]
@@ -0,0 +1,161 @@
+import os
+import zlib
+
+import pytest
+
+from glisse.git import CatFilePool, MissingObject, ObjectStore
+from glisse.git.cache import CachedObjects, ObjectCache
+from glisse.git.objects import OBJ_BLOB, TYPE_IDS
+
+
+def _history(git, revisions=30):
+    """Commits that rewrite a few files slightly, so packing makes delta chains."""
+    text = "".join(f"line {i} of a file long enough to be worth deltifying\n" for i in range(200))
+    for i in range(revisions):
+        text = text.replace(f"line {i} ", f"line {i} (edited) ", 1)
+        git.commit(f"rev {i}", {"big": text, f"dir/small{i % 3}": f"{i}\n"})
+
+
+def _all_objects(git):
+    """``{oid: (type, content)}`` for every object, as git reads them."""
+    data = git.run("cat-file", "--batch-all-objects", "--batch").stdout
+    out, pos = {}, 0
+    while pos < len(data):
+        end = data.index(b"\n", pos)
+        oid, kind, size = data[pos:end].split()
+        start = end + 1
+        out[bytes.fromhex(oid.decode())] = (TYPE_IDS[kind], data[start:start + int(size)])
+        pos = start + int(size) + 1
+    return out
+
+
+@pytest.mark.parametrize("layout", ["loose", "packed", "deep deltas", "mixed"])
+def test_reads_every_object_like_git(git, layout):
+    _history(git)
+    if layout == "packed":
+        git("repack", "-adq")
+    elif layout == "deep deltas":
+        git("repack", "-adfq", "--depth=50", "--window=50")
+    elif layout == "mixed":
+        git("repack", "-adq")
+        git.commit("after repack", {"big": "rewritten\n"})
+    expected = _all_objects(git)
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    try:
+        for oid, (kind, content) in expected.items():
+            got_kind, got = store.read(oid)
+            assert (got_kind, bytes(got)) == (kind, content), oid.hex()
+            assert oid in store
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("backend", ["native", "cat-file", "cached"])
+def test_read_many(git, backend):
+    _history(git, revisions=5)
+    git("repack", "-adq")
+    git.commit("loose", {"big": "rewritten\n"})
+    expected = _all_objects(git)
+    git_dir = os.path.join(git.path, ".git")
+    if backend == "native":
+        objects = ObjectStore(git_dir)
+    elif backend == "cat-file":
+        objects = CatFilePool(git_dir)
+    else:
+        objects = CachedObjects(ObjectStore(git_dir), ObjectCache())
+        objects.read(next(iter(expected)))
+    try:
+        oids = list(expected)
+        oids.insert(len(oids) // 2, b"\x12" * 20)
+        found = objects.read_many(oids)
+        assert found[len(oids) // 2] is None
+        del oids[len(oids) // 2], found[len(found) // 2]
+        assert [(kind, bytes(data)) for kind, data in found] == [expected[oid] for oid in oids]
+    finally:
+        objects.close()
+
+
+def test_packs_use_deltas(git):
+    _history(git)
+    git("repack", "-adfq", "--depth=50", "--window=50")
+    verify = git("verify-pack", "-v", *_idx_files(git))
+    assert any(len(line.split()) == 7 for line in verify.splitlines())
+
+
+def _idx_files(git):
+    pack_dir = os.path.join(git.path, ".git", "objects", "pack")
+    return [os.path.join(pack_dir, f) for f in os.listdir(pack_dir) if f.endswith(".idx")]
+
+
+def test_missing_object(git):
+    git.commit("init", {"a": "1"})
+    git("repack", "-adq")
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    try:
+        with pytest.raises(MissingObject):
+            store.read(b"\x12" * 20)
+        assert b"\x12" * 20 not in store
+    finally:
+        store.close()
+
+
+def test_picks_up_packs_written_later(git):
+    git.commit("init", {"a": "1"})
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    try:
+        oid = git.commit("later", {"a": "2"})
+        git("repack", "-adq")
+        git("prune-packed")
+        assert store.commit(oid).parents
+    finally:
+        store.close()
+
+
+def test_written_objects_are_valid_for_git(git):
+    git.commit("init")
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    try:
+        oid = store.write(OBJ_BLOB, b"written by glisse\n")
+    finally:
+        store.close()
+    assert oid.hex() == git("hash-object", "--stdin", input=b"written by glisse\n")
+    assert git("cat-file", "-p", oid.hex()) == "written by glisse"
+    git("fsck", "--strict")
+
+
+def test_reads_from_a_large_pack_feed_zlib_only_the_entry(git, monkeypatch):
+    from glisse.git import pack
+
+    blobs = []
+    for i in range(8):
+        commit = git.commit(f"blob {i}", {f"blob{i}": os.urandom(1 << 20)})
+        blobs.append((commit, bytes.fromhex(git("rev-parse", f"HEAD:blob{i}"))))
+    git("repack", "-adq")
+    fed = []
+    decompressobj = zlib.decompressobj
+
+    class Decompress:
+        def __init__(self):
+            self._d = decompressobj()
+
+        def decompress(self, data, *args):
+            fed.append(len(data))
+            return self._d.decompress(data, *args)
+
+        def __getattr__(self, name):
+            return getattr(self._d, name)
+
+    monkeypatch.setattr(pack.zlib, "decompressobj", Decompress)
+    store = ObjectStore(os.path.join(git.path, ".git"))
+    try:
+        for commit, blob in blobs:
+            fed.clear()
+            store.commit(commit)
+            assert sum(fed) < 1024
+            fed.clear()
+            kind, data = store.read(blob)
+            assert kind == OBJ_BLOB and len(data) == 1 << 20
+            assert sum(fed) < (1 << 20) + 2 * pack._CHUNK
+    finally:
+        store.close()
+